@@ -1,10 +1,121 @@
-from flask import Flask, jsonify, request
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import Flask, Response, g, jsonify, make_response, request
 from flask_cors import CORS
+import bulk_import
+import db_pool
 import db_utils
+import exports
+import metrics
+import serialization
+import trending
+
+# Seconds clients and the CDN may reuse a catalog response before revalidating
+HTTP_MAX_AGE = int(os.environ.get("APPSTORE_HTTP_MAX_AGE", 0))
+# Ids accepted by one /api/apps/batch call. The query has no limit of its own
+# (the ids are one JSON parameter), this bounds the response size.
+MAX_BATCH_IDS = int(os.environ.get("APPSTORE_MAX_BATCH_IDS", 500))
+# Largest page a cursor request gets, bigger limits are cut down to it
+MAX_PAGE_SIZE = 100
+
+# Database stats exported on /metrics: (prefix, stats function, keys that are counters)
+POOL_COUNTERS = {"created", "reused", "closed", "health_check_failures"}
+METRICS_COLLECTORS = [
+    ("appstore_db_pool", db_utils.get_pool_stats, POOL_COUNTERS),
+    ("appstore_db_read_pool", db_utils.get_read_pool_stats, POOL_COUNTERS),
+    ("appstore_write_queue", db_utils.get_write_queue_stats,
+     {"submitted", "completed", "failed", "rejected", "timed_out"}),
+    ("appstore_group_commit", db_utils.get_group_commit_stats,
+     {"submitted", "committed", "batches", "failed", "rejected"}),
+    ("appstore_db_write", db_utils.get_busy_retry_stats,
+     {"busy", "retried", "recovered", "gave_up", "errors"}),
+    ("appstore_details_cache", db_utils.get_details_cache_stats,
+     {"hits", "misses", "evictions", "expirations", "invalidations", "stale_puts"}),
+    ("appstore_top_charts", db_utils.get_top_chart_stats,
+     {"hits", "builds", "refreshes", "checks", "not_materialized"}),
+    ("appstore_recommendations", db_utils.get_recommendation_stats,
+     {"builds", "events", "updates", "rows_updated", "errors"}),
+    ("appstore_trending", db_utils.get_trending_stats, {"events", "refreshes", "errors"}),
+    ("appstore_event_compaction", db_utils.get_event_compaction_stats,
+     {"compactions", "compacted_events", "errors"}),
+]
 
 app = Flask(__name__)
+app.json = serialization.FastJSONProvider(app)
+request_metrics = metrics.RequestMetrics(METRICS_COLLECTORS)
+request_metrics.install(app)  # Before compression, so it records compressed sizes
+app.after_request(serialization.compress_response)
+# Started per worker on its first request, never in a forking master
+app.before_request(db_utils.start_event_compaction)
 CORS(app)  # Enable CORS for Next.js development
 
+def conditional(*tables):
+    """Answer If-None-Match / If-Modified-Since from table versions alone.
+
+    The ETag hashes the request path and arguments with the change counters
+    of the tables the view reads, so a 304 is decided before the view runs
+    its queries or serializes anything. When which tables those are depends
+    on the arguments, pass one function returning them instead.
+
+    A view that answers from a snapshot (a top chart, cached app details)
+    sets g.served_version to the version it was taken at. If that isn't
+    the current version the response goes out without validators, a tag
+    for the current version must never stand for older content.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            read = tables[0]() if len(tables) == 1 and callable(tables[0]) else tables
+            version, changed_at = db_utils.get_data_version(read)
+            if version is None:
+                return view(*args, **kwargs)
+
+            key = f"{request.path}?{urlencode(sorted(request.args.items(multi=True)))}|{version}"
+            etag = hashlib.blake2b(key.encode("utf-8"), digest_size=12).hexdigest()
+            last_modified = datetime.fromtimestamp(int(changed_at), timezone.utc)
+
+            if request.if_none_match:
+                # The client may hold the tag of a compressed variant
+                matched = next((tag for tag in serialization.etag_variants(etag)
+                                if request.if_none_match.contains(tag)), None)
+            elif request.if_modified_since is not None and last_modified <= request.if_modified_since:
+                matched = etag
+            else:
+                matched = None
+            if matched:
+                response = make_response("", 304)
+                response.set_etag(matched)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if g.get('served_version', version) != version:
+                    return response
+                response.set_etag(etag)
+
+            # Last-Modified has one second resolution, only hand it out once
+            # no later write can land in the same second
+            if time.time() - changed_at >= 1:
+                response.last_modified = last_modified
+            response.cache_control.public = True
+            response.cache_control.max_age = HTTP_MAX_AGE
+            response.cache_control.must_revalidate = True
+            return response
+        return wrapper
+    return decorator
+
+@app.errorhandler(db_pool.DatabaseOverloaded)
+def database_overloaded(e):
+    # Transient: the writer is backed up, tell the client to retry shortly
+    response = jsonify({"error": "Service busy, please retry", "detail": str(e)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @app.route('/')
 def index():
     return jsonify({
@@ -12,6 +123,9 @@ def index():
         "message": "Welcome to the App Store API",
         "endpoints": [
             "/health",
+            "/health/live",
+            "/health/ready",
+            "/metrics",
             "/api/apps",
             "/api/apps/<id>",
             "/api/search?q=<query>",
@@ -23,12 +137,50 @@ def index():
 def health_check():
     conn = db_utils.get_db_connection()
     if conn:
-        conn.close()
-        return jsonify({"status": "healthy", "database": "connected"}), 200
+        db_utils.release_db_connection(conn)
+        return jsonify({
+            "status": "healthy",
+            "database": "connected",
+            "pool": db_utils.get_pool_stats(),
+            "write_queue": db_utils.get_write_queue_stats(),
+            "busy_retry": db_utils.get_busy_retry_stats(),
+            "group_commit": db_utils.get_group_commit_stats(),
+            "details_cache": db_utils.get_details_cache_stats(),
+            "top_charts": db_utils.get_top_chart_stats(),
+            "recommendations": db_utils.get_recommendation_stats(),
+            "trending": db_utils.get_trending_stats(),
+            "event_compaction": db_utils.get_event_compaction_stats(),
+        }), 200
     else:
         return jsonify({"status": "unhealthy", "database": "disconnected"}), 500
 
+@app.route('/health/live')
+def liveness_check():
+    # Shallow: the process is up and serving, no database access
+    return jsonify({"status": "alive"})
+
+@app.route('/health/ready')
+def readiness_check():
+    # Deep: a query has to succeed on every connection kind this process uses
+    error = db_utils.check_database()
+    if error:
+        return jsonify({"status": "unavailable", "error": error}), 503
+    return jsonify({"status": "ready"})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(request_metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def _flag(name):
+    # Boolean query parameters: ?expand=true (or 1/yes)
+    return request.args.get(name, default='').lower() in ('1', 'true', 'yes')
+
+def _listing_tables():
+    # Expanded listings also depend on the tag graph in tags.similar_tag_ids
+    return db_utils.TOP_CHART_TABLES + ('tags',) if _flag('expand') else db_utils.TOP_CHART_TABLES
+
 @app.route('/api/apps', methods=['GET'])
+@conditional(_listing_tables)
 def get_apps():
     limit = request.args.get('limit', default=20, type=int)
     offset = request.args.get('offset', default=0, type=int)
@@ -36,25 +188,120 @@ def get_apps():
     max_price = request.args.get('max_price', type=float)
     sort_by = request.args.get('sort_by', default='downloads')
     sort_order = request.args.get('sort_order', default='desc')
-    
-    if category:
-        apps = db_utils.get_apps_by_category(category, limit, offset, max_price, sort_by, sort_order)
+    cursor = request.args.get('cursor')
+    expand = _flag('expand')
+
+    if expand and not category:
+        return jsonify({"error": "expand needs a category"}), 400
+    if cursor is not None:
+        if expand:
+            return jsonify({"error": "expand doesn't support cursor pagination, use offset"}), 400
+        # Keyset pagination, an empty cursor asks for the first page
+        if limit < 1:
+            return jsonify({"error": "limit must be at least 1"}), 400
+        limit = min(limit, MAX_PAGE_SIZE)
+        try:
+            apps, next_cursor = db_utils.get_apps_page(category, limit, cursor or None, max_price, sort_by, sort_order)
+        except db_utils.InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
+        if apps is None:
+            return jsonify({"error": "Database error"}), 500
+        return jsonify({"items": apps, "next_cursor": next_cursor})
+
+    # The first pages of unfiltered listings come from the in-memory top charts
+    chart = None
+    if max_price is None and not expand:
+        chart = db_utils.get_top_chart_page(category, limit, offset, sort_by, sort_order)
+    if chart is not None:
+        apps, g.served_version, refreshed_at = chart
+    elif category:
+        apps = db_utils.get_apps_by_category(category, limit, offset, max_price, sort_by, sort_order, expand)
     else:
         apps = db_utils.get_all_apps(limit, offset, max_price, sort_by, sort_order)
         
     if apps is None:
         return jsonify({"error": "Database error"}), 500
     
-    return jsonify(apps)
+    response = jsonify(apps)
+    if chart is not None:
+        response.headers['X-Chart-Refreshed-At'] = datetime.fromtimestamp(refreshed_at, timezone.utc).isoformat()
+    if apps and len(apps) == limit and not expand:
+        # Lets offset clients switch to cursors from where they are
+        response.headers['X-Next-Cursor'] = db_utils.encode_cursor(sort_by, sort_order, apps[-1], category, max_price)
+    return response
+
+@app.route('/api/apps/batch', methods=['GET', 'POST'])
+def get_apps_batch():
+    # ?ids=1,2,3 or a {"ids": [1, 2, 3]} body
+    if request.method == 'POST':
+        ids = (request.get_json(silent=True) or {}).get('ids')
+    else:
+        ids = [part for part in request.args.get('ids', '').split(',') if part.strip()]
+    try:
+        if not isinstance(ids, list):
+            raise TypeError
+        app_ids = [int(app_id) for app_id in ids]
+    except (TypeError, ValueError):
+        return jsonify({"error": "ids must be a list of integers"}), 400
+    if len(app_ids) > MAX_BATCH_IDS:
+        return jsonify({"error": f"at most {MAX_BATCH_IDS} ids per request"}), 400
+
+    apps = db_utils.get_app_details_batch(app_ids)
+    if apps is None:
+        return jsonify({"error": "Database error"}), 500
+    missing = [app_id for app_id, app_data in zip(app_ids, apps) if app_data is None]
+    return jsonify({"apps": apps, "missing": missing})
 
 @app.route('/api/apps/<int:app_id>', methods=['GET'])
+@conditional(*db_utils.DETAILS_TABLES)
 def get_app_details(app_id):
-    app_data = db_utils.get_app_details(app_id)
+    # Cached details can predate another process's write, conditional then leaves out the ETag
+    app_data, g.served_version = db_utils.get_app_details_versioned(app_id)
     if app_data is None:
         return jsonify({"error": "App not found or database error"}), 404
         
     return jsonify(app_data)
 
+@app.route('/api/apps/<int:app_id>/similar', methods=['GET'])
+def get_similar_apps(app_id):
+    # "Users who installed this also installed", served from memory
+    limit = max(0, request.args.get('limit', default=10, type=int))
+    if not db_utils.RECS_ENABLED:
+        return jsonify({"error": "Recommendations are off, they need numpy and scipy and APPSTORE_RECS=1"}), 404
+    result = db_utils.get_similar_apps(app_id, limit)
+    if result is None:
+        response = jsonify({"error": "Recommendations are still being built, please retry"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    similar, built_at = result
+    return jsonify({
+        "app_id": app_id,
+        "similar": similar,
+        "built_at": datetime.fromtimestamp(built_at, timezone.utc).isoformat(),
+    })
+
+@app.route('/api/apps/trending', methods=['GET'])
+def get_trending_apps():
+    # Net installs over a sliding window, recent ones weighted up, served from memory
+    window = request.args.get('window', default='day')
+    limit = max(0, request.args.get('limit', default=20, type=int))
+    if not db_utils.TRENDING_ENABLED:
+        return jsonify({"error": "Trending is off, set APPSTORE_TRENDING=1"}), 404
+    try:
+        result = db_utils.get_trending_apps(window, limit)
+    except KeyError:
+        return jsonify({"error": f"window must be one of {', '.join(trending.WINDOWS)}"}), 400
+    if result is None:
+        response = jsonify({"error": "Trending apps are still loading, please retry"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    apps, ranked_at = result
+    return jsonify({
+        "window": window,
+        "apps": apps,
+        "ranked_at": datetime.fromtimestamp(ranked_at, timezone.utc).isoformat(),
+    })
+
 @app.route('/api/search', methods=['GET'])
 def search_apps():
     query = request.args.get('q', '')
@@ -62,6 +309,8 @@ def search_apps():
     max_price = request.args.get('max_price', type=float)
     sort_by = request.args.get('sort_by', default='downloads')
     sort_order = request.args.get('sort_order', default='desc')
+    limit = request.args.get('limit', default=20, type=int)
+    offset = request.args.get('offset', default=0, type=int)
     
     # If no query but category exists, we might want to just list apps by category, 
     # but this endpoint is typically for text search.
@@ -69,13 +318,18 @@ def search_apps():
     # No, the user logic in frontend handles empty query by calling /api/apps.
     # But if they type in search bar AND select a tag, they call this.
     
-    results = db_utils.search_apps(query, category, max_price, sort_by, sort_order)
+    expand = _flag('expand')
+    if expand and not category:
+        return jsonify({"error": "expand needs a category"}), 400
+    
+    results = db_utils.search_apps(query, category, max_price, sort_by, sort_order, limit, offset, expand)
     if results is None:
          return jsonify({"error": "Database error"}), 500
          
     return jsonify(results)
 
 @app.route('/api/categories', methods=['GET'])
+@conditional('tags')
 def get_categories():
     categories = db_utils.get_categories()
     if categories is None:
@@ -216,6 +470,39 @@ def get_app_reports(app_id):
         return jsonify({"error": "Database error"}), 500
     return jsonify(reports)
 
+@app.route('/api/admin/sql_profile', methods=['GET', 'DELETE'])
+def sql_profile():
+    # Top statements by total time plus the slow-query log, APPSTORE_SQL_PROFILE=1 only
+    if request.method == 'DELETE':
+        db_utils.reset_query_profile()
+        return jsonify({"message": "Profile reset"})
+    limit = request.args.get('limit', default=20, type=int)
+    order = request.args.get('order', default='total_ms')
+    if order not in ('total_ms', 'calls', 'max_ms', 'mean_ms', 'rows'):
+        return jsonify({"error": "order must be total_ms, calls, max_ms, mean_ms or rows"}), 400
+    profile = db_utils.get_query_profile(limit, order)
+    if profile is None:
+        return jsonify({"error": "SQL profiling is off, start the API with APPSTORE_SQL_PROFILE=1"}), 404
+    return jsonify(profile)
+
+@app.route('/api/export/<kind>', methods=['GET'])
+def export_catalog(kind):
+    # Streams the whole table, memory use doesn't depend on its size
+    fmt = request.args.get('format', default='ndjson')
+    try:
+        since = exports.parse_since(request.args.get('since'))
+        use_gzip = bool(request.accept_encodings['gzip'])  # Compressed as it streams
+        chunks = exports.stream(kind, fmt, since, gzip=use_gzip, dumps=app.json.dump_bytes)
+    except exports.ExportError as e:
+        return jsonify({"error": str(e)}), 400
+
+    response = Response(chunks, mimetype=exports.FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    response.vary.add('Accept-Encoding')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @app.route('/api/apps', methods=['POST'])
 def create_app():
     data = request.json
@@ -237,5 +524,16 @@ def create_app():
     else:
         return jsonify({"error": "Failed to create app"}), 500
 
+@app.route('/api/apps/import', methods=['POST'])
+def import_apps():
+    # Body is a JSON array or NDJSON, read as it arrives rather than all at once
+    chunk_size = request.args.get('chunk_size', default=bulk_import.CHUNK_SIZE, type=int)
+    if chunk_size < 1:
+        return jsonify({"error": "chunk_size must be positive"}), 400
+    report = bulk_import.import_apps(bulk_import.parse_records(request.stream), chunk_size)
+    status = 200 if report["summary"]["created"] else 400
+    return jsonify(report), status
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server only, production runs under gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get("APPSTORE_DEBUG", "0") == "1")
@@ -0,0 +1,82 @@
+"""Time the big list endpoints with each JSON encoder and compression setting.
+
+Run from the repository root:
+
+    python benchmarks/serialization_bench.py --db app_data.db
+
+Two numbers per endpoint: the time to encode an already fetched payload
+(serialization alone) and the full request through the Flask test client,
+together with the bytes that would go over the wire.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_utils  # noqa: E402
+import serialization  # noqa: E402
+
+ENDPOINTS = [
+    "/api/users",
+    "/api/search?q=&limit=100",
+    "/api/apps?limit=100",
+]
+
+
+def _variants():
+    variants = [("stdlib", None)]
+    if serialization.orjson is not None:
+        variants.append(("orjson", None))
+    encoder = variants[-1][0]
+    variants.append((encoder, "gzip"))
+    if serialization.brotli is not None:
+        variants.append((encoder, "br"))
+    return variants
+
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=db_utils.DB_NAME, help="Database to run against")
+    parser.add_argument("--repeat", type=int, default=200, help="Requests per measurement")
+    args = parser.parse_args()
+
+    db_utils.DB_NAME = args.db
+    import app as app_module  # After DB_NAME is set
+    flask_app = app_module.app
+    provider = flask_app.json
+    client = flask_app.test_client()
+
+    print(f"{'endpoint':28} {'encoder':8} {'encoding':9} {'encode ms':>10} {'request ms':>11} {'bytes':>9}")
+    for path in ENDPOINTS:
+        payload = client.get(path).get_json()
+        for encoder, encoding in _variants():
+            provider.encoder = encoder
+            headers = {"Accept-Encoding": encoding} if encoding else {}
+
+            def encode_only():
+                data = provider.dump_bytes(payload)
+                if encoding and len(data) >= serialization.COMPRESS_MIN_BYTES:
+                    serialization.encode(data, encoding)
+
+            encode_ms = _time(encode_only, args.repeat)
+            request_ms = _time(lambda: client.get(path, headers=headers), args.repeat)
+            size = len(client.get(path, headers=headers).data)
+            print(f"{path:28} {encoder:8} {encoding or '-':9} {encode_ms:10.3f} {request_ms:11.3f} {size:9d}")
+
+    db_utils.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,603 @@
+"""Latency and throughput benchmarks for every db_utils function and API route.
+
+Run from the repository root:
+
+    python benchmarks/suite.py run --size small --out results.json
+    python benchmarks/suite.py run --db scale_data.db --baseline results.json
+    python benchmarks/suite.py compare results.json new.json
+    python benchmarks/suite.py scale --workers 1 2 4 8
+
+--size generates (once, then reuses) a database with generate_data.py.
+Every run works on a fresh copy, since the write benchmarks change data.
+Each case is run at every --concurrency level, and the JSON output holds
+p50/p95/p99/mean latency in ms, throughput and error counts. Latency
+covers only the call itself, throughput is over wall time and so also
+includes the untimed setup some cases need (the comment that an update
+or delete benchmark then edits).
+
+scale starts the production server (gunicorn.conf.py) with each --workers
+count in turn and drives it over HTTP from --clients load processes, to
+show how read throughput grows with cores. The load processes run on the
+same machine and need CPU too, so keep workers plus clients within the
+core count for a clean curve.
+"""
+import argparse
+import http.client
+import multiprocessing
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db_utils  # noqa: E402
+import generate_data  # noqa: E402
+
+DATA_DIR = os.path.join(ROOT, "benchmarks", ".data")
+
+# Arguments for generate_data.generate, keyed by --size
+SIZES = {
+    "small": dict(users=10000, apps=1000, installs=100000, comments=20000, reports=500),
+    "medium": dict(users=200000, apps=100000, installs=2000000, comments=400000, reports=10000),
+    "large": dict(users=1000000, apps=1000000, installs=10000000, comments=2000000, reports=50000),
+}
+
+# A case regressed when p95 grew, or throughput fell, by more than this
+DEFAULT_THRESHOLD = 0.15
+
+
+# --- Cases ---
+
+class Context:
+    """Ids of the benchmark database, sampled once before any case runs."""
+
+    def __init__(self, db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            self.max_app = conn.execute("SELECT MAX(app_id) FROM app").fetchone()[0]
+            self.max_user = conn.execute("SELECT MAX(user_id) FROM user").fetchone()[0]
+            self.tags = [row[0] for row in conn.execute("SELECT tag_id FROM tags")]
+            self.comments = conn.execute(
+                "SELECT comment_id, user_id FROM comments ORDER BY comment_id LIMIT 10000").fetchall()
+        finally:
+            conn.close()
+
+    def app(self, rng):
+        # Skewed towards popular apps like real traffic (ids are popularity ranks)
+        return min(self.max_app, int(rng.paretovariate(1.2)))
+
+    def user(self, rng):
+        return rng.randint(1, self.max_user)
+
+    def comment(self, rng):
+        return rng.choice(self.comments)
+
+
+def _new_comment(ctx, rng):
+    # Untimed setup for update/delete: a comment the benchmark owns
+    user_id = ctx.user(rng)
+    return db_utils.add_comment(ctx.app(rng), user_id, 3.0, "benchmark"), user_id
+
+
+def db_cases(ctx):
+    """[(name, prepare(rng) -> args, call(*args))] for db_utils."""
+    sorts = ["downloads", "rating", "price", "app_name"]
+    return [
+        ("db.get_all_apps", lambda rng: (20, rng.randint(0, 200), None, rng.choice(sorts), "desc"),
+         db_utils.get_all_apps),
+        ("db.get_apps_by_category",
+         lambda rng: (rng.choice(ctx.tags), 20, rng.randint(0, 200), None, rng.choice(sorts), "desc"),
+         db_utils.get_apps_by_category),
+        ("db.get_apps_by_category_expanded",
+         lambda rng: (rng.choice(ctx.tags), 20, rng.randint(0, 200), None, rng.choice(sorts), "desc", True),
+         db_utils.get_apps_by_category),
+        ("db.get_apps_page", lambda rng: (rng.choice(ctx.tags), 20, None, None, rng.choice(sorts), "desc"),
+         db_utils.get_apps_page),
+        ("db.get_app_details", lambda rng: (ctx.app(rng),), db_utils.get_app_details),
+        ("db.get_app_details_batch", lambda rng: ([ctx.app(rng) for _ in range(24)],),
+         db_utils.get_app_details_batch),
+        ("db.search_apps", lambda rng: (rng.choice(["pocket", "weather", "pro tas", "zen"]),),
+         db_utils.search_apps),
+        ("db.get_categories", lambda rng: (), db_utils.get_categories),
+        ("db.get_all_users", lambda rng: (), db_utils.get_all_users),
+        ("db.get_data_version", lambda rng: (["app", "app_tags"],), db_utils.get_data_version),
+        ("db.record_download", lambda rng: (ctx.app(rng), ctx.user(rng)), db_utils.record_download),
+        ("db.remove_download", lambda rng: (ctx.app(rng), ctx.user(rng)), db_utils.remove_download),
+        ("db.add_comment", lambda rng: (ctx.app(rng), ctx.user(rng), 4.0, "benchmark"), db_utils.add_comment),
+        ("db.update_comment", lambda rng: (*_new_comment(ctx, rng), 2.0, "edited"), db_utils.update_comment),
+        ("db.delete_comment", lambda rng: _new_comment(ctx, rng), db_utils.delete_comment),
+        ("db.add_report", lambda rng: (ctx.comment(rng)[0], "benchmark"), db_utils.add_report),
+        ("db.add_app_report", lambda rng: (ctx.app(rng), "benchmark"), db_utils.add_app_report),
+        ("db.get_reported_users", lambda rng: (), db_utils.get_reported_users),
+        ("db.get_user_reports", lambda rng: (ctx.comment(rng)[1],), db_utils.get_user_reports),
+        ("db.get_reported_apps", lambda rng: (), db_utils.get_reported_apps),
+        ("db.get_app_reports", lambda rng: (ctx.app(rng),), db_utils.get_app_reports),
+        ("db.add_app", lambda rng: ("Benchmark App", 0.99, "benchmark", rng.choice(ctx.tags), None, [], None),
+         db_utils.add_app),
+    ]
+
+
+def http_cases(ctx):
+    """[(name, prepare(rng) -> (method, url, body), ok)] for every route.
+
+    body is sent as JSON, or as is when it is bytes. ok(response) says
+    whether a response counts as a success, None for any status below 500.
+    """
+    def get(url):
+        return lambda rng: ("GET", url(rng), None)
+
+    def send(method, url, body):
+        return lambda rng: (method, url(rng), body(rng))
+
+    cases = [
+        ("GET /", get(lambda rng: "/")),
+        ("GET /health", get(lambda rng: "/health")),
+        ("GET /api/apps", get(lambda rng: f"/api/apps?limit=20&offset={rng.randint(0, 200)}")),
+        ("GET /api/apps?category", get(lambda rng: f"/api/apps?category={rng.choice(ctx.tags)}&sort_by=rating")),
+        ("GET /api/apps?cursor", get(lambda rng: f"/api/apps?cursor=&category={rng.choice(ctx.tags)}")),
+        ("GET /api/apps/batch", get(lambda rng: "/api/apps/batch?ids=" + ",".join(
+            str(ctx.app(rng)) for _ in range(24)))),
+        ("GET /api/apps/<id>", get(lambda rng: f"/api/apps/{ctx.app(rng)}")),
+        ("GET /api/search", get(lambda rng: f"/api/search?q={rng.choice(['pocket', 'weather', 'zen'])}")),
+        ("GET /api/categories", get(lambda rng: "/api/categories")),
+        ("GET /api/users", get(lambda rng: "/api/users")),
+        ("POST /api/apps/<id>/download", send("POST", lambda rng: f"/api/apps/{ctx.app(rng)}/download",
+                                              lambda rng: {"user_id": ctx.user(rng)})),
+        ("DELETE /api/apps/<id>/download", send("DELETE", lambda rng: f"/api/apps/{ctx.app(rng)}/download",
+                                                lambda rng: {"user_id": ctx.user(rng)})),
+        ("POST /api/apps/<id>/comments", send("POST", lambda rng: f"/api/apps/{ctx.app(rng)}/comments",
+                                              lambda rng: {"user_id": ctx.user(rng), "stars": 4,
+                                                           "comment": "benchmark"})),
+        ("POST /api/comments/<id>/report", send("POST", lambda rng: f"/api/comments/{ctx.comment(rng)[0]}/report",
+                                                lambda rng: {"reason": "benchmark"})),
+        ("POST /api/apps/<id>/report", send("POST", lambda rng: f"/api/apps/{ctx.app(rng)}/report",
+                                            lambda rng: {"reason": "benchmark"})),
+        ("GET /api/admin/reported_users", get(lambda rng: "/api/admin/reported_users")),
+        ("GET /api/admin/users/<id>/reports",
+         get(lambda rng: f"/api/admin/users/{ctx.comment(rng)[1]}/reports")),
+        ("GET /api/admin/reported_apps", get(lambda rng: "/api/admin/reported_apps")),
+        ("GET /api/admin/apps/<id>/reports", get(lambda rng: f"/api/admin/apps/{ctx.app(rng)}/reports")),
+        ("POST /api/apps", send("POST", lambda rng: "/api/apps",
+                                lambda rng: {"name": "Benchmark App", "description": "benchmark",
+                                             "category": rng.choice(ctx.tags), "price": 0.99})),
+    ]
+
+    def manage_comment(method):
+        def prepare(rng):
+            comment_id, user_id = _new_comment(ctx, rng)
+            return method, f"/api/comments/{comment_id}", {"user_id": user_id, "stars": 2, "comment": "edited"}
+        return prepare
+
+    cases += [
+        ("PUT /api/comments/<id>", manage_comment("PUT")),
+        ("DELETE /api/comments/<id>", manage_comment("DELETE")),
+    ]
+    cases = [(name, prepare, None) for name, prepare in cases]
+
+    def import_body(rng, ndjson):
+        apps = [{"name": f"Imported App {rng.randint(0, 10 ** 6)}", "description": "benchmark",
+                 "category": rng.choice(ctx.tags), "price": 0.99} for _ in range(3)]
+        if ndjson:
+            return "".join(json.dumps(app) + "\n" for app in apps).encode()
+        return json.dumps(apps).encode()
+
+    def imported_all(response):
+        # A row that fails to parse or validate is still a 200 while others succeed
+        summary = response.get_json()["summary"]
+        return response.status_code == 200 and summary["created"] == summary["received"] == 3
+
+    def served_or_loading(response):
+        # In-memory views answer 503 until their first build, that isn't a failure
+        if response.status_code == 503:
+            return "still" in response.get_json().get("error", "")
+        return response.status_code < 500
+
+    def streamed(response):
+        # Exports stream, read the whole body so its time counts
+        return response.status_code == 200 and len(response.get_data()) > 0
+
+    cases += [
+        ("POST /api/apps/import (array)", send("POST", lambda rng: "/api/apps/import",
+                                               lambda rng: import_body(rng, False)), imported_all),
+        ("POST /api/apps/import (ndjson)", send("POST", lambda rng: "/api/apps/import",
+                                                lambda rng: import_body(rng, True)), imported_all),
+        ("GET /api/apps/trending", get(lambda rng: f"/api/apps/trending?window={rng.choice(['day', 'week'])}"),
+         served_or_loading),
+        ("GET /api/apps/<id>/similar", get(lambda rng: f"/api/apps/{ctx.app(rng)}/similar"), served_or_loading),
+        ("GET /api/export/apps", get(lambda rng: "/api/export/apps"), streamed),
+        ("GET /api/export/comments (csv)", get(lambda rng: "/api/export/comments?format=csv"), streamed),
+        ("GET /api/export/installs", get(lambda rng: "/api/export/installs"), streamed),
+        ("GET /metrics", get(lambda rng: "/metrics"), None),
+        ("GET /health/live", get(lambda rng: "/health/live"), None),
+        ("GET /health/ready", get(lambda rng: "/health/ready"), None),
+        ("GET /api/admin/sql_profile", get(lambda rng: "/api/admin/sql_profile"), None),
+    ]
+    return cases
+
+
+# --- Running ---
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_case(prepare, call, concurrency, iterations, seed, client_factory=None, check=None):
+    """Run iterations calls split over concurrency threads, return the stats."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = max(1, iterations // concurrency)
+
+    def worker(index):
+        rng = random.Random(f"{seed}:{index}")
+        client = client_factory() if client_factory else None
+        mine = []
+        failed = 0
+        for _ in range(per_thread):
+            args = prepare(rng)
+            start = time.perf_counter()
+            try:
+                if client is not None:
+                    method, url, body = args
+                    if isinstance(body, bytes):
+                        response = client.open(url, method=method, data=body)
+                    else:
+                        response = client.open(url, method=method, json=body)
+                    ok = check(response) if check else response.status_code < 500
+                else:
+                    call(*args)
+                    ok = True
+            except Exception:
+                ok = False
+            mine.append((time.perf_counter() - start) * 1000)
+            failed += not ok
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "ops": len(latencies),
+        "errors": errors[0],
+        "throughput": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(_percentile(latencies, 0.50), 3),
+        "p95_ms": round(_percentile(latencies, 0.95), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+    }
+
+
+def _database(args):
+    if args.db:
+        return args.db
+    path = os.path.join(DATA_DIR, f"{args.size}.db")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        print(f"Generating {args.size} database, this only happens once...")
+        generate_data.generate(path, seed=args.seed, **SIZES[args.size])
+    return path
+
+
+def _copy_database(source_path, workdir):
+    db_path = os.path.join(workdir, "bench.db")
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(db_path)
+    source.backup(target)
+    source.close()
+    target.close()
+    return db_path
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    source_path = _database(args)
+    workdir = tempfile.mkdtemp()
+    try:
+        db_path = _copy_database(source_path, workdir)
+        db_utils.DB_NAME = db_path
+        if args.no_cache:
+            db_utils._details_cache.max_entries = 0
+        import app as app_module  # After DB_NAME is set
+        ctx = Context(db_path)
+
+        cases = []
+        if args.only != "http":
+            cases += [(name, prepare, call, None, None) for name, prepare, call in db_cases(ctx)]
+        if args.only != "db":
+            cases += [(name, prepare, None, app_module.app.test_client, check)
+                      for name, prepare, check in http_cases(ctx)]
+        if args.filter:
+            cases = [case for case in cases if args.filter in case[0]]
+
+        results = {}
+        for name, prepare, call, client_factory, check in cases:
+            results[name] = {}
+            for concurrency in args.concurrency:
+                stats = run_case(prepare, call, concurrency, args.iterations, args.seed, client_factory, check)
+                results[name][str(concurrency)] = stats
+                print(f"{name:40} c={concurrency:<3} p50={stats['p50_ms']:8.3f}ms p95={stats['p95_ms']:8.3f}ms "
+                      f"p99={stats['p99_ms']:8.3f}ms {stats['throughput']:9.1f}/s errors={stats['errors']}")
+    finally:
+        db_utils.get_pool().close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "database": os.path.abspath(source_path),
+            "size": None if args.db else args.size,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "details_cache": not args.no_cache,
+            "split_rw": db_utils.SPLIT_RW,
+            "group_commit": db_utils.GROUP_COMMIT,
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            return _report_regressions(json.load(f), report, args.threshold)
+    return 0
+
+
+# --- Scaling across worker processes ---
+
+def _read_paths(ctx, seed, count=2000):
+    # A read-heavy mix, fixed up front so every worker count sees the same requests
+    rng = random.Random(seed)
+    paths = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.5:
+            paths.append(f"/api/apps/{ctx.app(rng)}")
+        elif roll < 0.75:
+            paths.append(f"/api/apps?limit=20&offset={rng.randint(0, 200)}&sort_by=rating")
+        elif roll < 0.9:
+            paths.append(f"/api/search?q={rng.choice(['pocket', 'weather', 'zen'])}")
+        else:
+            paths.append("/api/categories")
+    return paths
+
+
+def _load_client(port, paths, duration, offset):
+    # One load process: sequential keep-alive requests until the time is up
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies = []
+    errors = 0
+    index = offset
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 500
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            ok = False
+        latencies.append((time.perf_counter() - start) * 1000)
+        errors += not ok
+    conn.close()
+    return latencies, errors
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(db_path, workers, threads, port, no_cache):
+    env = dict(os.environ, APPSTORE_DB_PATH=db_path, APPSTORE_WORKERS=str(workers),
+               APPSTORE_THREADS=str(threads), APPSTORE_BIND=f"127.0.0.1:{port}")
+    if no_cache:
+        env["APPSTORE_DETAILS_CACHE_SIZE"] = "0"
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup, is it installed?")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health/ready")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    _stop_server(server)
+    raise RuntimeError("gunicorn did not become ready within 30s")
+
+
+def _stop_server(server):
+    server.send_signal(signal.SIGTERM)  # Graceful: finishes in-flight requests
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def scale(args):
+    source_path = _database(args)
+    workdir = tempfile.mkdtemp()
+    results = {}
+    try:
+        db_path = _copy_database(source_path, workdir)
+        paths = _read_paths(Context(db_path), args.seed)
+        base = None
+        for workers in args.workers:
+            port = _free_port()
+            server = _start_server(db_path, workers, args.threads, port, args.no_cache)
+            try:
+                with multiprocessing.Pool(args.clients) as clients:
+                    _load_client(port, paths, 1.0, 0)  # Warm up the first worker's caches
+                    runs = clients.starmap(_load_client, [(port, paths, args.duration, i * 97)
+                                                          for i in range(args.clients)])
+            finally:
+                _stop_server(server)
+
+            latencies = [ms for run_latencies, _ in runs for ms in run_latencies]
+            stats = {
+                "ops": len(latencies),
+                "errors": sum(errors for _, errors in runs),
+                "throughput": round(len(latencies) / args.duration, 1),
+                "p50_ms": round(_percentile(latencies, 0.50), 3),
+                "p95_ms": round(_percentile(latencies, 0.95), 3),
+                "p99_ms": round(_percentile(latencies, 0.99), 3),
+            }
+            base = base or stats["throughput"]
+            stats["speedup"] = round(stats["throughput"] / base, 2) if base else None
+            results[str(workers)] = stats
+            print(f"workers={workers:<3} {stats['throughput']:9.1f}/s x{stats['speedup']:<5} "
+                  f"p50={stats['p50_ms']:8.3f}ms p95={stats['p95_ms']:8.3f}ms errors={stats['errors']}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "database": os.path.abspath(source_path),
+            "size": None if args.db else args.size,
+            "threads": args.threads,
+            "clients": args.clients,
+            "duration": args.duration,
+            "cpus": os.cpu_count(),
+            "details_cache": not args.no_cache,
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "scaling": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+    return 0
+
+
+# --- Comparing ---
+
+def compare_reports(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Return [(case, concurrency, metric, old, new)] for every regression."""
+    regressions = []
+    for name, levels in current["results"].items():
+        for concurrency, stats in levels.items():
+            old = baseline["results"].get(name, {}).get(concurrency)
+            if not old:
+                continue
+            if old["p95_ms"] > 0 and stats["p95_ms"] > old["p95_ms"] * (1 + threshold):
+                regressions.append((name, concurrency, "p95_ms", old["p95_ms"], stats["p95_ms"]))
+            if stats["throughput"] < old["throughput"] * (1 - threshold):
+                regressions.append((name, concurrency, "throughput", old["throughput"], stats["throughput"]))
+            if stats["errors"] > old["errors"]:
+                regressions.append((name, concurrency, "errors", old["errors"], stats["errors"]))
+    return regressions
+
+
+def _report_regressions(baseline, current, threshold):
+    regressions = compare_reports(baseline, current, threshold)
+    for name, concurrency, metric, old, new in regressions:
+        print(f"REGRESSION {name} c={concurrency} {metric}: {old} -> {new}")
+    print(f"{len(regressions)} regressions beyond {threshold:.0%} against the baseline.")
+    return 1 if regressions else 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    return _report_regressions(baseline, current, args.threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Run the benchmarks")
+    source = run_parser.add_mutually_exclusive_group()
+    source.add_argument("--db", help="Existing database to benchmark (a copy is used)")
+    source.add_argument("--size", choices=sorted(SIZES), default="small", help="Generated database size")
+    run_parser.add_argument("--iterations", type=int, default=200, help="Calls per case and concurrency level")
+    run_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    run_parser.add_argument("--only", choices=["db", "http"], help="Run only one kind of case")
+    run_parser.add_argument("--filter", help="Only cases whose name contains this")
+    run_parser.add_argument("--no-cache", action="store_true", help="Disable the app details cache")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--out", help="Write results as JSON here")
+    run_parser.add_argument("--baseline", help="Compare against this results file, exit 1 on regressions")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    compare_parser = sub.add_parser("compare", help="Compare two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    cpus = os.cpu_count() or 1
+    scale_parser = sub.add_parser("scale", help="Measure HTTP throughput as gunicorn workers are added")
+    source = scale_parser.add_mutually_exclusive_group()
+    source.add_argument("--db", help="Existing database to benchmark (a copy is used)")
+    source.add_argument("--size", choices=sorted(SIZES), default="small", help="Generated database size")
+    scale_parser.add_argument("--workers", type=int, nargs="+",
+                              default=sorted({1, max(1, cpus // 2), cpus}), help="Worker counts to try")
+    scale_parser.add_argument("--threads", type=int, default=4, help="Threads per worker")
+    scale_parser.add_argument("--clients", type=int, default=max(2, cpus), help="Load generating processes")
+    scale_parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per worker count")
+    scale_parser.add_argument("--no-cache", action="store_true", help="Disable the app details cache")
+    scale_parser.add_argument("--seed", type=int, default=42)
+    scale_parser.add_argument("--out", help="Write results as JSON here")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        return run(args)
+    if args.command == "scale":
+        return scale(args)
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
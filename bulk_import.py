@@ -0,0 +1,284 @@
+import argparse
+import codecs
+import itertools
+import json
+import re
+import sqlite3
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+import db_pool
+import db_utils
+
+CHUNK_SIZE = 1000  # Apps per transaction
+READ_SIZE = 64 * 1024
+_SEPARATORS = re.compile(r"[\s,]*")  # Between array elements
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+# --- Parsing ---
+
+def _read_text(fp):
+    # Decoded text in READ_SIZE pieces, multi-byte characters may straddle reads
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        data = fp.read(READ_SIZE)
+        if not data:
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+            return
+        yield decoder.decode(data) if isinstance(data, bytes) else data
+
+
+def _ndjson_records(pieces, first):
+    # first is what parse_records already read, split like any later piece
+    index = 0
+    buffer = ""
+    for piece in itertools.chain([first], pieces):
+        buffer += piece
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if line.strip():
+                yield index, line
+                index += 1
+    if buffer.strip():
+        yield index, buffer
+
+
+def _array_records(pieces, buffer):
+    decoder = json.JSONDecoder()
+    # pos walks the buffer, which is only cut down when a read is appended
+    pos = buffer.index("[") + 1  # Past the opening [
+    index = 0
+    eof = False
+    while True:
+        pos = _SEPARATORS.match(buffer, pos).end()
+        if buffer.startswith("]", pos):
+            return
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            if eof:
+                # Can't find the next element after a broken one, stop here
+                yield index, ImportRowError(f"invalid JSON: {e}")
+                return
+            piece = next(pieces, None)
+            if piece is None:
+                eof = True
+            else:
+                buffer = buffer[pos:] + piece
+                pos = 0
+            continue
+        yield index, obj
+        index += 1
+        pos = end
+
+
+def parse_records(fp):
+    """Yield (index, record) from a stream holding a JSON array or NDJSON.
+
+    record is a parsed object, a raw NDJSON line, or an ImportRowError.
+    Only one read's worth of input is held in memory at a time.
+    """
+    pieces = _read_text(fp)
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        if buffer.strip():
+            break
+    if buffer.lstrip().startswith("["):
+        return _array_records(pieces, buffer)
+    return _ndjson_records(pieces, buffer)
+
+
+# --- Validation ---
+
+def validate(record, known_tags):
+    """Return the insert tuple for one record, or raise ImportRowError."""
+    if isinstance(record, ImportRowError):
+        raise record
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except json.JSONDecodeError as e:
+            raise ImportRowError(f"invalid JSON: {e}")
+    if not isinstance(record, dict):
+        raise ImportRowError("each app must be a JSON object")
+
+    name = record.get("name")
+    description = record.get("description")
+    category = record.get("category")
+    if not all(isinstance(value, str) and value.strip() for value in (name, description, category)):
+        raise ImportRowError("name, description and category are required strings")
+    if category not in known_tags:
+        raise ImportRowError(f"unknown category {category!r}")
+
+    price = record.get("price") or 0.0
+    if isinstance(price, bool) or not isinstance(price, (int, float)) or price < 0:
+        raise ImportRowError("price must be a non-negative number")
+
+    icon = record.get("icon")
+    if icon is not None and not isinstance(icon, str):
+        raise ImportRowError("icon must be a string")
+    images = record.get("images") or []
+    if not isinstance(images, list) or not all(isinstance(image, str) for image in images):
+        raise ImportRowError("images must be a list of strings")
+    developer_id = record.get("developer_id")
+    if developer_id is not None and (isinstance(developer_id, bool) or not isinstance(developer_id, int)):
+        raise ImportRowError("developer_id must be an integer")
+
+    # Extra tags beyond the primary category, which always comes first
+    tags = record.get("tags") or []
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ImportRowError("tags must be a list of strings")
+    unknown = [tag for tag in tags if tag not in known_tags]
+    if unknown:
+        raise ImportRowError(f"unknown tags {unknown}")
+    tags = [category] + [tag for tag in dict.fromkeys(tags) if tag != category]
+
+    return (name, float(price), description, category, icon, images, developer_id, tags)
+
+
+# --- Loading ---
+
+def _insert_chunk(conn, rows):
+    # run_write holds the write lock (BEGIN IMMEDIATE), so these ids can't be handed out twice
+    next_id = conn.execute("""
+        SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'app'), 0),
+                   COALESCE((SELECT MAX(app_id) FROM app), 0)) + 1
+    """).fetchone()[0]
+    app_ids = list(range(next_id, next_id + len(rows)))
+    now = datetime.now().isoformat(sep=" ")
+
+    conn.executemany(
+        "INSERT INTO app (app_id, app_name, icon, price, developer_id, category) VALUES (?, ?, ?, ?, ?, ?)",
+        [(app_id, name, icon, price, developer_id, category)
+         for app_id, (name, price, _, category, icon, _, developer_id, _) in zip(app_ids, rows)]
+    )
+    conn.executemany(
+        "INSERT INTO app_page (app_id, description, images, last_update) VALUES (?, ?, ?, ?)",
+        [(app_id, description, json.dumps(images), now)
+         for app_id, (_, _, description, _, _, images, _, _) in zip(app_ids, rows)]
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO app_tags (app_id, tag_id) VALUES (?, ?)",
+        [(app_id, tag) for app_id, row in zip(app_ids, rows) for tag in row[7]]
+    )
+
+    # One counter update per tag for the whole chunk
+    tag_counts = Counter(tag for row in rows for tag in row[7])
+    conn.executemany("UPDATE tags SET amount = amount + ? WHERE tag_id = ?",
+                     [(count, tag) for tag, count in tag_counts.items()])
+    return app_ids
+
+
+def _load_chunk(chunk, results):
+    # chunk: [(index, row)]. A failed chunk is retried row by row so one bad
+    # row (a constraint, say) doesn't fail the others.
+    try:
+        app_ids = db_utils.run_write(_insert_chunk, [row for _, row in chunk])
+    except db_pool.DatabaseOverloaded as e:
+        # Contention, not bad rows: retrying them one by one would only make it worse
+        for index, _ in chunk:
+            results.append({"index": index, "status": "error", "error": f"database busy, retry later: {e}"})
+        return
+    except sqlite3.Error as e:
+        if len(chunk) == 1:
+            results.append({"index": chunk[0][0], "status": "error", "error": str(e)})
+            return
+        for entry in chunk:
+            _load_chunk([entry], results)
+        return
+    for (index, _), app_id in zip(chunk, app_ids):
+        results.append({"index": index, "status": "created", "app_id": app_id})
+
+
+def _known_tags():
+    conn = db_utils.get_read_connection()
+    if not conn:
+        raise sqlite3.OperationalError("could not connect to the database")
+    try:
+        return {row['tag_id'] for row in conn.execute("SELECT tag_id FROM tags")}
+    finally:
+        db_utils.release_db_connection(conn)
+
+
+def import_apps(records, chunk_size=CHUNK_SIZE):
+    """Validate and insert (index, record) pairs, chunk_size apps per transaction.
+
+    Returns {"results": [...], "summary": {...}} with one result per record,
+    in input order, and counts plus throughput for the whole run.
+    """
+    started = time.perf_counter()
+    known_tags = _known_tags()
+    results = []
+    chunk = []
+    chunks = 0
+    received = 0
+    for index, record in records:
+        received += 1
+        try:
+            chunk.append((index, validate(record, known_tags)))
+        except ImportRowError as e:
+            results.append({"index": index, "status": "error", "error": str(e)})
+            continue
+        if len(chunk) >= chunk_size:
+            _load_chunk(chunk, results)
+            chunks += 1
+            chunk = []
+    if chunk:
+        _load_chunk(chunk, results)
+        chunks += 1
+
+    elapsed = time.perf_counter() - started
+    results.sort(key=lambda result: result["index"])
+    created = sum(1 for result in results if result["status"] == "created")
+    return {
+        "results": results,
+        "summary": {
+            "received": received,
+            "created": created,
+            "failed": received - created,
+            "chunks": chunks,
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(received / elapsed, 1) if elapsed > 0 else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import apps from a JSON array or NDJSON file")
+    parser.add_argument("path", help="File to import, - for stdin")
+    parser.add_argument("--db", default=db_utils.DB_NAME, help="Path to the SQLite database")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Apps per transaction")
+    args = parser.parse_args()
+
+    db_utils.DB_NAME = args.db
+    fp = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    try:
+        report = import_apps(parse_records(fp), args.chunk_size)
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        return 1
+    finally:
+        if fp is not sys.stdin.buffer:
+            fp.close()
+        db_utils.get_pool().close_all()
+
+    for result in report["results"]:
+        if result["status"] == "error":
+            print(f"row {result['index']}: {result['error']}")
+    summary = report["summary"]
+    print(f"Imported {summary['created']} of {summary['received']} apps in {summary['seconds']}s "
+          f"({summary['rows_per_second']} rows/s, {summary['chunks']} transactions).")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import db_utils
+import migrations
+
+DB_NAME = "app_data.db"
+
+# Plan steps that are intentional, keyed by db_utils function:
+# (step prefix, SQL shape, reason). A step is only allowed in statements
+# containing the shape, None for any of the function's statements. Anything
+# else that scans a table without an index or sorts in a temp B-tree fails.
+# Sorts stay allowed where no index can give the order: rows reached
+# through app_tags sorted by an app column, and computed rankings.
+CATEGORY_JOIN = "JOIN app_tags at ON a.app_id = at.app_id WHERE at.tag_id = "
+RELATED_TAGS = "FROM tag_neighbors tn JOIN app_tags at ON at.tag_id = tn.neighbor_id"
+ALLOWED_STEPS = {
+    "get_categories": [("SCAN tags", None, "returns every tag")],
+    # Either side of the join may drive, depending on table statistics
+    "get_reported_users": [("SCAN u", None, "returns every reported user, sorted by report count in Python")],
+    "get_reported_apps": [("SCAN a", None, "returns every reported app, sorted by report count in Python")],
+    "search_apps": [
+        ("USE TEMP B-TREE FOR ORDER BY", "app_search MATCH ", "ranks the full-text matches, bounded by LIMIT"),
+        ("USE TEMP B-TREE FOR ORDER BY", "ORDER BY m.tag_weight DESC", "expand: ranks by tag relatedness first"),
+        ("SCAN m", RELATED_TAGS,
+         "expand: the related categories' apps, found through tag_neighbors and idx_app_tags_tag"),
+        ("USE TEMP B-TREE FOR GROUP BY", RELATED_TAGS, "expand: one row per app across the related categories"),
+    ],
+    "get_apps_by_category": [
+        ("USE TEMP B-TREE FOR ORDER BY", CATEGORY_JOIN, "sorts one category's rows, found through idx_app_tags_tag"),
+        ("USE TEMP B-TREE FOR ORDER BY", "ORDER BY m.tag_weight DESC", "expand: ranks by tag relatedness first"),
+        ("SCAN m", RELATED_TAGS,
+         "expand: the related categories' apps, found through tag_neighbors and idx_app_tags_tag"),
+        ("USE TEMP B-TREE FOR GROUP BY", RELATED_TAGS, "expand: one row per app across the related categories"),
+    ],
+    "get_apps_page": [
+        ("USE TEMP B-TREE FOR ORDER BY", CATEGORY_JOIN,
+         "category pages sort one category's rows, like get_apps_by_category"),
+    ],
+    "get_app_details_batch": [
+        ("SCAN (subquery", "ROW_NUMBER() OVER", "reads back the windowed comments of the requested apps"),
+        ("USE TEMP B-TREE FOR", "ROW_NUMBER() OVER", "ranks comments per app, only the requested apps' rows"),
+    ],
+    "_load_installs": [("SCAN user_apps", None, "a full recommendations build reads every install")],
+    "compact_download_events": [
+        ("USE TEMP B-TREE FOR GROUP BY", "GROUP BY day, app_id",
+         "totals the compacted events per day and app, found through their index"),
+    ],
+}
+
+# Statistics from tables smaller than this make SQLite happily sort a row or
+# two in a temp B-tree instead of walking the index, which says nothing about
+# the plan it will pick on real data. Those tables are checked without stats.
+MIN_STAT_ROWS = 100
+
+# Threads that query on their own schedule, their statements would be
+# charged to whichever call happens to be running. Their loaders are
+# checked directly instead, see collect_statements.
+BACKGROUND_THREADS = ("top-charts", "recommendations", "trending", "event-compaction")
+
+# Table-valued functions are scans of one JSON value, not of a table
+VIRTUAL_SCANS = ("json_each",)
+
+
+def _calls(conn):
+    # Representative arguments for every db_utils query, against real ids
+    app_id = conn.execute("SELECT app_id FROM app ORDER BY app_id LIMIT 1").fetchone()[0]
+    user_id = conn.execute("SELECT user_id FROM user ORDER BY user_id LIMIT 1").fetchone()[0]
+    tag_id = conn.execute("SELECT tag_id FROM tags ORDER BY tag_id LIMIT 1").fetchone()[0]
+
+    cur = conn.execute("SELECT * FROM app ORDER BY app_id LIMIT 1")
+    row = dict(zip([c[0] for c in cur.description], cur.fetchone()))
+
+    calls = []
+    for sort_by in ["downloads", "rating", "price", "app_name"]:
+        for sort_order in ["asc", "desc"]:
+            for max_price in [None, 5.0]:
+                calls.append(("get_all_apps", (20, 0, max_price, sort_by, sort_order)))
+                calls.append(("get_apps_by_category", (tag_id, 20, 0, max_price, sort_by, sort_order)))
+                calls.append(("get_apps_by_category", (tag_id, 20, 0, max_price, sort_by, sort_order, True)))
+                # Keyset pages, the second one seeks past a cursor
+                for category in [None, tag_id]:
+                    cursor = db_utils.encode_cursor(sort_by, sort_order, row, category, max_price)
+                    calls.append(("get_apps_page", (category, 20, None, max_price, sort_by, sort_order)))
+                    calls.append(("get_apps_page", (category, 20, cursor, max_price, sort_by, sort_order)))
+    calls += [
+        ("get_app_details", (app_id,)),
+        ("get_app_details_batch", ([app_id, app_id + 1, -1],)),
+        ("search_apps", ("a", None, None, "relevance", "desc")),
+        ("search_apps", ("a", None, None, "downloads", "desc")),
+        ("search_apps", ("a", tag_id, 5.0, "rating", "asc")),
+        ("search_apps", ("", None, 5.0, "relevance", "desc")),
+        ("search_apps", ("a", tag_id, None, "relevance", "desc", 20, 0, True)),
+        ("search_apps", ("", tag_id, None, "relevance", "desc", 20, 0, True)),
+        ("get_categories", ()),
+        ("get_data_version", (["app", "app_tags", "tags"],)),
+        ("get_all_users", ()),
+        ("record_download", (app_id, user_id)),
+        ("remove_download", (app_id, user_id)),
+        ("add_comment", (app_id, user_id, 4.0, "plan check")),
+        ("get_reported_users", ()),
+        ("get_user_reports", (user_id,)),
+        ("add_app_report", (app_id, "plan check")),
+        ("get_reported_apps", ()),
+        ("get_app_reports", (app_id,)),
+        ("add_app", ("Plan Check", 0.0, "desc", tag_id, None, [], user_id)),
+    ]
+    return calls
+
+
+def _followups(conn):
+    # Calls that need ids created by the calls above
+    comment_id = conn.execute("SELECT MAX(comment_id) FROM comments").fetchone()[0]
+    user_id = conn.execute("SELECT user_id FROM comments WHERE comment_id = ?", (comment_id,)).fetchone()[0]
+    return [
+        ("update_comment", (comment_id, user_id, 3.0, "plan check")),
+        ("add_report", (comment_id, "plan check")),
+        ("delete_comment", (comment_id, user_id)),
+    ]
+
+
+def _is_checked(sql):
+    if "'main'." in sql:
+        return False  # FTS5 reading its own shadow tables
+    head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    return head in ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+
+
+def _bad_steps(name, sql, plan):
+    allowed = [prefix for prefix, shape, _ in ALLOWED_STEPS.get(name, []) if shape is None or shape in sql]
+    bad = []
+    for row in plan:
+        detail = row[3]
+        if any(detail.startswith(prefix) for prefix in allowed):
+            continue
+        if detail == "SCAN CONSTANT ROW":
+            continue  # A SELECT without a FROM
+        if "USE TEMP B-TREE" in detail:
+            bad.append(detail)
+        elif detail.startswith("SCAN ") and " USING " not in detail and "VIRTUAL TABLE INDEX" not in detail:
+            if not any(detail.startswith(f"SCAN {vtab}") for vtab in VIRTUAL_SCANS):
+                bad.append(detail)
+    return bad
+
+
+def _drop_small_table_stats(conn):
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        return
+    small = [tbl for tbl, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1").fetchall()
+             if int(stat.split()[0]) < MIN_STAT_ROWS]
+    conn.executemany("DELETE FROM sqlite_stat1 WHERE tbl = ?", [(tbl,) for tbl in small])
+    conn.commit()
+    conn.execute("ANALYZE sqlite_schema")  # Reload what's left
+
+
+def collect_statements(db_path):
+    """Run every db_utils query against db_path and return [(function, sql)]."""
+    statements = []
+    current = {"name": None}
+
+    def trace(sql):
+        if threading.current_thread().name in BACKGROUND_THREADS:
+            return
+        if current["name"] and _is_checked(sql):
+            statements.append((current["name"], sql))
+
+    db_utils.add_connect_hook(lambda conn: conn.set_trace_callback(trace))
+    db_utils.DB_NAME = db_path
+
+    conn = sqlite3.connect(db_path)
+    try:
+        migrations.migrate(conn)
+        _drop_small_table_stats(conn)
+        calls = _calls(conn)
+        for name, args in calls:
+            current["name"] = name
+            getattr(db_utils, name)(*args)
+        current["name"] = None
+        calls = _followups(conn)
+        for name, args in calls:
+            current["name"] = name
+            getattr(db_utils, name)(*args)
+        current["name"] = "_load_installs"
+        for _ in db_utils._load_installs()[2]:
+            pass
+        current["name"] = "_fetch_download_events"
+        db_utils._fetch_download_events(None, time.time() - 7 * 86400)
+        db_utils._fetch_download_events(0, None)
+        current["name"] = "compact_download_events"
+        db_utils.compact_download_events()
+        current["name"] = None
+    finally:
+        conn.close()
+    return statements
+
+
+def check(db_path):
+    """Return [(function, sql, bad plan steps)] for every offending query."""
+    failures = []
+    seen = set()
+    statements = collect_statements(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        for name, sql in statements:
+            if (name, sql) in seen:
+                continue
+            seen.add((name, sql))
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            flat = " ".join(sql.split())
+            bad = _bad_steps(name, flat, plan)
+            if bad:
+                failures.append((name, flat, bad))
+    finally:
+        conn.close()
+    return failures, len(seen)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fail if any db_utils query falls back to a full scan or a temp B-tree sort")
+    parser.add_argument("--db", default=DB_NAME, help="Database to copy and test against")
+    args = parser.parse_args()
+
+    # Work on a copy, the check runs the write paths too
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "plan_check.db")
+    try:
+        source = sqlite3.connect(args.db)
+        target = sqlite3.connect(db_path)
+        source.backup(target)
+        source.close()
+        target.close()
+
+        failures, checked = check(db_path)
+        for name, sql, bad in failures:
+            print(f"{name}: {'; '.join(bad)}")
+            print(f"    {sql}")
+        print(f"Checked {checked} statements, {len(failures)} with a bad plan.")
+        return 1 if failures else 0
+    finally:
+        db_utils.get_pool().close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
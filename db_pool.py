@@ -0,0 +1,361 @@
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+# Applied once when a connection is opened, not on every checkout.
+DEFAULT_PRAGMAS = [
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -16000),      # negative = KiB, so ~16MB of page cache
+    ("mmap_size", 268435456),    # 256MB
+    ("busy_timeout", 5000),      # ms
+]
+
+
+class DatabaseOverloaded(Exception):
+    """Raised instead of queueing more work when the database can't keep up.
+
+    The Flask layer turns this into a 503 so clients back off and retry.
+    """
+
+
+class WriteQueueFull(DatabaseOverloaded):
+    pass
+
+
+class WriteTimeout(DatabaseOverloaded):
+    pass
+
+
+class DatabaseBusy(DatabaseOverloaded):
+    """A write still hit SQLITE_BUSY/SQLITE_LOCKED after every retry."""
+
+
+class PooledConnection(sqlite3.Connection):
+    # Remembers which pool it came from so callers can release it blindly
+    pool = None
+
+
+def run_transaction(conn, fn, *args):
+    """Run fn(conn, *args) and commit, rolling back if it raises.
+
+    The transaction starts with BEGIN IMMEDIATE, taking the write lock up
+    front. A deferred transaction that reads first and then upgrades can
+    fail with SQLITE_BUSY straight away, without the busy timeout applying.
+    """
+    try:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        result = fn(conn, *args)
+        conn.commit()
+        return result
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+
+def is_busy_error(error):
+    """True for SQLITE_BUSY/SQLITE_LOCKED (and their extended codes)."""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error)
+    return "database is locked" in message or "database table is locked" in message
+
+
+class BusyRetry:
+    """Runs write transactions, retrying the ones that lose on lock contention.
+
+    Each attempt already waits up to the connection's busy_timeout for the
+    lock. When that runs out (or SQLite reports busy without waiting), the
+    transaction has been rolled back and is run again after a jittered
+    exponential backoff, up to retries more times. After that DatabaseBusy
+    is raised, which the API turns into a 503. Other errors are not retried.
+    """
+
+    def __init__(self, retries=3, backoff=0.01, max_backoff=0.5):
+        self.retries = retries
+        self.backoff = backoff  # Seconds, doubled on every retry
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "busy": 0,         # Attempts that failed on busy/locked
+            "retried": 0,
+            "recovered": 0,    # Succeeded after at least one retry
+            "gave_up": 0,      # Raised DatabaseBusy
+            "errors": 0,       # Failed for any other database error
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def run(self, conn, fn, *args):
+        attempt = 0
+        while True:
+            try:
+                result = run_transaction(conn, fn, *args)
+            except sqlite3.Error as e:
+                if not is_busy_error(e):
+                    self._count("errors")
+                    raise
+                self._count("busy")
+                if attempt >= self.retries:
+                    self._count("gave_up")
+                    raise DatabaseBusy(f"database still locked after {attempt + 1} attempts: {e}") from e
+                # Full jitter, so writers that collided don't collide again
+                time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+                attempt += 1
+                self._count("retried")
+                continue
+            if attempt:
+                self._count("recovered")
+            return result
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data["max_retries"] = self.retries
+        return data
+
+
+class ConnectionPool:
+    """Keeps SQLite connections open between calls instead of reconnecting.
+
+    Connections are handed out LIFO so a busy thread keeps getting the same
+    warm connection back, and released connections go back on the idle stack
+    (up to max_idle) rather than being closed. Works for thread-per-request
+    servers as well as fixed worker threads.
+    """
+
+    def __init__(self, db_path, pragmas=None, max_idle=8, health_check_interval=30.0, read_only=False,
+                 on_connect=None, factory=PooledConnection):
+        self.db_path = db_path
+        self.read_only = read_only
+        self.on_connect = on_connect  # Called with every newly opened connection
+        self.factory = factory  # A PooledConnection subclass
+        self.pragmas = list(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+
+        self._lock = threading.Lock()
+        self._idle = []  # [(conn, released_at)]
+        self._pid = os.getpid()
+        self._in_use = 0
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "closed": 0,
+            "health_check_failures": 0,
+        }
+
+    def _connect(self):
+        if self.read_only:
+            # mode=ro can't take the write lock at all, query_only also
+            # rejects writes to temp tables and PRAGMAs that would modify
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True,
+                                   check_same_thread=False, factory=self.factory)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=self.factory)
+        conn.pool = self
+        conn.row_factory = sqlite3.Row  # Access columns by name
+        for name, value in self.pragmas:
+            if self.read_only and name == "journal_mode":
+                continue  # Set by the writer, a reader can't change it
+            conn.execute(f"PRAGMA {name} = {value}")
+        if self.read_only:
+            conn.execute("PRAGMA query_only = ON")
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def checkout(self):
+        """Return an open connection, reusing an idle one when possible."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked child: the inherited handles belong to the parent.
+                # Forget them without closing, closing would touch shared state.
+                self._idle = []
+                self._in_use = 0
+                self._pid = os.getpid()
+
+            while self._idle:
+                conn, released_at = self._idle.pop()
+                if time.monotonic() - released_at < self.health_check_interval or self._is_healthy(conn):
+                    self._in_use += 1
+                    self._stats["reused"] += 1
+                    return conn
+                self._stats["health_check_failures"] += 1
+                self._close(conn)
+
+        conn = self._connect()
+        with self._lock:
+            self._in_use += 1
+            self._stats["created"] += 1
+        return conn
+
+    def release(self, conn):
+        """Hand a connection back. Any open transaction is rolled back."""
+        if conn is None:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._lock:
+                self._in_use -= 1
+                self._close(conn)
+            return
+
+        with self._lock:
+            self._in_use -= 1
+            if len(self._idle) < self.max_idle:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._close(conn)
+
+    def _close(self, conn):
+        # Caller holds self._lock
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        self._stats["closed"] += 1
+
+    def close_all(self):
+        with self._lock:
+            for conn, _ in self._idle:
+                self._close(conn)
+            self._idle = []
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["in_use"] = self._in_use
+            data["idle"] = len(self._idle)
+            data["max_idle"] = self.max_idle
+            return data
+
+
+class WriteQueue:
+    """Serializes all writes through one dedicated connection and thread.
+
+    Callers submit a function that takes the writer's connection; it runs
+    inside its own transaction on the writer thread and submit() blocks
+    until it has committed. The queue is bounded, when it is full submit()
+    raises WriteQueueFull straight away instead of piling up more waiters.
+    """
+
+    def __init__(self, pool, max_depth=1000, timeout=30.0, retry=None):
+        self.pool = pool
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.retry = retry  # A BusyRetry, or None to fail on the first busy error
+
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            "submitted": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "timed_out": 0,
+        }
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            # First use, or we are a forked child and the thread didn't come along
+            self._queue = queue.Queue(maxsize=self.max_depth)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        conn = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, fn, args = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if conn is None:
+                    conn = self.pool.checkout()
+                if self.retry is not None:
+                    result = self.retry.run(conn, fn, *args)
+                else:
+                    result = run_transaction(conn, fn, *args)
+            except BaseException as e:
+                with self._lock:
+                    self._stats["failed"] += 1
+                if isinstance(e, sqlite3.Error) and conn is not None:
+                    # Could be a broken connection, let the pool decide next time
+                    self.pool.release(conn)
+                    conn = None
+                future.set_exception(e)
+            else:
+                with self._lock:
+                    self._stats["completed"] += 1
+                future.set_result(result)
+        if conn is not None:
+            self.pool.release(conn)
+
+    def submit(self, fn, *args):
+        """Run fn(conn, *args) on the writer and return its result."""
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((future, fn, args))
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise WriteQueueFull(f"write queue is full ({self.max_depth} pending)")
+        with self._lock:
+            self._stats["submitted"] += 1
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Still queued: drop it. Already running: it will finish on its own.
+            future.cancel()
+            with self._lock:
+                self._stats["timed_out"] += 1
+            raise WriteTimeout(f"write did not complete within {self.timeout}s")
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data["depth"] = self.depth()
+        data["max_depth"] = self.max_depth
+        return data
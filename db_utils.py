@@ -1,25 +1,280 @@
+import base64
+import os
+import re
 import sqlite3
 import json
+import threading
+import time
 from datetime import datetime
 
-DB_NAME = "app_data.db"
+import db_pool
+import migrations
+import profiler
+import recommendations
+import tag_graph
+import trending
+from group_commit import GroupCommitter
+from top_charts import TopCharts
+from ttl_cache import TTLCache
+
+DB_NAME = os.environ.get("APPSTORE_DB_PATH", "app_data.db")
+
+# Connection pool settings (see db_pool.DEFAULT_PRAGMAS for the rest)
+POOL_MAX_IDLE = int(os.environ.get("APPSTORE_DB_POOL_SIZE", 8))
+BUSY_TIMEOUT_MS = int(os.environ.get("APPSTORE_DB_BUSY_TIMEOUT_MS", 5000))
+SYNCHRONOUS = os.environ.get("APPSTORE_DB_SYNCHRONOUS", "NORMAL")
+
+# Split mode: reads go to read-only connections, writes to one writer thread
+SPLIT_RW = os.environ.get("APPSTORE_DB_SPLIT_RW", "0") == "1"
+WRITE_QUEUE_SIZE = int(os.environ.get("APPSTORE_DB_WRITE_QUEUE_SIZE", 1000))
+WRITE_TIMEOUT = float(os.environ.get("APPSTORE_DB_WRITE_TIMEOUT", 30))
+
+# Writes that lose on lock contention are retried with jittered backoff
+BUSY_RETRIES = int(os.environ.get("APPSTORE_DB_BUSY_RETRIES", 3))
+BUSY_BACKOFF_MS = float(os.environ.get("APPSTORE_DB_BUSY_BACKOFF_MS", 10))
+
+# Group commit: installs/uninstalls are batched into one transaction per window
+GROUP_COMMIT = os.environ.get("APPSTORE_GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("APPSTORE_GROUP_COMMIT_WINDOW_MS", 5))
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get("APPSTORE_GROUP_COMMIT_MAX_BATCH", 256))
+
+# Full-text search (see migrations._search_index)
+SEARCH_MAX_LIMIT = 100
+SEARCH_SNIPPET_TOKENS = 12
+SEARCH_WEIGHT_NAME = 10.0        # bm25 column weights
+SEARCH_WEIGHT_DESCRIPTION = 1.0
+SEARCH_WEIGHT_TAGS = 4.0
+SEARCH_BOOST_DOWNLOADS = 0.5     # Up to +50% relevance for very popular apps
+SEARCH_BOOST_RATING = 0.25       # Up to +25% for a 5 star rating
+
+# Assembled get_app_details payloads. Writes in this process invalidate their
+# app, the TTL bounds staleness from writes made by other processes.
+DETAILS_CACHE_SIZE = int(os.environ.get("APPSTORE_DETAILS_CACHE_SIZE", 1024))
+DETAILS_CACHE_TTL = float(os.environ.get("APPSTORE_DETAILS_CACHE_TTL", 5))
+DETAILS_COMMENTS = 5  # Latest comments included with an app's details
+DETAILS_TABLES = ("app", "app_page", "app_tags", "comments", "user")  # What a details payload reads
+MAX_STARS = 5  # rating_histogram buckets are 0 to MAX_STARS
+
+# First pages of the default listings, served from memory (see top_charts.py).
+# A chart is at most TOP_CHART_MAX_AGE seconds behind the database.
+TOP_CHART_SIZE = int(os.environ.get("APPSTORE_TOP_CHART_SIZE", 100))
+TOP_CHART_MAX_AGE = float(os.environ.get("APPSTORE_TOP_CHART_MAX_AGE", 5))
+TOP_CHART_TABLES = ("app", "app_tags")
+
+# "Also installed" recommendations (see recommendations.py), need numpy and scipy
+RECS_ENABLED = os.environ.get("APPSTORE_RECS", "1") == "1" and recommendations.available()
+RECS_TOP_K = int(os.environ.get("APPSTORE_RECS_TOP_K", 20))
+RECS_REBUILD_SECONDS = float(os.environ.get("APPSTORE_RECS_REBUILD_SECONDS", 900))
+RECS_UPDATE_SECONDS = float(os.environ.get("APPSTORE_RECS_UPDATE_SECONDS", 1))
+
+# Trending apps (see trending.py), ranked from the download_events log. Events
+# older than EVENT_RETENTION_HOURS are compacted into per-day totals every
+# EVENT_COMPACT_SECONDS, trending on or off (0 leaves it to the operator).
+TRENDING_ENABLED = os.environ.get("APPSTORE_TRENDING", "1") == "1"
+TRENDING_SIZE = int(os.environ.get("APPSTORE_TRENDING_SIZE", 100))
+TRENDING_REFRESH_SECONDS = float(os.environ.get("APPSTORE_TRENDING_REFRESH_SECONDS", 5))
+TRENDING_DAYS = 7
+EVENT_RETENTION_HOURS = float(os.environ.get("APPSTORE_EVENT_RETENTION_HOURS", 48))
+EVENT_COMPACT_SECONDS = float(os.environ.get("APPSTORE_EVENT_COMPACT_SECONDS", 600))
+
+# Opt-in statement profiler and slow-query log (see profiler.py)
+SQL_PROFILE = os.environ.get("APPSTORE_SQL_PROFILE", "0") == "1"
+SLOW_QUERY_MS = float(os.environ.get("APPSTORE_SLOW_QUERY_MS", 50))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get("APPSTORE_SLOW_QUERY_LOG_SIZE", 200))
+
+_pool = None
+_read_pool = None
+_writer = None
+_download_batcher = None
+_pool_lock = threading.Lock()
+_connect_hooks = []
+_details_cache = TTLCache(max_entries=DETAILS_CACHE_SIZE, ttl=DETAILS_CACHE_TTL)
+_busy_retry = db_pool.BusyRetry(retries=BUSY_RETRIES, backoff=BUSY_BACKOFF_MS / 1000)
+
+def add_connect_hook(fn):
+    # fn(conn) runs on every connection opened from now on (tracing, profiling)
+    _connect_hooks.append(fn)
+
+def _on_connect(conn):
+    for fn in _connect_hooks:
+        fn(conn)
+
+def _connection_factory():
+    if not SQL_PROFILE:
+        return db_pool.PooledConnection
+    if profiler.profiler is None:
+        profiler.profiler = profiler.QueryProfiler(slow_ms=SLOW_QUERY_MS, slow_log_size=SLOW_QUERY_LOG_SIZE)
+    return profiler.ProfiledConnection
+
+def get_query_profile(limit=20, order="total_ms"):
+    # None unless APPSTORE_SQL_PROFILE=1
+    if profiler.profiler is None:
+        return None
+    return {
+        "stats": profiler.profiler.stats(),
+        "statements": profiler.profiler.top(limit, order),
+        "slow": profiler.profiler.slow_queries(),
+    }
+
+def reset_query_profile():
+    if profiler.profiler is not None:
+        profiler.profiler.reset()
+
+def get_pool():
+    # Rebuilt if DB_NAME is pointed somewhere else (scripts, benchmarks)
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.db_path != DB_NAME:
+            if _pool is not None:
+                _pool.close_all()
+                _details_cache.clear()
+            pragmas = [(name, value) for name, value in db_pool.DEFAULT_PRAGMAS
+                       if name not in ("busy_timeout", "synchronous")]
+            pragmas += [("synchronous", SYNCHRONOUS), ("busy_timeout", BUSY_TIMEOUT_MS)]
+            _pool = db_pool.ConnectionPool(DB_NAME, pragmas=pragmas, max_idle=POOL_MAX_IDLE,
+                                           on_connect=_on_connect, factory=_connection_factory())
+            _run_migrations(_pool)
+        return _pool
+
+def _run_migrations(pool):
+    # Once per process and database, before anything reads the new columns
+    conn = pool.checkout()
+    try:
+        migrations.migrate(conn)
+    except sqlite3.Error as e:
+        print(f"Error upgrading database schema: {e}")
+    finally:
+        pool.release(conn)
+
+def reset_after_fork():
+    """Forget the pools, writer threads and cache inherited from the parent.
+
+    Call first thing in a forked worker. The parent's connections are
+    dropped without being closed: closing them would touch state the parent
+    still uses. Everything is rebuilt on first use in the worker.
+    """
+    global _pool, _read_pool, _writer, _download_batcher
+    with _pool_lock:
+        _pool = _read_pool = _writer = _download_batcher = None
+    _details_cache.clear()
+    _top_charts.clear()
+    reset_query_profile()
+
+def shutdown():
+    """Drain the writer queue and close idle connections, for a clean exit."""
+    global _writer
+    if _event_compactor is not None:
+        _event_compactor.stop()  # First, a compaction in progress still goes through the writer
+    with _pool_lock:
+        writer, _writer = _writer, None
+        pools = [pool for pool in (_pool, _read_pool) if pool is not None]
+    if writer is not None:
+        writer.stop()  # Queued writes still run before the thread exits
+    for pool in pools:
+        pool.close_all()
+
+def get_pool_stats():
+    return get_pool().stats()
+
+def _get_read_pool():
+    global _read_pool
+    pragmas = get_pool().pragmas
+    with _pool_lock:
+        if _read_pool is None or _read_pool.db_path != DB_NAME:
+            if _read_pool is not None:
+                _read_pool.close_all()
+            _read_pool = db_pool.ConnectionPool(DB_NAME, pragmas=pragmas, max_idle=POOL_MAX_IDLE,
+                                                read_only=True, on_connect=_on_connect,
+                                                factory=_connection_factory())
+        return _read_pool
+
+def get_writer():
+    global _writer
+    pool = get_pool()
+    with _pool_lock:
+        if _writer is None or _writer.pool is not pool:
+            if _writer is not None:
+                _writer.stop()
+            _writer = db_pool.WriteQueue(pool, max_depth=WRITE_QUEUE_SIZE, timeout=WRITE_TIMEOUT,
+                                         retry=_busy_retry)
+        return _writer
+
+def get_write_queue_stats():
+    if not SPLIT_RW:
+        return None
+    return get_writer().stats()
+
+def get_busy_retry_stats():
+    return _busy_retry.stats()
+
+def get_read_pool_stats():
+    if not SPLIT_RW:
+        return None
+    return _get_read_pool().stats()
+
+def check_database():
+    """Run a real query on a write and, in split mode, a read connection.
+
+    Returns None when both answer, else a description of what failed.
+    """
+    checks = [("write", get_db_connection)]
+    if SPLIT_RW:
+        checks.append(("read", get_read_connection))
+    for label, connect in checks:
+        conn = connect()
+        if not conn:
+            return f"could not open a {label} connection"
+        try:
+            conn.execute("SELECT version FROM table_versions LIMIT 1").fetchall()
+        except sqlite3.Error as e:
+            return f"{label} connection failed: {e}"
+        finally:
+            release_db_connection(conn)
+    return None
 
 def get_db_connection():
     try:
-        conn = sqlite3.connect(DB_NAME)
-        conn.row_factory = sqlite3.Row  # Access columns by name
-        return conn
+        return get_pool().checkout()
+    except sqlite3.Error as e:
+        print(f"Error connecting to database: {e}")
+        return None
+
+def get_read_connection():
+    if not SPLIT_RW:
+        return get_db_connection()
+    try:
+        return _get_read_pool().checkout()
     except sqlite3.Error as e:
         print(f"Error connecting to database: {e}")
         return None
 
+def release_db_connection(conn):
+    if conn is not None:
+        conn.pool.release(conn)
+
+def run_write(fn, *args):
+    """Run fn(conn, *args) in a write transaction and return its result.
+
+    In split mode this goes through the single writer queue and may raise
+    db_pool.WriteQueueFull when it is backed up. Lock contention is retried
+    (see db_pool.BusyRetry) and raises db_pool.DatabaseBusy if it outlasts
+    the retries. Any other sqlite3.Error propagates to the caller.
+    """
+    if SPLIT_RW:
+        return get_writer().submit(fn, *args)
+    conn = get_pool().checkout()
+    try:
+        return _busy_retry.run(conn, fn, *args)
+    finally:
+        release_db_connection(conn)
+
 def get_all_apps(limit=20, offset=0, max_price=None, sort_by='downloads', sort_order='desc'):
-    conn = get_db_connection()
+    conn = get_read_connection()
     if not conn:
         return None
     
     try:
-        query_parts = ["SELECT a.*, (SELECT tag_id FROM app_tags at WHERE at.app_id = a.app_id LIMIT 1) as category FROM app a"]
+        query_parts = ["SELECT a.* FROM app a"]
         params = []
         
         if max_price is not None:
@@ -48,25 +303,59 @@ def get_all_apps(limit=20, offset=0, max_price=None, sort_by='downloads', sort_o
         print(f"Error fetching apps: {e}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+# Apps tagged with a category or one of its related tags, one row per app
+# with the weight of its closest tag (see tag_graph). Joined as a subquery,
+# its one parameter is the category.
+_EXPANDED_TAG_MATCHES = """
+    SELECT at.app_id, MAX(tn.weight) AS tag_weight
+    FROM tag_neighbors tn
+    JOIN app_tags at ON at.tag_id = tn.neighbor_id
+    WHERE tn.tag_id = ?
+    GROUP BY at.app_id
+"""
 
-def get_apps_by_category(category_tag, limit=20, offset=0, max_price=None, sort_by='downloads', sort_order='desc'):
-    conn = get_db_connection()
+def _ensure_tag_neighbors(conn):
+    # Two primary key lookups when current; rebuilt here after the tags change
+    if tag_graph.is_stale(conn):
+        run_write(_rebuild_tag_neighbors)
+
+def _rebuild_tag_neighbors(conn):
+    if tag_graph.is_stale(conn):  # Unless another request got here first
+        tag_graph.rebuild(conn)
+
+def get_apps_by_category(category_tag, limit=20, offset=0, max_price=None, sort_by='downloads', sort_order='desc',
+                         expand=False):
+    """Apps in a category. With expand, apps in related categories follow,
+    closest first (see tag_graph), each row carrying its tag_weight."""
+    conn = get_read_connection()
     if not conn:
         return None
     
     try:
-        base_query = """
-            SELECT a.*, (SELECT tag_id FROM app_tags at WHERE at.app_id = a.app_id LIMIT 1) as category
-            FROM app a
-            JOIN app_tags at ON a.app_id = at.app_id
-            WHERE at.tag_id = ?
-        """
+        if expand:
+            _ensure_tag_neighbors(conn)
+            base_query = f"""
+                SELECT a.*, m.tag_weight
+                FROM ({_EXPANDED_TAG_MATCHES}) m
+                JOIN app a ON a.app_id = m.app_id
+            """
+            conditions = []
+        else:
+            base_query = """
+                SELECT a.*
+                FROM app a
+                JOIN app_tags at ON a.app_id = at.app_id
+            """
+            conditions = ["at.tag_id = ?"]
         params = [category_tag]
         
         if max_price is not None:
-            base_query += " AND price <= ?"
+            conditions.append("price <= ?")
             params.append(max_price)
+        if conditions:
+            base_query += " WHERE " + " AND ".join(conditions)
             
         # Safe sorting
         allowed_sorts = ['price', 'rating', 'downloads', 'app_name']
@@ -75,7 +364,10 @@ def get_apps_by_category(category_tag, limit=20, offset=0, max_price=None, sort_
         if sort_order.lower() not in ['asc', 'desc']:
             sort_order = 'desc'
             
-        base_query += f" ORDER BY {sort_by} {sort_order}"
+        if expand:
+            base_query += f" ORDER BY m.tag_weight DESC, a.{sort_by} {sort_order}"
+        else:
+            base_query += f" ORDER BY {sort_by} {sort_order}"
             
         base_query += " LIMIT ? OFFSET ?"
         params.extend([limit, offset])
@@ -86,14 +378,348 @@ def get_apps_by_category(category_tag, limit=20, offset=0, max_price=None, sort_
         print(f"Error fetching apps by category: {e}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
-def get_app_details(app_id):
-    conn = get_db_connection()
+# --- Top charts ---
+
+def _load_chart(key, size):
+    category_tag, sort_by, sort_order = key
+    if category_tag:
+        return get_apps_by_category(category_tag, size, 0, None, sort_by, sort_order)
+    return get_all_apps(size, 0, None, sort_by, sort_order)
+
+def _chart_version():
+    return get_data_version(TOP_CHART_TABLES)[0]
+
+_top_charts = TopCharts(_load_chart, _chart_version, size=TOP_CHART_SIZE, max_age=TOP_CHART_MAX_AGE)
+
+def get_top_chart_page(category_tag=None, limit=20, offset=0, sort_by='downloads', sort_order='desc'):
+    """The same rows as get_all_apps / get_apps_by_category, from memory.
+
+    Returns (apps, version, refreshed_at) or None when the page can't be
+    served from a chart (past TOP_CHART_SIZE, or a database error), in
+    which case the caller runs the query instead. version is the
+    get_data_version(TOP_CHART_TABLES) the chart was built at. Rows are
+    shared, don't modify them.
+    """
+    # Normalized like the queries do, so equivalent requests share a chart
+    if sort_by not in LISTING_SORTS:
+        sort_by = 'downloads'
+    sort_order = sort_order.lower() if sort_order.lower() in ('asc', 'desc') else 'desc'
+    return _top_charts.page((category_tag or None, sort_by, sort_order), offset, limit)
+
+def get_top_chart_stats():
+    return _top_charts.stats()
+
+# --- Recommendations ---
+
+def _load_installs():
+    conn = get_read_connection()
     if not conn:
+        raise sqlite3.OperationalError("could not connect to the database")
+    try:
+        n_users = (conn.execute("SELECT MAX(user_id) FROM user").fetchone()[0] or 0) + 1
+        n_apps = (conn.execute("SELECT MAX(app_id) FROM app").fetchone()[0] or 0) + 1
+    except BaseException:
+        release_db_connection(conn)
+        raise
+    return n_users, n_apps, _install_batches(conn)
+
+def _install_batches(conn):
+    try:
+        cursor = conn.cursor()
+        cursor.row_factory = None  # Plain tuples, numpy takes them as they are
+        cursor.execute("SELECT user_id, app_id FROM user_apps")
+        while True:
+            rows = cursor.fetchmany(100000)
+            if not rows:
+                break
+            yield rows
+    finally:
+        release_db_connection(conn)
+
+_recommender = recommendations.CoInstallRecommender(
+    _load_installs,
+    top_k=RECS_TOP_K,
+    rebuild_interval=RECS_REBUILD_SECONDS,
+    update_interval=RECS_UPDATE_SECONDS,
+) if RECS_ENABLED else None
+
+def _record_install_event(op, app_id, user_id):
+    if _recommender is not None:
+        _recommender.record(op, app_id, user_id)
+
+def get_similar_apps(app_id, limit=10):
+    """Apps most often installed by the users who installed app_id.
+
+    Returns ([{"app_id", "common_users"}], built_at) from memory, or None
+    while recommendations are off or still being built.
+    """
+    if _recommender is None:
+        return None
+    similar = _recommender.similar(app_id, limit)
+    if similar is None:
+        return None
+    return [{"app_id": other, "common_users": count} for other, count in similar], _recommender.built_at
+
+def get_recommendation_stats():
+    if _recommender is None:
+        return None
+    return _recommender.stats()
+
+# --- Trending ---
+
+def _fetch_download_events(after_id, since):
+    conn = get_read_connection()
+    if not conn:
+        raise sqlite3.OperationalError("could not connect to the database")
+    try:
+        if after_id is not None:
+            events = conn.execute(
+                "SELECT event_id, app_id, delta, created_at FROM download_events WHERE event_id > ?"
+                " ORDER BY event_id", (after_id,)
+            ).fetchall()
+            return [], [tuple(row) for row in events]
+        # One snapshot, so a compaction can't move events between the two reads
+        conn.execute("BEGIN")
+        try:
+            daily = conn.execute(
+                "SELECT day, app_id, downloads FROM download_daily WHERE day >= ?", (int(since // 86400),)
+            ).fetchall()
+            events = conn.execute(
+                "SELECT event_id, app_id, delta, created_at FROM download_events WHERE created_at >= ?", (since,)
+            ).fetchall()
+        finally:
+            conn.rollback()
+        return [tuple(row) for row in daily], [tuple(row) for row in events]
+    finally:
+        release_db_connection(conn)
+
+def compact_download_events(retention_hours=None, days=TRENDING_DAYS):
+    """Fold download events older than retention_hours into download_daily.
+
+    Per-day totals older than days are dropped too. Returns how many
+    events were compacted.
+    """
+    if retention_hours is None:
+        retention_hours = EVENT_RETENTION_HOURS
+    cutoff = time.time() - retention_hours * 3600
+    return run_write(_compact_download_events, cutoff, int(time.time() // 86400) - days + 1)
+
+def _compact_download_events(conn, cutoff, first_day):
+    conn.execute("""
+        INSERT INTO download_daily (day, app_id, downloads)
+        SELECT CAST(created_at / 86400 AS INTEGER) AS day, app_id, SUM(delta)
+        FROM download_events
+        WHERE created_at < ?
+        GROUP BY day, app_id
+        ON CONFLICT (day, app_id) DO UPDATE SET downloads = downloads + excluded.downloads
+    """, (cutoff,))
+    compacted = conn.execute("DELETE FROM download_events WHERE created_at < ?", (cutoff,)).rowcount
+    conn.execute("DELETE FROM download_daily WHERE day < ?", (first_day,))
+    return compacted
+
+_trending = trending.TrendingApps(
+    _fetch_download_events,
+    days=TRENDING_DAYS,
+    size=TRENDING_SIZE,
+    refresh_interval=TRENDING_REFRESH_SECONDS,
+) if TRENDING_ENABLED else None
+# Started by start_event_compaction: the log grows with every install, trending on or off
+_event_compactor = trending.EventCompactor(
+    compact_download_events,
+    interval=EVENT_COMPACT_SECONDS,
+) if EVENT_COMPACT_SECONDS > 0 else None
+
+def get_trending_apps(window='day', limit=20):
+    """Apps with the most net installs lately, recent ones counting more.
+
+    Returns ([{"app_id", "score", "installs"}], ranked_at) from memory, or
+    None while trending is off or still loading. Raises KeyError for a
+    window not in trending.WINDOWS.
+    """
+    if _trending is None:
+        return None
+    top = _trending.top(window, limit)
+    if top is None:
+        return None
+    return [{"app_id": app_id, "score": score, "installs": installs}
+            for app_id, score, installs in top], _trending.ranked_at
+
+def get_trending_stats():
+    if _trending is None:
         return None
+    return _trending.stats()
+
+def start_event_compaction():
+    # Call from worker processes only: a thread in the gunicorn master would
+    # hold its locks across the forks of new workers
+    if _event_compactor is not None:
+        _event_compactor.ensure_started()
+
+def get_event_compaction_stats():
+    if _event_compactor is None:
+        return None
+    return _event_compactor.stats()
+
+def get_data_version(tables):
+    """Return (version, changed_at) covering every table in tables.
+
+    version is a string that changes whenever any of them is written to,
+    changed_at the unix time of the latest of those writes. Both come from
+    table_versions (see migrations._table_versions), a primary key lookup
+    per table, so it is cheap enough to run before deciding on a 304.
+    """
+    conn = get_read_connection()
+    if not conn:
+        return None, None
+    try:
+        return _read_data_version(conn, tables)
+    except sqlite3.Error as e:
+        print(f"Error fetching data version: {e}")
+        return None, None
+    finally:
+        release_db_connection(conn)
+
+# --- Keyset pagination ---
+
+LISTING_SORTS = ['price', 'rating', 'downloads', 'app_name']
+
+class InvalidCursor(ValueError):
+    pass
+
+def _listing_sort(sort_by, sort_order):
+    # Same fallbacks as get_all_apps / get_apps_by_category
+    if sort_by not in LISTING_SORTS:
+        sort_by = 'downloads'
+    sort_order = sort_order.lower() if sort_order.lower() in ['asc', 'desc'] else 'desc'
+    return sort_by, sort_order
+
+def encode_cursor(sort_by, sort_order, row, category_tag=None, max_price=None):
+    # Opaque to clients: base64 of the sort key of the last row they saw,
+    # plus the query it belongs to so it can't be replayed against another
+    sort_by, sort_order = _listing_sort(sort_by, sort_order)
+    payload = {
+        "s": sort_by,
+        "o": sort_order,
+        "v": row[sort_by],
+        "id": row["app_id"],
+        "f": [category_tag, max_price],
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        return payload["s"], payload["o"], payload["v"], int(payload["id"]), payload["f"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f"malformed cursor: {e}")
+
+def get_apps_page(category_tag=None, limit=20, cursor=None, max_price=None, sort_by='downloads', sort_order='desc'):
+    """One page of the catalog ordered by (sort_by, app_id).
+
+    Returns (apps, next_cursor); next_cursor is None on the last page. Pass
+    it back as cursor to continue. Unlike LIMIT/OFFSET the cost doesn't grow
+    with depth, and rows don't shift when download counts change in between.
+    Raises InvalidCursor if the cursor is malformed or from another query.
+    """
+    sort_by, sort_order = _listing_sort(sort_by, sort_order)
+
+    after = None
+    if cursor:
+        cursor_sort, cursor_order, value, last_id, filters = decode_cursor(cursor)
+        if (cursor_sort, cursor_order) != (sort_by, sort_order) or filters != [category_tag, max_price]:
+            raise InvalidCursor("cursor belongs to a different query")
+        after = (value, last_id)
+
+    conn = get_read_connection()
+    if not conn:
+        return None, None
+
+    try:
+        sql = "SELECT a.* FROM app a"
+        conditions = []
+        params = []
+        if category_tag:
+            sql += " JOIN app_tags at ON a.app_id = at.app_id"
+            conditions.append("at.tag_id = ?")
+            params.append(category_tag)
+        if max_price is not None:
+            conditions.append("a.price <= ?")
+            params.append(max_price)
+        if after is not None:
+            # Row-value comparison, app_id breaks ties in the same direction
+            op = "<" if sort_order == 'desc' else ">"
+            conditions.append(f"(a.{sort_by}, a.app_id) {op} (?, ?)")
+            params.extend(after)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY a.{sort_by} {sort_order}, a.app_id {sort_order} LIMIT ?"
+        limit = max(limit, 0)  # A negative LIMIT means no limit to SQLite
+        params.append(limit + 1)  # One extra to learn whether there is a next page
+
+        rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            if rows:  # An empty page has no last row to continue from
+                next_cursor = encode_cursor(sort_by, sort_order, rows[-1], category_tag, max_price)
+        return rows, next_cursor
+    except sqlite3.Error as e:
+        print(f"Error fetching apps page: {e}")
+        return None, None
+    finally:
+        release_db_connection(conn)
+
+def _read_data_version(conn, tables):
+    placeholders = ", ".join("?" * len(tables))
+    rows = conn.execute(
+        f"SELECT name, version, changed_at FROM table_versions WHERE name IN ({placeholders})",
+        list(tables)
+    ).fetchall()
+    versions = {row['name']: row['version'] for row in rows}
+    version = ".".join(str(versions.get(name, 0)) for name in tables)
+    changed_at = max((row['changed_at'] for row in rows), default=None)
+    return version, changed_at
+
+def get_details_cache_stats():
+    return _details_cache.stats()
+
+def invalidate_app(app_id):
+    # Call after the write that changed app_id has committed
+    _details_cache.invalidate(app_id)
+
+def get_app_details(app_id):
+    # Cached payloads are shared between callers, don't modify the result
+    return get_app_details_versioned(app_id)[0]
+
+def get_app_details_versioned(app_id):
+    """Return (details, version) for app_id, details None if it doesn't exist.
+
+    version is the get_data_version(DETAILS_TABLES) the payload was loaded
+    at, which for a cached payload may predate writes made by another
+    process. It is read before the payload, so it is never newer than it.
+    """
+    cached = _details_cache.get(app_id)
+    if cached is not None:
+        return cached
+
+    token = _details_cache.token()
+    result, version = _load_app_details(app_id)
+    if result is not None:
+        _details_cache.put(app_id, (result, version), token)
+    return result, version
+
+def _load_app_details(app_id):
+    conn = get_read_connection()
+    if not conn:
+        return None, None
     
     try:
+        version, _ = _read_data_version(conn, DETAILS_TABLES)
+
         # Fetch app info with developer name
         app_query = """
             SELECT a.*, u.username as developer_name 
@@ -104,7 +730,7 @@ def get_app_details(app_id):
         app = conn.execute(app_query, (app_id,)).fetchone()
         
         if not app:
-            return None
+            return None, version
             
         # Fetch page details
         page_query = "SELECT * FROM app_page WHERE app_id = ?"
@@ -120,72 +746,217 @@ def get_app_details(app_id):
         tags = conn.execute(tags_query, (app_id,)).fetchall()
         tag_list = [row['tag_id'] for row in tags]
 
-        # Fetch comments (limit 5 for now)
+        # Fetch the latest comments
         comments_query = """
             SELECT c.*, u.username 
             FROM comments c
             JOIN user u ON c.user_id = u.user_id
             WHERE c.app_id = ?
-            ORDER BY c.date DESC
-            LIMIT 5
+            ORDER BY c.date DESC, c.comment_id DESC
+            LIMIT ?
         """
-        comments = conn.execute(comments_query, (app_id,)).fetchall()
+        comments = conn.execute(comments_query, (app_id, DETAILS_COMMENTS)).fetchall()
         comment_list = [dict(row) for row in comments]
 
-        result = dict(app)
-        if page:
-            result.update(dict(page))
-            # Parse images JSON if it exists
-            if 'images' in result and result['images']:
-                try:
-                    result['images'] = json.loads(result['images'])
-                except json.JSONDecodeError:
-                    result['images'] = []
-        
-        result['tags'] = tag_list
-        result['comments'] = comment_list
-        
-        return result
+        # Star distribution, at most six rows
+        histogram = conn.execute(
+            "SELECT stars, count FROM rating_histogram WHERE app_id = ?", (app_id,)
+        ).fetchall()
+
+        return _assemble_details(app, page, tag_list, comment_list, histogram), version
+    except sqlite3.Error as e:
+        print(f"Error fetching app details: {e}")
+        return None, None
+    finally:
+        release_db_connection(conn)
+
+def _assemble_details(app, page, tag_list, comment_list, histogram_rows):
+    result = dict(app)
+    if page:
+        result.update(dict(page))
+        if isinstance(result.get('last_update'), bytes):
+            # seed_data.py's datetime adapter stores it as a BLOB
+            result['last_update'] = result['last_update'].decode('utf-8')
+        # Parse images JSON if it exists
+        if 'images' in result and result['images']:
+            try:
+                result['images'] = json.loads(result['images'])
+            except json.JSONDecodeError:
+                result['images'] = []
+
+    result['tags'] = tag_list
+    result['comments'] = comment_list
+    # Comment counts indexed by stars, 0 to 5
+    histogram = [0] * (MAX_STARS + 1)
+    for row in histogram_rows:
+        if 0 <= row['stars'] <= MAX_STARS:
+            histogram[row['stars']] = row['count']
+    result['rating_histogram'] = histogram
+    return result
+
+def get_app_details_batch(app_ids):
+    """Details for many apps at once, in the shape get_app_details returns.
+
+    Returns a list aligned with app_ids holding None for ids that don't
+    exist. Cached apps come from the cache; the rest are loaded with five
+    set-based queries however many there are, the latest comments per app
+    picked with a window function.
+    """
+    found = {}
+    for app_id in dict.fromkeys(app_ids):
+        cached = _details_cache.get(app_id)
+        if cached is not None:
+            found[app_id] = cached[0]
+    wanted = [app_id for app_id in dict.fromkeys(app_ids) if app_id not in found]
+    if not wanted:
+        return [found.get(app_id) for app_id in app_ids]
+
+    token = _details_cache.token()
+    conn = get_read_connection()
+    if not conn:
+        return None
+
+    try:
+        version, _ = _read_data_version(conn, DETAILS_TABLES)
+        # The ids travel as one JSON parameter, no limit on how many
+        ids = json.dumps(wanted)
+        apps = conn.execute("""
+            SELECT a.*, u.username as developer_name
+            FROM app a
+            LEFT JOIN user u ON a.developer_id = u.user_id
+            WHERE a.app_id IN (SELECT value FROM json_each(?))
+        """, (ids,)).fetchall()
+        pages = {row['app_id']: row for row in conn.execute(
+            "SELECT * FROM app_page WHERE app_id IN (SELECT value FROM json_each(?))", (ids,))}
+
+        tags = {}
+        for row in conn.execute("""
+            SELECT at.app_id, t.tag_id
+            FROM tags t
+            JOIN app_tags at ON t.tag_id = at.tag_id
+            WHERE at.app_id IN (SELECT value FROM json_each(?))
+        """, (ids,)):
+            tags.setdefault(row['app_id'], []).append(row['tag_id'])
+
+        comments = {}
+        for row in conn.execute("""
+            SELECT * FROM (
+                SELECT c.*, u.username,
+                       ROW_NUMBER() OVER (PARTITION BY c.app_id ORDER BY c.date DESC, c.comment_id DESC) as rn
+                FROM comments c
+                JOIN user u ON c.user_id = u.user_id
+                WHERE c.app_id IN (SELECT value FROM json_each(?))
+            )
+            WHERE rn <= ?
+            ORDER BY app_id, rn
+        """, (ids, DETAILS_COMMENTS)):
+            comment = dict(row)
+            del comment['rn']
+            comments.setdefault(row['app_id'], []).append(comment)
+
+        histograms = {}
+        for row in conn.execute(
+                "SELECT app_id, stars, count FROM rating_histogram WHERE app_id IN (SELECT value FROM json_each(?))",
+                (ids,)):
+            histograms.setdefault(row['app_id'], []).append(row)
+
+        for app in apps:
+            app_id = app['app_id']
+            result = _assemble_details(app, pages.get(app_id), tags.get(app_id, []), comments.get(app_id, []),
+                                       histograms.get(app_id, []))
+            _details_cache.put(app_id, (result, version), token)
+            found[app_id] = result
+        return [found.get(app_id) for app_id in app_ids]
     except sqlite3.Error as e:
         print(f"Error fetching app details: {e}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+def _fts_query(query_string):
+    # Quote every word so user input can't inject FTS5 syntax, and prefix
+    # match the last one so results show up while the user is still typing
+    terms = re.findall(r"\w+", query_string or "")
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
 
-def search_apps(query_string, category_tag=None, max_price=None, sort_by='downloads', sort_order='desc'):
-    conn = get_db_connection()
+def search_apps(query_string, category_tag=None, max_price=None, sort_by='downloads', sort_order='desc',
+                limit=20, offset=0, expand=False):
+    """Full-text search, optionally within a category.
+
+    sort_by='relevance' ranks by the full-text match; the column sorts use
+    relevance to break ties. With expand, the category also takes in its
+    related ones (see tag_graph): each row carries its tag_weight, which
+    scales relevance, and by relevance with no query to rank by the closest
+    categories come first.
+    """
+    conn = get_read_connection()
     if not conn:
         return None
     
     try:
-        if category_tag:
-             sql = """
-                SELECT a.*, (SELECT tag_id FROM app_tags at WHERE at.app_id = a.app_id LIMIT 1) as category
-                FROM app a
-                JOIN app_tags at ON a.app_id = at.app_id
-                WHERE a.app_name LIKE ? AND at.tag_id = ?
-            """
-             params = [f'%{query_string}%', category_tag]
+        limit = max(0, min(int(limit), SEARCH_MAX_LIMIT))
+        offset = max(0, int(offset))
+        match = _fts_query(query_string)
+        expand = bool(expand and category_tag)
+        weighted = ", m.tag_weight" if expand else ""
+        scale = " * m.tag_weight" if expand else ""
+
+        if match is None:
+            # Nothing to match on, same as an unfiltered listing
+            sql = f"SELECT a.*, NULL as snippet, 0 as relevance{weighted} FROM app a"
+            params = []
         else:
-            sql = """
-                SELECT a.*, (SELECT tag_id FROM app_tags at WHERE at.app_id = a.app_id LIMIT 1) as category
-                FROM app a
-                WHERE a.app_name LIKE ?
+            # bm25 is negative (lower is better), so scaling it up by
+            # popularity and rating pushes well-liked apps further ahead
+            sql = f"""
+                SELECT a.*,
+                       snippet(app_search, -1, '<mark>', '</mark>', '…', {SEARCH_SNIPPET_TOKENS}) as snippet,
+                       bm25(app_search, {SEARCH_WEIGHT_NAME}, {SEARCH_WEIGHT_DESCRIPTION}, {SEARCH_WEIGHT_TAGS})
+                         * (1 + {SEARCH_BOOST_DOWNLOADS} * a.downloads / (a.downloads + 100.0)
+                              + {SEARCH_BOOST_RATING} * a.rating / 5.0){scale} as relevance
+                       {weighted}
+                FROM app_search
+                JOIN app a ON a.app_id = app_search.rowid
             """
-            params = [f'%{query_string}%']
-            
+            params = []
+
+        conditions = []
+        if expand:
+            _ensure_tag_neighbors(conn)
+            sql += f" JOIN ({_EXPANDED_TAG_MATCHES}) m ON m.app_id = a.app_id"
+            params.append(category_tag)
+        elif category_tag:
+            sql += " JOIN app_tags at ON a.app_id = at.app_id"
+            conditions.append("at.tag_id = ?")
+            params.append(category_tag)
+        if match is not None:
+            conditions.append("app_search MATCH ?")
+            params.append(match)
         if max_price is not None:
-            sql += " AND price <= ?"
+            conditions.append("a.price <= ?")
             params.append(max_price)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
             
         # Safe sorting
         allowed_sorts = ['price', 'rating', 'downloads', 'app_name']
-        if sort_by not in allowed_sorts:
-            sort_by = 'downloads'
         if sort_order.lower() not in ['asc', 'desc']:
             sort_order = 'desc'
-            
-        sql += f" ORDER BY {sort_by} {sort_order}"
+        if sort_by in allowed_sorts:
+            sql += f" ORDER BY a.{sort_by} {sort_order}, relevance"
+        elif match is not None:
+            sql += " ORDER BY relevance"
+        elif expand:
+            sql += " ORDER BY m.tag_weight DESC, a.downloads DESC"
+        else:
+            sql += " ORDER BY a.downloads DESC"
+
+        sql += " LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
 
         apps = conn.execute(sql, params).fetchall()
         return [dict(row) for row in apps]
@@ -193,10 +964,10 @@ def search_apps(query_string, category_tag=None, max_price=None, sort_by='downlo
         print(f"Error searching apps: {e}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def get_categories():
-    conn = get_db_connection()
+    conn = get_read_connection()
     if not conn:
         return None
     
@@ -208,10 +979,10 @@ def get_categories():
         print(f"Error fetching categories: {e}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def get_all_users():
-    conn = get_db_connection()
+    conn = get_read_connection()
     if not conn:
         return None
     try:
@@ -229,232 +1000,299 @@ def get_all_users():
         print(f"Error fetching users: {e}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
-def record_download(app_id, user_id):
-    conn = get_db_connection()
-    if not conn:
-        return False
+def _json_list_append(conn, table, column, key_column, key, value):
+    # Appends value to a JSON id-list cache column without re-reading the source table
+    conn.execute(f"""
+        UPDATE {table}
+        SET {column} = json_insert(COALESCE({column}, '[]'), '$[#]', ?)
+        WHERE {key_column} = ?
+    """, (value, key))
+
+def _json_list_remove(conn, table, column, key_column, key, value):
+    conn.execute(f"""
+        UPDATE {table}
+        SET {column} = json_remove({column}, (SELECT fullkey FROM json_each({table}.{column}) WHERE value = ? LIMIT 1))
+        WHERE {key_column} = ? AND EXISTS (SELECT 1 FROM json_each({table}.{column}) WHERE value = ?)
+    """, (value, key, value))
+
+def _record_download(conn, app_id, user_id):
+    # 1. Insert into user_apps (ignore if already exists)
+    cursor = conn.execute("INSERT OR IGNORE INTO user_apps (app_id, user_id) VALUES (?, ?)", (app_id, user_id))
+    if cursor.rowcount == 0:
+        return True # Already installed, caches are unchanged
     
-    try:
-        # 1. Insert into user_apps (ignore if already exists)
-        conn.execute("INSERT OR IGNORE INTO user_apps (app_id, user_id) VALUES (?, ?)", (app_id, user_id))
-        
-        # 2. Update app download count
-        conn.execute("""
-            UPDATE app 
-            SET downloads = (SELECT COUNT(*) FROM user_apps WHERE app_id = ?)
-            WHERE app_id = ?
-        """, (app_id, app_id))
-
-        # 3. Update user.app_ids cache
-        cursor = conn.cursor()
-        cursor.execute("SELECT app_id FROM user_apps WHERE user_id = ?", (user_id,))
-        app_ids = [row[0] for row in cursor.fetchall()]
-        conn.execute("UPDATE user SET app_ids = ? WHERE user_id = ?", (json.dumps(app_ids), user_id))
+    # 2. Update app download count
+    conn.execute("UPDATE app SET downloads = downloads + 1 WHERE app_id = ?", (app_id,))
+
+    # 3. Update user.app_ids cache
+    _json_list_append(conn, "user", "app_ids", "user_id", user_id, app_id)
+    return True
 
-        conn.commit()
-        return True
+def record_download(app_id, user_id):
+    try:
+        if GROUP_COMMIT:
+            result = _get_download_batcher().submit(("install", app_id, user_id))
+        else:
+            result = run_write(_record_download, app_id, user_id)
+        _record_install_event("install", app_id, user_id)
+        return result
     except sqlite3.Error as e:
         print(f"Error recording download: {e}")
         return False
     finally:
-        conn.close()
+        invalidate_app(app_id)
 
-def remove_download(app_id, user_id):
-    conn = get_db_connection()
-    if not conn:
-        return False
-    
-    try:
-        # 1. Delete from user_apps
-        conn.execute("DELETE FROM user_apps WHERE app_id = ? AND user_id = ?", (app_id, user_id))
+def _remove_download(conn, app_id, user_id):
+    # 1. Delete from user_apps
+    cursor = conn.execute("DELETE FROM user_apps WHERE app_id = ? AND user_id = ?", (app_id, user_id))
+    if cursor.rowcount == 0:
+        return True # Wasn't installed
 
-        # 3. Update user.app_ids cache
-        cursor = conn.cursor()
-        cursor.execute("SELECT app_id FROM user_apps WHERE user_id = ?", (user_id,))
-        app_ids = [row[0] for row in cursor.fetchall()]
-        conn.execute("UPDATE user SET app_ids = ? WHERE user_id = ?", (json.dumps(app_ids), user_id))
+    # 2. Update app download count
+    conn.execute("UPDATE app SET downloads = downloads - 1 WHERE app_id = ?", (app_id,))
+
+    # 3. Update user.app_ids cache
+    _json_list_remove(conn, "user", "app_ids", "user_id", user_id, app_id)
+    return True
 
-        conn.commit()
-        return True
+def remove_download(app_id, user_id):
+    try:
+        if GROUP_COMMIT:
+            result = _get_download_batcher().submit(("uninstall", app_id, user_id))
+        else:
+            result = run_write(_remove_download, app_id, user_id)
+        _record_install_event("uninstall", app_id, user_id)
+        return result
     except sqlite3.Error as e:
         print(f"Error removing download: {e}")
         return False
     finally:
-        conn.close()
+        invalidate_app(app_id)
 
-def add_comment(app_id, user_id, stars, comment_text):
-    conn = get_db_connection()
-    if not conn:
+def _apply_download_batch(conn, events):
+    # events: [(op, app_id, user_id)] in arrival order, op is install/uninstall
+    download_deltas = {}
+    for op, app_id, user_id in events:
+        if op == "install":
+            cursor = conn.execute("INSERT OR IGNORE INTO user_apps (app_id, user_id) VALUES (?, ?)", (app_id, user_id))
+            if cursor.rowcount:
+                download_deltas[app_id] = download_deltas.get(app_id, 0) + 1
+                _json_list_append(conn, "user", "app_ids", "user_id", user_id, app_id)
+        else:
+            cursor = conn.execute("DELETE FROM user_apps WHERE app_id = ? AND user_id = ?", (app_id, user_id))
+            if cursor.rowcount:
+                download_deltas[app_id] = download_deltas.get(app_id, 0) - 1
+                _json_list_remove(conn, "user", "app_ids", "user_id", user_id, app_id)
+
+    # One counter update per app for the whole batch
+    conn.executemany(
+        "UPDATE app SET downloads = downloads + ? WHERE app_id = ?",
+        [(delta, app_id) for app_id, delta in download_deltas.items() if delta]
+    )
+    return [True] * len(events)
+
+def _get_download_batcher():
+    global _download_batcher
+    with _pool_lock:
+        if _download_batcher is None:
+            _download_batcher = GroupCommitter(
+                lambda events: run_write(_apply_download_batch, events),
+                max_batch=GROUP_COMMIT_MAX_BATCH,
+                max_wait=GROUP_COMMIT_WINDOW_MS / 1000,
+                max_pending=WRITE_QUEUE_SIZE,
+                timeout=WRITE_TIMEOUT,
+            )
+        return _download_batcher
+
+def get_group_commit_stats():
+    if not GROUP_COMMIT:
         return None
-    
-    try:
-        cursor = conn.cursor()
-        # 1. Insert comment
-        cursor.execute(
-            "INSERT INTO comments (app_id, user_id, stars, comment) VALUES (?, ?, ?, ?)",
-            (app_id, user_id, stars, comment_text)
+    return _get_download_batcher().stats()
+
+def _rating_histogram_add(conn, app_id, stars, delta):
+    # delta comments (+1/-1) with these stars, in their bucket (see
+    # migrations._rating_histogram). An emptied bucket resets its total so
+    # float error can't linger. A comment without stars isn't counted.
+    if stars is None:
+        return
+    conn.execute(f"""
+        INSERT INTO rating_histogram (app_id, stars, count, total)
+        VALUES (?, {migrations.STAR_BUCKET.format(stars="?")}, ?, ? * ?)
+        ON CONFLICT (app_id, stars) DO UPDATE SET
+            count = count + excluded.count,
+            total = CASE WHEN count + excluded.count > 0 THEN total + excluded.total ELSE 0 END
+    """, (app_id, stars, delta, delta, stars))
+
+def _derive_rating(conn, app_id):
+    # rating_count, rating_sum and rating all follow from the app's at most six buckets
+    conn.execute("""
+        UPDATE app
+        SET (rating_count, rating_sum, rating) = (
+            SELECT COALESCE(SUM(h.count), 0), COALESCE(SUM(h.total), 0),
+                   COALESCE(SUM(h.total) / NULLIF(SUM(h.count), 0), 0)
+            FROM rating_histogram h
+            WHERE h.app_id = app.app_id
         )
-        new_comment_id = cursor.lastrowid
-
-        # 2. Update app_page.comment_ids cache
-        cursor.execute("SELECT comment_id FROM comments WHERE app_id = ?", (app_id,))
-        app_comment_ids = [row[0] for row in cursor.fetchall()]
-        conn.execute("UPDATE app_page SET comment_ids = ? WHERE app_id = ?", (json.dumps(app_comment_ids), app_id))
-
-        # 3. Update user.comment_ids cache
-        cursor.execute("SELECT comment_id FROM comments WHERE user_id = ?", (user_id,))
-        user_comment_ids = [row[0] for row in cursor.fetchall()]
-        conn.execute("UPDATE user SET comment_ids = ? WHERE user_id = ?", (json.dumps(user_comment_ids), user_id))
-
-        # 4. Update app rating
-        conn.execute("""
-            UPDATE app 
-            SET rating = COALESCE((SELECT AVG(stars) FROM comments WHERE app_id = ?), 0)
-            WHERE app_id = ?
-        """, (app_id, app_id))
-
-        conn.commit()
-        return new_comment_id
+        WHERE app_id = ?
+    """, (app_id,))
+
+def _add_comment(conn, app_id, user_id, stars, comment_text):
+    cursor = conn.cursor()
+    # 1. Insert comment
+    cursor.execute(
+        "INSERT INTO comments (app_id, user_id, stars, comment) VALUES (?, ?, ?, ?)",
+        (app_id, user_id, stars, comment_text)
+    )
+    new_comment_id = cursor.lastrowid
+
+    # 2. Update app_page.comment_ids cache
+    _json_list_append(conn, "app_page", "comment_ids", "app_id", app_id, new_comment_id)
+
+    # 3. Update user.comment_ids cache
+    _json_list_append(conn, "user", "comment_ids", "user_id", user_id, new_comment_id)
+
+    # 4. Count it in the histogram and re-derive the app rating
+    _rating_histogram_add(conn, app_id, stars, 1)
+    _derive_rating(conn, app_id)
+    return new_comment_id
+
+def add_comment(app_id, user_id, stars, comment_text):
+    try:
+        return run_write(_add_comment, app_id, user_id, stars, comment_text)
     except sqlite3.Error as e:
         print(f"Error adding comment: {e}")
         return None
     finally:
-        conn.close()
+        invalidate_app(app_id)
 
-def update_comment(comment_id, user_id, stars, comment_text):
-    conn = get_db_connection()
-    if not conn:
-        return False
-    
-    try:
-        cursor = conn.cursor()
-        # Verify ownership and get app_id
-        cursor.execute("SELECT user_id, app_id FROM comments WHERE comment_id = ?", (comment_id,))
-        row = cursor.fetchone()
-        if not row or row['user_id'] != user_id:
-            return False # Not found or not owner
-            
-        app_id = row['app_id']
+def _update_comment(conn, comment_id, user_id, stars, comment_text):
+    cursor = conn.cursor()
+    # Verify ownership and get app_id
+    cursor.execute("SELECT user_id, app_id, stars FROM comments WHERE comment_id = ?", (comment_id,))
+    row = cursor.fetchone()
+    if not row or row['user_id'] != user_id:
+        return False # Not found or not owner
+        
+    app_id = row['app_id']
+    old_stars = row['stars']
 
-        cursor.execute(
-            "UPDATE comments SET stars = ?, comment = ? WHERE comment_id = ?",
-            (stars, comment_text, comment_id)
-        )
+    cursor.execute(
+        "UPDATE comments SET stars = ?, comment = ? WHERE comment_id = ?",
+        (stars, comment_text, comment_id)
+    )
 
-        # Update app rating
-        conn.execute("""
-            UPDATE app 
-            SET rating = COALESCE((SELECT AVG(stars) FROM comments WHERE app_id = ?), 0)
-            WHERE app_id = ?
-        """, (app_id, app_id))
+    # Move it between histogram buckets and re-derive the app rating
+    _rating_histogram_add(conn, app_id, old_stars, -1)
+    _rating_histogram_add(conn, app_id, stars, 1)
+    _derive_rating(conn, app_id)
+    return True
 
-        conn.commit()
-        return True
+def _comment_app_id(comment_id):
+    # A comment never moves between apps, so this can be read before the write
+    conn = get_read_connection()
+    if not conn:
+        return None
+    try:
+        row = conn.execute("SELECT app_id FROM comments WHERE comment_id = ?", (comment_id,)).fetchone()
+        return row['app_id'] if row else None
+    except sqlite3.Error as e:
+        print(f"Error fetching comment: {e}")
+        return None
+    finally:
+        release_db_connection(conn)
+
+def update_comment(comment_id, user_id, stars, comment_text):
+    app_id = _comment_app_id(comment_id)
+    try:
+        return run_write(_update_comment, comment_id, user_id, stars, comment_text)
     except sqlite3.Error as e:
         print(f"Error updating comment: {e}")
         return False
     finally:
-        conn.close()
+        if app_id is not None:
+            invalidate_app(app_id)
 
-def delete_comment(comment_id, user_id):
-    conn = get_db_connection()
-    if not conn:
+def _delete_comment(conn, comment_id, user_id):
+    cursor = conn.cursor()
+    # Verify ownership and get app_id for cache update
+    cursor.execute("SELECT user_id, app_id, stars FROM comments WHERE comment_id = ?", (comment_id,))
+    row = cursor.fetchone()
+    if not row or row['user_id'] != user_id:
         return False
+        
+    app_id = row['app_id']
+    old_stars = row['stars']
+
+    # Delete
+    cursor.execute("DELETE FROM comments WHERE comment_id = ?", (comment_id,))
     
-    try:
-        cursor = conn.cursor()
-        # Verify ownership and get app_id for cache update
-        cursor.execute("SELECT user_id, app_id FROM comments WHERE comment_id = ?", (comment_id,))
-        row = cursor.fetchone()
-        if not row or row['user_id'] != user_id:
-            return False
-            
-        app_id = row['app_id']
+    # Update caches (app_page and user)
+    # 1. App Page
+    _json_list_remove(conn, "app_page", "comment_ids", "app_id", app_id, comment_id)
 
-        # Delete
-        cursor.execute("DELETE FROM comments WHERE comment_id = ?", (comment_id,))
-        
-        # Update caches (app_page and user)
-        # 1. App Page
-        cursor.execute("SELECT comment_id FROM comments WHERE app_id = ?", (app_id,))
-        app_comment_ids = [r[0] for r in cursor.fetchall()]
-        conn.execute("UPDATE app_page SET comment_ids = ? WHERE app_id = ?", (json.dumps(app_comment_ids), app_id))
-
-        # 2. User
-        cursor.execute("SELECT comment_id FROM comments WHERE user_id = ?", (user_id,))
-        user_comment_ids = [r[0] for r in cursor.fetchall()]
-        conn.execute("UPDATE user SET comment_ids = ? WHERE user_id = ?", (json.dumps(user_comment_ids), user_id))
-
-        # 3. Update app rating
-        conn.execute("""
-            UPDATE app 
-            SET rating = COALESCE((SELECT AVG(stars) FROM comments WHERE app_id = ?), 0)
-            WHERE app_id = ?
-        """, (app_id, app_id))
-
-        conn.commit()
-        return True
+    # 2. User
+    _json_list_remove(conn, "user", "comment_ids", "user_id", user_id, comment_id)
+
+    # 3. Take it out of the histogram and re-derive the app rating
+    _rating_histogram_add(conn, app_id, old_stars, -1)
+    _derive_rating(conn, app_id)
+    return True
+
+def delete_comment(comment_id, user_id):
+    app_id = _comment_app_id(comment_id)
+    try:
+        return run_write(_delete_comment, comment_id, user_id)
     except sqlite3.Error as e:
         print(f"Error deleting comment: {e}")
         return False
     finally:
-        conn.close()
+        if app_id is not None:
+            invalidate_app(app_id)
 
 # --- Reporting System ---
 
-def add_report(comment_id, reason):
-    conn = get_db_connection()
-    if not conn:
-        return False
+def _add_report(conn, comment_id, reason):
+    cursor = conn.cursor()
+    # Get comment details to find the author (reported_user)
+    cursor.execute("SELECT user_id, app_id FROM comments WHERE comment_id = ?", (comment_id,))
+    row = cursor.fetchone()
+    if not row:
+        return False # Comment not found
         
+    reported_user_id = row['user_id']
+    # We don't necessarily associate with app_id in the reports table for user reports, 
+    # but the schema has reported_app_id. For comment reports, it's primarily about the user and comment.
+    # Let's verify schema usage. 
+    # The schema has reported_app_id, reported_user_id, reported_comment_id.
+    # For a comment report, we should set reported_user_id (author) and reported_comment_id.
+    
+    cursor.execute("""
+        INSERT INTO reports (reported_user_id, reported_comment_id, comment)
+        VALUES (?, ?, ?)
+    """, (reported_user_id, comment_id, reason))
+    
+    # Update user_reports cache
+    report_id = cursor.lastrowid
+    
+    cursor.execute("""
+        INSERT INTO user_reports (user_id, report_ids)
+        VALUES (?, json_array(?))
+        ON CONFLICT (user_id) DO UPDATE
+        SET report_ids = json_insert(COALESCE(report_ids, '[]'), '$[#]', ?)
+    """, (reported_user_id, report_id, report_id))
+    return True
+
+def add_report(comment_id, reason):
     try:
-        cursor = conn.cursor()
-        # Get comment details to find the author (reported_user)
-        cursor.execute("SELECT user_id, app_id FROM comments WHERE comment_id = ?", (comment_id,))
-        row = cursor.fetchone()
-        if not row:
-            return False # Comment not found
-            
-        reported_user_id = row['user_id']
-        # We don't necessarily associate with app_id in the reports table for user reports, 
-        # but the schema has reported_app_id. For comment reports, it's primarily about the user and comment.
-        # Let's verify schema usage. 
-        # The schema has reported_app_id, reported_user_id, reported_comment_id.
-        # For a comment report, we should set reported_user_id (author) and reported_comment_id.
-        
-        cursor.execute("""
-            INSERT INTO reports (reported_user_id, reported_comment_id, comment)
-            VALUES (?, ?, ?)
-        """, (reported_user_id, comment_id, reason))
-        
-        # Update user_reports cache
-        report_id = cursor.lastrowid
-        
-        cursor.execute("SELECT report_ids FROM user_reports WHERE user_id = ?", (reported_user_id,))
-        row = cursor.fetchone()
-        if row and row['report_ids']:
-            ids = json.loads(row['report_ids'])
-        else:
-            ids = []
-        ids.append(report_id)
-        
-        cursor.execute("""
-            INSERT OR REPLACE INTO user_reports (user_id, report_ids)
-            VALUES (?, ?)
-        """, (reported_user_id, json.dumps(ids)))
-        
-        conn.commit()
-        return True
+        return run_write(_add_report, comment_id, reason)
     except sqlite3.Error as e:
         print(f"Error adding report: {e}")
         return False
-    finally:
-        conn.close()
 
 def get_reported_users():
-    conn = get_db_connection()
+    conn = get_read_connection()
     if not conn:
         return None
         
@@ -485,10 +1323,10 @@ def get_reported_users():
         print(f"Error fetching reported users: {e}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def get_user_reports(user_id):
-    conn = get_db_connection()
+    conn = get_read_connection()
     if not conn:
         return None
         
@@ -509,46 +1347,35 @@ def get_user_reports(user_id):
         print(f"Error fetching user reports: {e}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+def _add_app_report(conn, app_id, reason):
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        INSERT INTO reports (reported_app_id, comment)
+        VALUES (?, ?)
+    """, (app_id, reason))
+    report_id = cursor.lastrowid
+    
+    # Update app_reports cache
+    cursor.execute("""
+        INSERT INTO app_reports (app_id, report_ids)
+        VALUES (?, json_array(?))
+        ON CONFLICT (app_id) DO UPDATE
+        SET report_ids = json_insert(COALESCE(report_ids, '[]'), '$[#]', ?)
+    """, (app_id, report_id, report_id))
+    return True
 
 def add_app_report(app_id, reason):
-    conn = get_db_connection()
-    if not conn:
-        return False
-        
     try:
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO reports (reported_app_id, comment)
-            VALUES (?, ?)
-        """, (app_id, reason))
-        report_id = cursor.lastrowid
-        
-        # Update app_reports cache
-        cursor.execute("SELECT report_ids FROM app_reports WHERE app_id = ?", (app_id,))
-        row = cursor.fetchone()
-        if row and row['report_ids']:
-            ids = json.loads(row['report_ids'])
-        else:
-            ids = []
-        ids.append(report_id)
-        
-        cursor.execute("""
-            INSERT OR REPLACE INTO app_reports (app_id, report_ids)
-            VALUES (?, ?)
-        """, (app_id, json.dumps(ids)))
-        
-        conn.commit()
-        return True
+        return run_write(_add_app_report, app_id, reason)
     except sqlite3.Error as e:
         print(f"Error adding app report: {e}")
         return False
-    finally:
-        conn.close()
 
 def get_reported_apps():
-    conn = get_db_connection()
+    conn = get_read_connection()
     if not conn:
         return None
         
@@ -580,10 +1407,10 @@ def get_reported_apps():
         print(f"Error fetching reported apps: {e}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def get_app_reports(app_id):
-    conn = get_db_connection()
+    conn = get_read_connection()
     if not conn:
         return None
         
@@ -600,42 +1427,39 @@ def get_app_reports(app_id):
         print(f"Error fetching app reports: {e}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 # --- Admin Tools ---
 
+def _add_app(conn, name, price, description, category_tag, icon_url, images, developer_id):
+    cursor = conn.cursor()
+    
+    # 1. Insert App
+    cursor.execute("""
+        INSERT INTO app (app_name, icon, price, developer_id, category) VALUES (?, ?, ?, ?, ?)
+    """, (name, icon_url, price, developer_id, category_tag))
+    app_id = cursor.lastrowid
+    
+    # 2. Insert App Page
+    cursor.execute("""
+        INSERT INTO app_page (app_id, description, images, last_update)
+        VALUES (?, ?, ?, ?)
+    """, (app_id, description, json.dumps(images), datetime.now()))
+    
+    # 3. Insert Tag
+    cursor.execute("""
+        INSERT OR IGNORE INTO app_tags (app_id, tag_id) VALUES (?, ?)
+    """, (app_id, category_tag))
+    
+    # Update tag amount
+    cursor.execute("UPDATE tags SET amount = amount + 1 WHERE tag_id = ?", (category_tag,))
+    return app_id
+
 def add_app(name, price, description, category_tag, icon_url, images, developer_id=None):
-    conn = get_db_connection()
-    if not conn:
-        return None
-        
     try:
-        cursor = conn.cursor()
-        
-        # 1. Insert App
-        cursor.execute("""
-            INSERT INTO app (app_name, icon, price, developer_id) VALUES (?, ?, ?, ?)
-        """, (name, icon_url, price, developer_id))
-        app_id = cursor.lastrowid
-        
-        # 2. Insert App Page
-        cursor.execute("""
-            INSERT INTO app_page (app_id, description, images, last_update)
-            VALUES (?, ?, ?, ?)
-        """, (app_id, description, json.dumps(images), datetime.now()))
-        
-        # 3. Insert Tag
-        cursor.execute("""
-            INSERT OR IGNORE INTO app_tags (app_id, tag_id) VALUES (?, ?)
-        """, (app_id, category_tag))
-        
-        # Update tag amount
-        cursor.execute("UPDATE tags SET amount = amount + 1 WHERE tag_id = ?", (category_tag,))
-        
-        conn.commit()
-        return app_id
+        app_id = run_write(_add_app, name, price, description, category_tag, icon_url, images, developer_id)
     except sqlite3.Error as e:
         print(f"Error adding app: {e}")
         return None
-    finally:
-        conn.close()
+    invalidate_app(app_id)
+    return app_id
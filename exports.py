@@ -0,0 +1,161 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+import db_utils
+
+FETCH_SIZE = 500  # Rows pulled from SQLite per round trip
+GZIP_LEVEL = 5
+
+# kind -> (query, column the since filter applies to)
+# Ordered by primary key so a partner can resume a pull where it stopped.
+EXPORTS = {
+    "apps": ("""
+        SELECT a.app_id, a.app_name, a.icon, a.price, a.rating, a.rating_count, a.downloads,
+               a.developer_id, a.category, p.description, p.images,
+               CAST(p.last_update AS TEXT) as last_update,  -- seed_data.py stores some as BLOB
+               (SELECT json_group_array(at.tag_id) FROM app_tags at WHERE at.app_id = a.app_id) as tags
+        FROM app a
+        LEFT JOIN app_page p ON p.app_id = a.app_id
+        {where}
+        ORDER BY a.app_id
+    """, "p.last_update"),
+    "comments": ("""
+        SELECT c.comment_id, c.app_id, c.user_id, c.stars, c.comment, c.date
+        FROM comments c
+        {where}
+        ORDER BY c.comment_id
+    """, "c.date"),
+    "installs": ("""
+        SELECT ua.app_id, ua.user_id
+        FROM user_apps ua
+        {where}
+        ORDER BY ua.app_id, ua.user_id
+    """, None),
+}
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Columns holding JSON text, decoded for NDJSON and flattened for CSV
+JSON_COLUMNS = ("images", "tags")
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_since(value):
+    """Validate an ISO 8601 since parameter, returning it normalized."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).isoformat(sep=" ")
+    except ValueError:
+        raise ExportError(f"since must be an ISO 8601 date or timestamp, got {value!r}")
+
+
+def _query(kind, since):
+    if kind not in EXPORTS:
+        raise ExportError(f"unknown export {kind!r}, expected one of {', '.join(EXPORTS)}")
+    sql, since_column = EXPORTS[kind]
+    if since is None:
+        return sql.format(where=""), []
+    if since_column is None:
+        raise ExportError(f"{kind} export has no timestamp to filter on")
+    # datetime() so 'T' and ' ' separated timestamps compare correctly
+    return sql.format(where=f"WHERE datetime({since_column}) >= datetime(?)"), [since]
+
+
+def iter_batches(kind, since=None, fetch_size=None):
+    """Yield (columns, rows) batches of one export, fetch_size rows at a time.
+
+    Holds one read connection for the life of the generator and only ever
+    fetch_size rows in memory. The query is checked before the first yield,
+    so a bad kind or since raises ExportError straight away.
+    """
+    sql, params = _query(kind, since)
+    return _batches(sql, params, fetch_size or FETCH_SIZE)
+
+
+def _batches(sql, params, fetch_size):
+    conn = db_utils.get_read_connection()
+    if not conn:
+        return
+    try:
+        cursor = conn.execute(sql, params)
+        columns = [d[0] for d in cursor.description]
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield columns, rows
+    finally:
+        db_utils.release_db_connection(conn)
+
+
+def _decode(value):
+    try:
+        return json.loads(value) if value else []
+    except json.JSONDecodeError:
+        return []
+
+
+def _ndjson(batches, dumps):
+    for columns, rows in batches:
+        json_indexes = [i for i, name in enumerate(columns) if name in JSON_COLUMNS]
+        lines = []
+        for row in rows:
+            record = dict(zip(columns, row))
+            for i in json_indexes:
+                record[columns[i]] = _decode(row[i])
+            lines.append(dumps(record))
+        yield b"\n".join(lines) + b"\n"
+
+
+def _csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+    for columns, rows in batches:
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        json_indexes = [i for i, name in enumerate(columns) if name in JSON_COLUMNS]
+        for row in rows:
+            row = list(row)
+            for i in json_indexes:
+                row[i] = "|".join(str(item) for item in _decode(row[i]))
+            writer.writerow(row)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(kind, fmt="ndjson", since=None, gzip=False, dumps=None):
+    """Return an iterator of encoded export chunks.
+
+    dumps(obj) -> bytes encodes one NDJSON record, the app passes its JSON
+    provider so exports match the API's encoding.
+    """
+    if fmt not in FORMATS:
+        raise ExportError(f"unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    batches = iter_batches(kind, since)
+    if fmt == "ndjson":
+        chunks = _ndjson(batches, dumps or (lambda obj: json.dumps(obj).encode("utf-8")))
+    else:
+        chunks = _csv(batches)
+    return _gzip(chunks) if gzip else chunks
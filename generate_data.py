@@ -0,0 +1,293 @@
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+
+import init
+import maintenance
+import migrations
+
+DB_NAME = "scale_data.db"
+BATCH_SIZE = 50000  # Rows per executemany call
+
+# Fixed so the same seed gives byte-identical data whenever it is run
+EPOCH = datetime(2024, 1, 1)
+SPAN_SECONDS = 2 * 365 * 24 * 3600
+
+CATEGORIES = [
+    "productivity", "game", "health", "photography", "finance", "social", "music", "education",
+    "travel", "news", "shopping", "weather", "sports", "utilities", "food", "lifestyle",
+]
+# similar_tag_ids per category, the graph tag_graph expands categories over
+SIMILAR_CATEGORIES = {
+    "productivity": ["utilities", "education", "finance"],
+    "game": ["sports", "music", "social"],
+    "health": ["sports", "food", "lifestyle"],
+    "photography": ["social", "lifestyle"],
+    "finance": ["shopping", "news"],
+    "social": ["news", "music"],
+    "travel": ["weather", "food", "shopping"],
+    "news": ["weather", "sports"],
+}
+ADJECTIVES = ["Happy", "Grumpy", "Silly", "Super", "Lazy", "Fast", "Cyber", "Mega", "Tiny", "Quiet"]
+NOUNS = ["Cat", "Dog", "Coder", "Gamer", "Bot", "User", "Pilot", "Chef", "Ninja", "Owl"]
+PREFIXES = ["Pocket", "Infinite", "Daily", "Pro", "Ultra", "Smart", "Virtual", "Hyper", "Zen", "Open"]
+PRODUCTS = ["Tasker", "Weather", "Notes", "Music", "Chat", "Wallet", "Fit", "Cam", "Maps", "Quest"]
+WORDS = ["great", "slow", "love", "crashes", "useful", "ads", "smooth", "battery", "update", "worth",
+         "simple", "buggy", "fun", "price", "design", "support", "fast", "login", "sync", "offline"]
+
+# Relaxed for the load only: the database is rebuilt from scratch if it fails
+LOAD_PRAGMAS = [
+    ("journal_mode", "OFF"),
+    ("synchronous", "OFF"),
+    ("locking_mode", "EXCLUSIVE"),
+    ("temp_store", "MEMORY"),
+    ("cache_size", -1048576),  # 1GB
+]
+SERVE_PRAGMAS = [
+    ("locking_mode", "NORMAL"),
+    ("synchronous", "NORMAL"),
+    ("journal_mode", "WAL"),
+]
+
+
+class Zipf:
+    """Draws ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** s."""
+
+    def __init__(self, rng, n, s):
+        self.rng = rng
+        self.cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** s for rank in range(n)))
+        self.total = self.cum_weights[-1]
+
+    def draw(self):
+        return bisect.bisect(self.cum_weights, self.rng.random() * self.total)
+
+
+def _timestamp(rng):
+    return (EPOCH + timedelta(seconds=rng.randrange(SPAN_SECONDS))).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _batched(rows, size=BATCH_SIZE):
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _insert(conn, sql, rows):
+    count = 0
+    for batch in _batched(rows):
+        conn.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+class Generator:
+    def __init__(self, conn, seed, users, apps, installs, comments, reports, zipf_s, log=print):
+        self.conn = conn
+        self.users = users
+        self.apps = apps
+        self.installs = installs
+        self.comments = comments
+        self.reports = reports
+        self.zipf_s = zipf_s
+        self.log = log
+        # One stream per table, so changing one count doesn't reshuffle the rest
+        self.rng = {name: random.Random(f"{seed}:{name}")
+                    for name in ("users", "apps", "installs", "comments", "reports")}
+
+    def _step(self, label, fn):
+        started = time.perf_counter()
+        count = fn()
+        self.log(f" - {label}: {count} rows in {time.perf_counter() - started:.1f}s")
+
+    def run(self):
+        self._step("tags", self._tags)
+        self._step("users", self._users)
+        self._step("apps", self._apps)
+        self._step("installs", self._installs)
+        self._step("comments", self._comments)
+        self._step("reports", self._reports)
+
+    def _tags(self):
+        return _insert(self.conn, "INSERT INTO tags (tag_id, amount, similar_tag_ids) VALUES (?, 0, ?)",
+                       ((tag, json.dumps(SIMILAR_CATEGORIES.get(tag, []))) for tag in CATEGORIES))
+
+    def _users(self):
+        rng = self.rng["users"]
+        rows = ((user_id, f"{rng.choice(ADJECTIVES)}_{rng.choice(NOUNS)}_{user_id}", _timestamp(rng))
+                for user_id in range(1, self.users + 1))
+        return _insert(self.conn, "INSERT INTO user (user_id, username, creation_date) VALUES (?, ?, ?)", rows)
+
+    def _apps(self):
+        rng = self.rng["apps"]
+        # App ids are popularity ranks: app 1 is the most installed
+        categories = [rng.choice(CATEGORIES) for _ in range(self.apps)]
+        developers = Zipf(rng, self.users, 1.0)  # A few studios publish most apps
+
+        def apps():
+            for app_id in range(1, self.apps + 1):
+                name = f"{rng.choice(PREFIXES)} {rng.choice(PRODUCTS)} {app_id}"
+                price = rng.choices([0.0, 0.99, 1.99, 4.99, 9.99], weights=[60, 15, 10, 10, 5])[0]
+                yield (app_id, name, f"icon_{app_id}.png", price, developers.draw() + 1, categories[app_id - 1])
+
+        def pages():
+            for app_id in range(1, self.apps + 1):
+                description = " ".join(rng.choices(WORDS, k=rng.randint(8, 40)))
+                images = json.dumps([f"screen_{app_id}_{i}.jpg" for i in range(1, rng.randint(2, 5))])
+                yield (app_id, description, images, _timestamp(rng))
+
+        def app_tags():
+            for app_id, category in enumerate(categories, start=1):
+                yield (app_id, category)
+                if rng.random() < 0.3:
+                    yield (app_id, rng.choice(CATEGORIES))
+
+        count = _insert(self.conn, """
+            INSERT INTO app (app_id, app_name, icon, price, developer_id, category) VALUES (?, ?, ?, ?, ?, ?)
+        """, apps())
+        _insert(self.conn, "INSERT INTO app_page (app_id, description, images, last_update) VALUES (?, ?, ?, ?)",
+                pages())
+        _insert(self.conn, "INSERT OR IGNORE INTO app_tags (app_id, tag_id) VALUES (?, ?)", app_tags())
+        return count
+
+    def _installs(self):
+        rng = self.rng["installs"]
+        popularity = Zipf(rng, self.apps, self.zipf_s)
+        mean = self.installs / self.users if self.users else 0
+
+        def installs():
+            # Library sizes are skewed too, a few users install a lot
+            for user_id in range(1, self.users + 1):
+                want = min(self.apps, round(rng.expovariate(1 / mean))) if mean else 0
+                chosen = set()
+                attempts = 0
+                while len(chosen) < want and attempts < 4 * want:
+                    chosen.add(popularity.draw() + 1)
+                    attempts += 1
+                for app_id in sorted(chosen):
+                    yield (app_id, user_id)
+
+        return _insert(self.conn, "INSERT INTO user_apps (app_id, user_id) VALUES (?, ?)", installs())
+
+    def _comments(self):
+        rng = self.rng["comments"]
+        popularity = Zipf(rng, self.apps, self.zipf_s)
+        # Every app has an underlying quality, its reviews scatter around it
+        quality = [rng.uniform(1.5, 4.8) for _ in range(self.apps)]
+        self.comment_authors = array("i")
+
+        def comments():
+            for comment_id in range(1, self.comments + 1):
+                app_id = popularity.draw() + 1
+                user_id = rng.randint(1, self.users)
+                stars = min(5.0, max(1.0, round(rng.gauss(quality[app_id - 1], 1.0))))
+                text = " ".join(rng.choices(WORDS, k=rng.randint(3, 25)))
+                self.comment_authors.append(user_id)
+                yield (comment_id, app_id, user_id, stars, text, _timestamp(rng))
+
+        return _insert(self.conn, """
+            INSERT INTO comments (comment_id, app_id, user_id, stars, comment, date) VALUES (?, ?, ?, ?, ?, ?)
+        """, comments())
+
+    def _reports(self):
+        rng = self.rng["reports"]
+        popularity = Zipf(rng, self.apps, self.zipf_s)
+
+        def reports():
+            for report_id in range(1, self.reports + 1):
+                if self.comments and rng.random() < 0.7:
+                    # A comment report, which also reports its author
+                    comment_id = rng.randint(1, self.comments)
+                    yield (report_id, None, self.comment_authors[comment_id - 1], comment_id,
+                           "Inappropriate comment", _timestamp(rng))
+                else:
+                    yield (report_id, popularity.draw() + 1, None, None, "App issue", _timestamp(rng))
+
+        return _insert(self.conn, """
+            INSERT INTO reports (report_id, reported_app_id, reported_user_id, reported_comment_id, comment, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, reports())
+
+
+def build_derived(conn, log=print):
+    """Fill every cache column in set-based passes, then bring the schema up to date."""
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    migrations._performance_indexes(cursor)  # The passes below join through these
+    maintenance.rebuild_caches(cursor)
+    cursor.execute("UPDATE tags SET amount = (SELECT COUNT(*) FROM app_tags at WHERE at.tag_id = tags.tag_id)")
+    conn.commit()
+    log(f" - caches: {time.perf_counter() - started:.1f}s")
+
+    # Search index, primary categories and triggers are backfilled here,
+    # after the bulk load, so no trigger fires per inserted row
+    started = time.perf_counter()
+    migrations.migrate(conn)
+    log(f" - migrations and ANALYZE: {time.perf_counter() - started:.1f}s")
+
+
+def generate(db_path, seed=42, users=10000, apps=1000, installs=100000, comments=20000, reports=500,
+             zipf_s=1.1, log=print):
+    conn = sqlite3.connect(db_path)
+    try:
+        for name, value in LOAD_PRAGMAS:
+            conn.execute(f"PRAGMA {name} = {value}")
+        conn.executescript(init.get_schema())
+
+        conn.execute("BEGIN")
+        Generator(conn, seed, users, apps, installs, comments, reports, zipf_s, log).run()
+        conn.commit()
+
+        build_derived(conn, log)
+        for name, value in SERVE_PRAGMAS:
+            conn.execute(f"PRAGMA {name} = {value}")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a large, reproducible app store database")
+    parser.add_argument("--db", default=DB_NAME, help="Database file to create")
+    parser.add_argument("--force", action="store_true", help="Replace the file if it exists")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--apps", type=int, default=1000)
+    parser.add_argument("--installs", type=int, default=100000, help="Approximate, library sizes are random")
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--reports", type=int, default=500)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Popularity skew, higher is more skewed")
+    args = parser.parse_args()
+
+    if args.users < 1 or args.apps < 1:
+        parser.error("--users and --apps must be at least 1")
+    if os.path.exists(args.db):
+        if not args.force:
+            parser.error(f"{args.db} exists, pass --force to replace it")
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    started = time.perf_counter()
+    print(f"Generating {args.db} with seed {args.seed}...")
+    try:
+        generate(args.db, args.seed, args.users, args.apps, args.installs, args.comments, args.reports,
+                 args.zipf)
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        return 1
+    print(f"Done in {time.perf_counter() - started:.1f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
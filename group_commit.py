@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from db_pool import WriteQueueFull, WriteTimeout
+
+
+class GroupCommitter:
+    """Collects small writes for a few milliseconds and commits them together.
+
+    apply_batch(items) gets every item gathered in one window (bounded by
+    max_wait seconds after the first arrival, or max_batch items) and must
+    apply them in a single transaction, returning one result per item.
+    submit() blocks until the batch holding its item has committed, so a
+    caller still only sees success once its own write is on disk.
+
+    If a batch fails with a database error it is replayed one item at a
+    time, so a single bad item can't take everyone else's write down with it.
+    """
+
+    def __init__(self, apply_batch, max_batch=256, max_wait=0.005, max_pending=1000, timeout=30.0):
+        self.apply_batch = apply_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._pending = []  # [(item, future)]
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            "submitted": 0,
+            "rejected": 0,
+            "batches": 0,
+            "committed": 0,
+            "failed": 0,
+            "largest_batch": 0,
+        }
+
+    def _ensure_started(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pending = []
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="db-group-commit", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Hold the window open until it fills up or times out
+                deadline = time.monotonic() + self.max_wait
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._flush(batch)
+
+    def _flush(self, batch):
+        # Callers that already timed out have cancelled their future
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            results = self.apply_batch([item for item, _ in batch])
+        except sqlite3.Error as e:
+            if len(batch) > 1:
+                for entry in batch:
+                    self._replay(entry)
+                return
+            self._fail(batch, e)
+        except BaseException as e:
+            self._fail(batch, e)
+        else:
+            with self._cond:
+                self._stats["batches"] += 1
+                self._stats["committed"] += len(batch)
+                self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _replay(self, entry):
+        item, future = entry
+        try:
+            result = self.apply_batch([item])[0]
+        except BaseException as e:
+            self._fail([entry], e)
+        else:
+            with self._cond:
+                self._stats["batches"] += 1
+                self._stats["committed"] += 1
+            future.set_result(result)
+
+    def _fail(self, batch, error):
+        with self._cond:
+            self._stats["failed"] += len(batch)
+        for _, future in batch:
+            future.set_exception(error)
+
+    def submit(self, item):
+        """Queue item for the next batch and return its result once committed."""
+        self._ensure_started()
+        future = Future()
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise WriteQueueFull(f"group commit queue is full ({self.max_pending} pending)")
+            self._pending.append((item, future))
+            self._stats["submitted"] += 1
+            self._cond.notify()
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise WriteTimeout(f"group commit did not complete within {self.timeout}s")
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            data["pending"] = len(self._pending)
+        data["max_batch"] = self.max_batch
+        data["max_wait_ms"] = self.max_wait * 1000
+        return data
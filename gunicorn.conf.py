@@ -0,0 +1,39 @@
+"""Production server settings: gunicorn -c gunicorn.conf.py app:app
+
+Prefork: the master process forks APPSTORE_WORKERS workers, each serving
+APPSTORE_THREADS requests at a time with its own SQLite connections.
+kill -HUP the master to reload code and settings by starting new workers
+and retiring the old ones gracefully; SIGTERM finishes in-flight requests,
+waiting up to APPSTORE_GRACEFUL_TIMEOUT seconds, before exiting.
+"""
+import multiprocessing
+import os
+
+import db_utils
+
+bind = os.environ.get("APPSTORE_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("APPSTORE_WORKERS", 0)) or multiprocessing.cpu_count()
+threads = int(os.environ.get("APPSTORE_THREADS", 4))
+worker_class = "gthread"
+timeout = int(os.environ.get("APPSTORE_WORKER_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("APPSTORE_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+# Load the app once in the master and fork it, rather than importing it in every worker
+preload_app = os.environ.get("APPSTORE_PRELOAD", "0") == "1"
+reload = os.environ.get("APPSTORE_RELOAD", "0") == "1"  # Restart workers on code changes, development only
+accesslog = os.environ.get("APPSTORE_ACCESS_LOG") or None  # "-" for stdout
+
+
+def on_starting(server):
+    # Bring the schema up to date once, before any worker can race another to do it
+    db_utils.get_pool()
+    db_utils.shutdown()
+
+
+def post_fork(server, worker):
+    # With preload_app the app (and maybe a pool) came along in the fork
+    db_utils.reset_after_fork()
+
+
+def worker_exit(server, worker):
+    db_utils.shutdown()
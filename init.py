@@ -3,6 +3,8 @@ import json
 import random
 from datetime import datetime, timedelta
 
+import migrations
+
 DB_NAME = "app_data.db"
 
 def get_schema():
@@ -23,8 +25,11 @@ def get_schema():
         icon TEXT,
         price REAL DEFAULT 0.0,
         rating REAL DEFAULT 0.0,
+        rating_sum REAL DEFAULT 0.0,
+        rating_count INTEGER DEFAULT 0,
         downloads INTEGER DEFAULT 0,
         developer_id INTEGER,
+        category TEXT,
         FOREIGN KEY (developer_id) REFERENCES user(user_id) ON DELETE SET NULL
     );
 
@@ -219,6 +224,14 @@ def populate_data(cursor):
         count = cursor.fetchone()[0]
         cursor.execute("UPDATE app SET downloads = ? WHERE app_id = ?", (count, aid))
 
+    # Update app ratings (running sum/count that db_utils maintains by delta)
+    for (aid,) in all_apps:
+        cursor.execute("SELECT COALESCE(SUM(stars), 0), COUNT(stars) FROM comments WHERE app_id = ?", (aid,))
+        star_sum, star_count = cursor.fetchone()
+        rating = star_sum / star_count if star_count else 0
+        cursor.execute("UPDATE app SET rating = ?, rating_sum = ?, rating_count = ? WHERE app_id = ?",
+                       (rating, star_sum, star_count, aid))
+
     # Update Reports Caches
     # User Reports
     cursor.execute("SELECT reported_user_id, report_id FROM reports WHERE reported_user_id IS NOT NULL")
@@ -253,6 +266,9 @@ def main():
         populate_data(cursor)
         
         conn.commit()
+
+        # Indexes and anything added after the base schema
+        migrations.migrate(conn)
         print(f"Database '{DB_NAME}' created and populated successfully!")
         
     except sqlite3.Error as e:
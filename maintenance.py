@@ -0,0 +1,191 @@
+import argparse
+import json
+import sqlite3
+import sys
+
+import migrations
+import tag_graph
+
+DB_NAME = "app_data.db"
+
+# Float drift from many +/- star updates is expected, anything bigger is a bug
+RATING_TOLERANCE = 1e-6
+
+
+def rebuild_caches(cursor):
+    """Recompute every denormalized counter and JSON id list from the source tables."""
+    cursor.execute("""
+        UPDATE app
+        SET downloads = (SELECT COUNT(*) FROM user_apps ua WHERE ua.app_id = app.app_id),
+            rating_sum = COALESCE((SELECT SUM(stars) FROM comments c WHERE c.app_id = app.app_id), 0),
+            rating_count = (SELECT COUNT(stars) FROM comments c WHERE c.app_id = app.app_id),
+            rating = COALESCE((SELECT AVG(stars) FROM comments c WHERE c.app_id = app.app_id), 0)
+    """)
+    cursor.execute("""
+        UPDATE user
+        SET app_ids = (SELECT json_group_array(app_id) FROM user_apps ua WHERE ua.user_id = user.user_id),
+            comment_ids = (SELECT json_group_array(comment_id) FROM comments c WHERE c.user_id = user.user_id)
+    """)
+    cursor.execute("""
+        UPDATE app_page
+        SET comment_ids = (SELECT json_group_array(comment_id) FROM comments c WHERE c.app_id = app_page.app_id)
+    """)
+
+    cursor.execute("DELETE FROM user_reports")
+    cursor.execute("""
+        INSERT INTO user_reports (user_id, report_ids)
+        SELECT reported_user_id, json_group_array(report_id)
+        FROM reports WHERE reported_user_id IS NOT NULL
+        GROUP BY reported_user_id
+    """)
+    cursor.execute("DELETE FROM app_reports")
+    cursor.execute("""
+        INSERT INTO app_reports (app_id, report_ids)
+        SELECT reported_app_id, json_group_array(report_id)
+        FROM reports WHERE reported_app_id IS NOT NULL
+        GROUP BY reported_app_id
+    """)
+
+
+def rebuild_rating_histogram(cursor):
+    """Recount rating_histogram from comments, then re-derive every app's rating from it."""
+    migrations.recount_ratings(cursor)
+
+
+def _load_id_list(value):
+    try:
+        return sorted(json.loads(value)) if value else []
+    except (json.JSONDecodeError, TypeError):
+        return None  # Reported as a mismatch
+
+
+def _group_ids(cursor, sql):
+    groups = {}
+    for key, value in cursor.execute(sql):
+        groups.setdefault(key, []).append(value)
+    return {key: sorted(values) for key, values in groups.items()}
+
+
+def _check_id_lists(cursor, problems, label, cache_sql, source_sql):
+    expected = _group_ids(cursor, source_sql)
+    for key, value in cursor.execute(cache_sql).fetchall():
+        actual = _load_id_list(value)
+        want = expected.get(key, [])
+        if actual != want:
+            problems.append(f"{label}[{key}]: cached {value!r}, expected {want}")
+
+
+def verify_caches(cursor):
+    """Compare every cache maintained by delta against a full recompute.
+
+    Returns a list of human readable mismatches, empty when everything agrees.
+    """
+    problems = []
+
+    rows = cursor.execute("""
+        SELECT a.app_id, a.downloads, a.rating, a.rating_sum, a.rating_count,
+               (SELECT COUNT(*) FROM user_apps ua WHERE ua.app_id = a.app_id),
+               COALESCE((SELECT SUM(stars) FROM comments c WHERE c.app_id = a.app_id), 0),
+               (SELECT COUNT(stars) FROM comments c WHERE c.app_id = a.app_id)
+        FROM app a
+    """).fetchall()
+    for app_id, downloads, rating, rating_sum, rating_count, real_downloads, real_sum, real_count in rows:
+        if downloads != real_downloads:
+            problems.append(f"app[{app_id}].downloads: cached {downloads}, expected {real_downloads}")
+        if rating_count != real_count:
+            problems.append(f"app[{app_id}].rating_count: cached {rating_count}, expected {real_count}")
+        if abs((rating_sum or 0) - real_sum) > RATING_TOLERANCE:
+            problems.append(f"app[{app_id}].rating_sum: cached {rating_sum}, expected {real_sum}")
+        real_rating = real_sum / real_count if real_count else 0
+        if abs((rating or 0) - real_rating) > RATING_TOLERANCE:
+            problems.append(f"app[{app_id}].rating: cached {rating}, expected {real_rating}")
+
+    _check_id_lists(cursor, problems, "user.app_ids",
+                    "SELECT user_id, app_ids FROM user",
+                    "SELECT user_id, app_id FROM user_apps")
+    _check_id_lists(cursor, problems, "user.comment_ids",
+                    "SELECT user_id, comment_ids FROM user",
+                    "SELECT user_id, comment_id FROM comments")
+    _check_id_lists(cursor, problems, "app_page.comment_ids",
+                    "SELECT app_id, comment_ids FROM app_page",
+                    "SELECT app_id, comment_id FROM comments")
+    _check_id_lists(cursor, problems, "user_reports.report_ids",
+                    "SELECT user_id, report_ids FROM user_reports",
+                    "SELECT reported_user_id, report_id FROM reports WHERE reported_user_id IS NOT NULL")
+    _check_id_lists(cursor, problems, "app_reports.report_ids",
+                    "SELECT app_id, report_ids FROM app_reports",
+                    "SELECT reported_app_id, report_id FROM reports WHERE reported_app_id IS NOT NULL")
+
+    # Reports whose owner has no cache row at all
+    for table, column, key in [("user_reports", "reported_user_id", "user_id"),
+                               ("app_reports", "reported_app_id", "app_id")]:
+        missing = cursor.execute(f"""
+            SELECT DISTINCT r.{column} FROM reports r
+            WHERE r.{column} IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{key} = r.{column})
+        """).fetchall()
+        for (owner,) in missing:
+            problems.append(f"{table}[{owner}]: missing cache row")
+
+    expected = {(app_id, stars): (count, total)
+                for app_id, stars, count, total in cursor.execute(migrations.HISTOGRAM_ROWS)}
+    actual = {(app_id, stars): (count, total) for app_id, stars, count, total
+              in cursor.execute("SELECT app_id, stars, count, total FROM rating_histogram WHERE count != 0")}
+    for app_id, stars in sorted(expected.keys() | actual.keys()):
+        count, total = actual.get((app_id, stars), (0, 0.0))
+        real_count, real_total = expected.get((app_id, stars), (0, 0.0))
+        if count != real_count or abs(total - real_total) > RATING_TOLERANCE:
+            problems.append(f"rating_histogram[{app_id}, {stars}]: cached {count} totalling {total}, "
+                            f"expected {real_count} totalling {real_total}")
+
+    # Related tags, unless a tag changed since the last build (the next
+    # expanded query rebuilds it then)
+    if not tag_graph.is_stale(cursor):
+        expected = {(tag, other): rest for tag, other, *rest in tag_graph.expected_rows(cursor)}
+        actual = {(tag, other): rest for tag, other, *rest
+                  in cursor.execute("SELECT tag_id, neighbor_id, distance, weight FROM tag_neighbors")}
+        for tag, other in sorted(expected.keys() | actual.keys()):
+            want, have = expected.get((tag, other)), actual.get((tag, other))
+            if want != have:
+                problems.append(f"tag_neighbors[{tag}, {other}]: cached {have}, expected {want}")
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance tasks for the app store database")
+    parser.add_argument("--db", default=DB_NAME, help="Path to the SQLite database")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("verify", help="Check denormalized caches against a full recompute")
+    sub.add_parser("rebuild", help="Recompute all denormalized caches, rating histograms included, from scratch")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        cursor = conn.cursor()
+        if args.command == "verify":
+            if migrations.get_version(conn) < migrations.LATEST_VERSION:
+                print("The database is behind the latest schema, run migrations.py first.")
+                return 1
+            problems = verify_caches(cursor)
+            for problem in problems:
+                print(problem)
+            print(f"{len(problems)} mismatches found.")
+            return 1 if problems else 0
+        elif args.command == "rebuild":
+            migrations.migrate(conn)
+            rebuild_caches(cursor)
+            rebuild_rating_histogram(cursor)
+            tag_graph.rebuild(cursor)
+            conn.commit()
+            print("Caches rebuilt.")
+            return 0
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+import bisect
+import threading
+import time
+
+from flask import g, request
+
+# Upper bounds, in seconds and bytes; +Inf is implied
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, Prometheus style."""
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._le = [f'le="{bound}"' for bound in buckets] + ['le="+Inf"']
+
+    def observe(self, values, amount):
+        # Caller holds the registry lock
+        series = self._series.get(values)
+        if series is None:
+            series = self._series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, amount)] += 1
+        series[-1] += amount
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for values, series in sorted(self._series.items()):
+            cumulative = 0
+            for le, count in zip(self._le, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {cumulative}")
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+
+    def inc(self, values, amount=1):
+        # Caller holds the registry lock
+        self._series[values] = self._series.get(values, 0) + amount
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} counter")
+        for values, count in sorted(self._series.items()):
+            lines.append(f"{self.name}{_labels(self.labels, values)} {_number(count)}")
+
+
+class RequestMetrics:
+    """Per-route HTTP metrics plus database stats, rendered as Prometheus text.
+
+    Recording a request is a few dict updates under one lock. Routes are
+    labelled with their URL rule, not the path, so /api/apps/1 and
+    /api/apps/2 share a series and unmatched paths all count as one.
+
+    collectors are (prefix, stats_fn, counter_keys) triples read at scrape
+    time: stats_fn() returns a flat dict or None, keys in counter_keys are
+    exported as <prefix>_<key>_total counters and the rest as gauges.
+    """
+
+    def __init__(self, collectors=()):
+        self.collectors = list(collectors)
+        self.started_at = time.time()
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._latency = Histogram("http_request_duration_seconds", "Time spent handling requests.",
+                                  ("route", "method"), LATENCY_BUCKETS)
+        self._sizes = Histogram("http_response_size_bytes", "Response body sizes, as sent.",
+                                ("route", "method"), SIZE_BUCKETS)
+        self._requests = Counter("http_requests_total", "Requests handled, by status code.",
+                                 ("route", "method", "status"))
+
+    def start(self):
+        with self._lock:
+            self._in_flight += 1
+        return time.perf_counter()
+
+    def finish(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def observe(self, route, method, status, started, size):
+        # size is None for streamed bodies, whose length isn't known up front
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._latency.observe((route, method), elapsed)
+            self._requests.inc((route, method, str(status)))
+            if size is not None:
+                self._sizes.observe((route, method), size)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append("# HELP http_requests_in_flight Requests currently being handled.")
+            lines.append("# TYPE http_requests_in_flight gauge")
+            lines.append(f"http_requests_in_flight {self._in_flight}")
+            self._requests.render(lines)
+            self._latency.render(lines)
+            self._sizes.render(lines)
+
+        lines.append("# HELP process_start_time_seconds Start time of the process since the epoch.")
+        lines.append("# TYPE process_start_time_seconds gauge")
+        lines.append(f"process_start_time_seconds {_number(self.started_at)}")
+
+        for prefix, stats_fn, counter_keys in self.collectors:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                # A broken collector shouldn't take the whole scrape down
+                print(f"Error collecting {prefix} metrics: {e}")
+                continue
+            if not stats:
+                continue
+            for key, value in sorted(stats.items()):
+                if not isinstance(value, (int, float)):
+                    continue
+                if key in counter_keys:
+                    name, kind = f"{prefix}_{key}_total", "counter"
+                else:
+                    name, kind = f"{prefix}_{key}", "gauge"
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def install(self, flask_app):
+        """Hook into a Flask app's request cycle.
+
+        Register this before any after_request hook that changes the body,
+        such as compression: after_request hooks run in reverse, so this one
+        then sees the final response size.
+        """
+        @flask_app.before_request
+        def _start_timer():
+            g.metrics_started = self.start()
+
+        @flask_app.after_request
+        def _record(response):
+            started = g.pop("metrics_started", None)
+            if started is not None:
+                route = request.url_rule.rule if request.url_rule else "<unmatched>"
+                size = None if response.is_streamed else response.content_length
+                self.observe(route, request.method, response.status_code, started, size)
+                self.finish()
+            return response
+
+        @flask_app.teardown_request
+        def _teardown(exc):
+            # Requests that never reached after_request still leave the gauge
+            if "metrics_started" in g:
+                g.pop("metrics_started")
+                self.finish()
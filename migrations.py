@@ -0,0 +1,409 @@
+import argparse
+import sqlite3
+import sys
+
+import tag_graph
+
+DB_NAME = "app_data.db"
+
+# Each migration runs in its own transaction and bumps PRAGMA user_version.
+# They are written to be safe on databases whose tables were created from a
+# newer init.get_schema() (columns may already exist, indexes use IF NOT EXISTS).
+
+
+def _column_names(cursor, table):
+    return {row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _add_column(cursor, table, column, definition):
+    if column not in _column_names(cursor, table):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
+
+def _rating_totals(cursor):
+    # Running star sum/count so comment writes can update app.rating by delta
+    added = _add_column(cursor, "app", "rating_sum", "REAL DEFAULT 0.0")
+    _add_column(cursor, "app", "rating_count", "INTEGER DEFAULT 0")
+    if added:
+        cursor.execute("""
+            UPDATE app
+            SET rating_sum = COALESCE((SELECT SUM(stars) FROM comments c WHERE c.app_id = app.app_id), 0),
+                rating_count = (SELECT COUNT(stars) FROM comments c WHERE c.app_id = app.app_id)
+        """)
+
+
+def _performance_indexes(cursor):
+    statements = [
+        # get_all_apps / get_apps_by_category / search_apps ORDER BY
+        "CREATE INDEX IF NOT EXISTS idx_app_downloads ON app (downloads)",
+        "CREATE INDEX IF NOT EXISTS idx_app_rating ON app (rating)",
+        "CREATE INDEX IF NOT EXISTS idx_app_price ON app (price)",
+        "CREATE INDEX IF NOT EXISTS idx_app_name ON app (app_name)",
+        # Category membership, covering so the join never touches the table
+        "CREATE INDEX IF NOT EXISTS idx_app_tags_tag ON app_tags (tag_id, app_id)",
+        # get_app_details latest comments, and per-user comment lookups
+        "CREATE INDEX IF NOT EXISTS idx_comments_app_date ON comments (app_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_comments_user ON comments (user_id)",
+        # A user's library (the primary key is app_id first)
+        "CREATE INDEX IF NOT EXISTS idx_user_apps_user ON user_apps (user_id, app_id)",
+        # get_all_users
+        "CREATE INDEX IF NOT EXISTS idx_user_username ON user (username)",
+        # get_user_reports / get_app_reports
+        "CREATE INDEX IF NOT EXISTS idx_reports_user_created ON reports (reported_user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reports_app_created ON reports (reported_app_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reports_comment ON reports (reported_comment_id)",
+    ]
+    for sql in statements:
+        cursor.execute(sql)
+
+
+def _primary_category(cursor):
+    # The first tag an app was given is its primary category. Stored on the
+    # row so listings don't run a correlated app_tags lookup per result.
+    _add_column(cursor, "app", "category", "TEXT")
+    cursor.execute("""
+        UPDATE app
+        SET category = (SELECT tag_id FROM app_tags at WHERE at.app_id = app.app_id ORDER BY at.rowid LIMIT 1)
+        WHERE category IS NULL
+    """)
+
+    # Keep it in sync however app_tags is written to
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_app_tags_insert_category
+        AFTER INSERT ON app_tags
+        BEGIN
+            UPDATE app SET category = NEW.tag_id
+            WHERE app_id = NEW.app_id AND category IS NULL;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_app_tags_delete_category
+        AFTER DELETE ON app_tags
+        BEGIN
+            UPDATE app
+            SET category = (SELECT tag_id FROM app_tags at WHERE at.app_id = OLD.app_id ORDER BY at.rowid LIMIT 1)
+            WHERE app_id = OLD.app_id AND category = OLD.tag_id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_app_tags_update_category
+        AFTER UPDATE OF app_id, tag_id ON app_tags
+        BEGIN
+            UPDATE app
+            SET category = (SELECT tag_id FROM app_tags at WHERE at.app_id = OLD.app_id ORDER BY at.rowid LIMIT 1)
+            WHERE app_id = OLD.app_id AND category = OLD.tag_id;
+            UPDATE app SET category = NEW.tag_id
+            WHERE app_id = NEW.app_id AND category IS NULL;
+        END
+    """)
+
+
+def _search_index(cursor):
+    # Full-text index for search_apps, rowid is the app_id. Prefix indexes
+    # make the per-keystroke "term*" queries from the search box cheap.
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS app_search USING fts5(
+            app_name, description, tags,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    cursor.execute("DELETE FROM app_search")
+    cursor.execute("""
+        INSERT INTO app_search (rowid, app_name, description, tags)
+        SELECT a.app_id, a.app_name, COALESCE(p.description, ''),
+               COALESCE((SELECT group_concat(tag_id, ' ') FROM app_tags at WHERE at.app_id = a.app_id), '')
+        FROM app a
+        LEFT JOIN app_page p ON p.app_id = a.app_id
+    """)
+
+    # Kept in sync from the source tables so every writer is covered
+    triggers = [
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_app_search_app_insert AFTER INSERT ON app
+        BEGIN
+            INSERT INTO app_search (rowid, app_name, description, tags) VALUES (NEW.app_id, NEW.app_name, '', '');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_app_search_app_update AFTER UPDATE OF app_name ON app
+        BEGIN
+            UPDATE app_search SET app_name = NEW.app_name WHERE rowid = NEW.app_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_app_search_app_delete AFTER DELETE ON app
+        BEGIN
+            DELETE FROM app_search WHERE rowid = OLD.app_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_app_search_page_insert AFTER INSERT ON app_page
+        BEGIN
+            UPDATE app_search SET description = COALESCE(NEW.description, '') WHERE rowid = NEW.app_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_app_search_page_update AFTER UPDATE OF description ON app_page
+        BEGIN
+            UPDATE app_search SET description = COALESCE(NEW.description, '') WHERE rowid = NEW.app_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_app_search_tags_insert AFTER INSERT ON app_tags
+        BEGIN
+            UPDATE app_search
+            SET tags = COALESCE((SELECT group_concat(tag_id, ' ') FROM app_tags at WHERE at.app_id = NEW.app_id), '')
+            WHERE rowid = NEW.app_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_app_search_tags_delete AFTER DELETE ON app_tags
+        BEGIN
+            UPDATE app_search
+            SET tags = COALESCE((SELECT group_concat(tag_id, ' ') FROM app_tags at WHERE at.app_id = OLD.app_id), '')
+            WHERE rowid = OLD.app_id;
+        END
+        """,
+    ]
+    for sql in triggers:
+        cursor.execute(sql)
+    _search_tags_update_trigger(cursor)
+
+
+def _search_tags_update_trigger(cursor):
+    # An app_tags row moved to another app or tag changes both apps' tags
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_app_search_tags_update AFTER UPDATE ON app_tags
+        BEGIN
+            UPDATE app_search
+            SET tags = COALESCE((SELECT group_concat(tag_id, ' ') FROM app_tags at WHERE at.app_id = app_search.rowid), '')
+            WHERE rowid IN (OLD.app_id, NEW.app_id);
+        END
+    """)
+
+
+def _search_tags_update(cursor):
+    # Databases indexed before the trigger existed may have missed updates
+    _search_tags_update_trigger(cursor)
+    cursor.execute("""
+        UPDATE app_search
+        SET tags = COALESCE((SELECT group_concat(tag_id, ' ') FROM app_tags at WHERE at.app_id = app_search.rowid), '')
+    """)
+
+
+# Tables whose changes are counted in table_versions
+VERSIONED_TABLES = ["app", "app_page", "app_tags", "tags", "comments", "user"]
+
+
+def _table_versions(cursor):
+    # A change counter per table, bumped by trigger on every write so the
+    # API can derive ETags without looking at the data itself
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            changed_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    now = "(julianday('now') - 2440587.5) * 86400.0"  # Unix time
+    for table in VERSIONED_TABLES:
+        cursor.execute(f"INSERT OR IGNORE INTO table_versions (name, version, changed_at) VALUES (?, 0, {now})",
+                       (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1, changed_at = {now} WHERE name = '{table}';
+                END
+            """)
+
+
+def _tag_neighbors(cursor):
+    # Transitive neighbourhoods of the similar_tag_ids graph, so a category
+    # can be expanded to its related ones with a join instead of a query per tag
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tag_neighbors (
+            tag_id TEXT NOT NULL,
+            neighbor_id TEXT NOT NULL,
+            distance INTEGER NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (tag_id, neighbor_id)
+        ) WITHOUT ROWID
+    """)
+    # Bumped only by changes to the graph itself, not by tags.amount, so the
+    # table is rebuilt when a tag or its similar ids change and no more often
+    now = "(julianday('now') - 2440587.5) * 86400.0"  # Unix time
+    for name in (tag_graph.GRAPH_VERSION, tag_graph.BUILT_VERSION):
+        cursor.execute(f"INSERT OR IGNORE INTO table_versions (name, version, changed_at) VALUES (?, 0, {now})",
+                       (name,))
+    for event, name in [("INSERT", "insert"), ("DELETE", "delete"),
+                        ("UPDATE OF tag_id, similar_tag_ids", "update")]:
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_tags_{name}_graph_version AFTER {event} ON tags
+            BEGIN
+                UPDATE table_versions SET version = version + 1, changed_at = {now}
+                WHERE name = '{tag_graph.GRAPH_VERSION}';
+            END
+        """)
+    tag_graph.rebuild(cursor)
+
+
+def _download_events(cursor):
+    # Append-only install/uninstall log for time-windowed stats, written by
+    # trigger so every writer is covered. AUTOINCREMENT keeps ids growing
+    # after compaction empties the table, readers tail it by event_id.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS download_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            app_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_download_events_created ON download_events (created_at)")
+    # Net installs per app and UTC day (days since the epoch), what old
+    # events are compacted into
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS download_daily (
+            day INTEGER NOT NULL,
+            app_id INTEGER NOT NULL,
+            downloads INTEGER NOT NULL,
+            PRIMARY KEY (day, app_id)
+        ) WITHOUT ROWID
+    """)
+    now = "(julianday('now') - 2440587.5) * 86400.0"  # Unix time
+    for event, row, delta in [("INSERT", "NEW", 1), ("DELETE", "OLD", -1)]:
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_user_apps_{event.lower()}_event AFTER {event} ON user_apps
+            BEGIN
+                INSERT INTO download_events (app_id, user_id, delta, created_at)
+                VALUES ({row}.app_id, {row}.user_id, {delta}, {now});
+            END
+        """)
+
+
+# Histogram bucket of a comment's stars. Comments without stars have no
+# bucket and don't count towards the rating, like AVG(stars) skips them.
+STAR_BUCKET = "CAST(ROUND({stars}) AS INTEGER)"
+HISTOGRAM_ROWS = f"""
+    SELECT app_id, {STAR_BUCKET.format(stars="stars")}, COUNT(*), SUM(stars)
+    FROM comments
+    WHERE stars IS NOT NULL
+    GROUP BY 1, 2
+"""
+
+
+def _rating_histogram(cursor):
+    # Comments per app and star bucket (stars rounded, 0 to 5), kept by delta
+    # on every comment write. total is the sum of the exact stars in the
+    # bucket, so the rating derived from it is the true mean, not a rounded one.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rating_histogram (
+            app_id INTEGER NOT NULL,
+            stars INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (app_id, stars)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute(f"INSERT OR IGNORE INTO rating_histogram (app_id, stars, count, total) {HISTOGRAM_ROWS}")
+
+
+def recount_ratings(cursor):
+    """Recount rating_histogram from comments, then re-derive every app's rating from it."""
+    cursor.execute("DELETE FROM rating_histogram")
+    cursor.execute(f"INSERT INTO rating_histogram (app_id, stars, count, total) {HISTOGRAM_ROWS}")
+    cursor.execute("""
+        UPDATE app
+        SET (rating_count, rating_sum, rating) = (
+            SELECT COALESCE(SUM(h.count), 0), COALESCE(SUM(h.total), 0),
+                   COALESCE(SUM(h.total) / NULLIF(SUM(h.count), 0), 0)
+            FROM rating_histogram h
+            WHERE h.app_id = app.app_id
+        )
+    """)
+
+
+MIGRATIONS = [
+    (1, "Running star sum/count on app", _rating_totals),
+    (2, "Secondary indexes for db_utils queries", _performance_indexes),
+    (3, "Stored primary category on app", _primary_category),
+    (4, "FTS5 search index over app name, description and tags", _search_index),
+    (5, "Per-table change counters for conditional GETs", _table_versions),
+    (6, "Related tag neighbourhoods for expanded category queries", _tag_neighbors),
+    (7, "Download event log and daily rollups for trending", _download_events),
+    (8, "Per-app star rating histogram", _rating_histogram),
+    (9, "Keep app_search tags in sync on app_tags updates", _search_tags_update),
+    # Histograms from 8 counted comments without stars as 0 stars
+    (10, "Leave comments without stars out of ratings", recount_ratings),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, verbose=False):
+    """Apply every pending migration in order. Returns the versions applied.
+
+    Safe to call from several processes at once: each step takes the write
+    lock first and re-checks the version before doing anything.
+    """
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        if version <= get_version(conn):
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= get_version(conn):
+                conn.rollback()  # Another process got here first
+                continue
+            fn(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append(version)
+        if verbose:
+            print(f"Applied migration {version}: {description}")
+
+    if applied:
+        # Refresh planner statistics, sampled so it stays quick on big databases
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
+        conn.commit()
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade an app store database to the latest schema")
+    parser.add_argument("--db", default=DB_NAME, help="Path to the SQLite database")
+    parser.add_argument("--status", action="store_true", help="Only print the current schema version")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        current = get_version(conn)
+        if args.status:
+            print(f"Schema version {current} (latest {LATEST_VERSION})")
+            return 0
+        applied = migrate(conn, verbose=True)
+        if not applied:
+            print(f"Already at version {current}, nothing to do.")
+        return 0
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+
+from db_pool import PooledConnection
+
+# Frames from these files are skipped when looking for a statement's call site
+_INTERNAL_FILES = (os.path.abspath(__file__), os.path.abspath(sys.modules["db_pool"].__file__))
+_EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+
+
+def _normalize(sql):
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def _call_site():
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename not in _INTERNAL_FILES:
+            return f"{os.path.basename(filename)}:{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return None
+
+
+class QueryProfiler:
+    """Aggregates per-statement timings and keeps a rolling slow-query log.
+
+    Statements are keyed by their whitespace-normalized SQL, so the same
+    query with different parameters adds up in one entry. Time covers the
+    execute and every fetch from its cursor. Slow statements also get their
+    EXPLAIN QUERY PLAN captured, once per distinct statement.
+    """
+
+    def __init__(self, slow_ms=50.0, slow_log_size=200, max_statements=500):
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+
+        self._lock = threading.Lock()
+        self._statements = {}  # sql -> stats dict
+        self._slow = deque(maxlen=slow_log_size)
+        self._plans = {}  # sql -> [plan detail]
+        self._dropped = 0
+
+    def record(self, conn, sql, params, elapsed_ms, rows, call_site):
+        key = _normalize(sql)
+        with self._lock:
+            stats = self._statements.get(key)
+            if stats is None:
+                if len(self._statements) >= self.max_statements:
+                    self._dropped += 1
+                    return
+                stats = self._statements[key] = {
+                    "sql": key, "calls": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "call_sites": {},
+                }
+            stats["calls"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["rows"] += rows
+            sites = stats["call_sites"]
+            if call_site in sites or len(sites) < 10:
+                sites[call_site] = sites.get(call_site, 0) + 1
+            slow = elapsed_ms >= self.slow_ms
+            need_plan = slow and key not in self._plans
+
+        if not slow:
+            return
+        plan = self._explain(conn, sql, params) if need_plan else None
+        with self._lock:
+            if need_plan:
+                self._plans[key] = plan
+            self._slow.append({
+                "sql": key,
+                "params": repr(params)[:200],
+                "ms": round(elapsed_ms, 3),
+                "rows": rows,
+                "call_site": call_site,
+                "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "plan": self._plans.get(key),
+            })
+        print(f"Slow query ({elapsed_ms:.1f}ms) at {call_site}: {key[:200]}")
+
+    def _explain(self, conn, sql, params):
+        if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        try:
+            # A plain cursor, so the EXPLAIN itself isn't profiled
+            cursor = sqlite3.Cursor(conn)
+            try:
+                if isinstance(params, (list, tuple)) and params and isinstance(params[0], (list, tuple)):
+                    params = params[0]  # executemany: explain the first row
+                rows = cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+                return [row[3] for row in rows]
+            finally:
+                cursor.close()
+        except (sqlite3.Error, ValueError):
+            return None
+
+    def top(self, limit=20, order="total_ms"):
+        with self._lock:
+            statements = [dict(stats, call_sites=dict(stats["call_sites"]), plan=self._plans.get(sql))
+                          for sql, stats in self._statements.items()]
+        for stats in statements:
+            stats["mean_ms"] = round(stats["total_ms"] / stats["calls"], 3)
+            stats["total_ms"] = round(stats["total_ms"], 3)
+            stats["max_ms"] = round(stats["max_ms"], 3)
+        statements.sort(key=lambda stats: stats[order], reverse=True)
+        return statements[:limit]
+
+    def slow_queries(self):
+        with self._lock:
+            return list(self._slow)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "statements": len(self._statements),
+                "slow_logged": len(self._slow),
+                "untracked_statements": self._dropped,
+                "slow_ms": self.slow_ms,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow.clear()
+            self._plans.clear()
+            self._dropped = 0
+
+
+# Set by db_utils when profiling is switched on
+profiler = None
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    # One statement is "open" from execute() until its rows are exhausted,
+    # the cursor is reused or closed; fetch time counts towards it.
+
+    _open = None  # [sql, params, elapsed_ms, rows, call_site]
+
+    def _finish(self):
+        entry, self._open = self._open, None
+        if entry is not None and profiler is not None:
+            sql, params, elapsed_ms, rows, call_site = entry
+            profiler.record(self.connection, sql, params, elapsed_ms, rows, call_site)
+
+    def _run(self, method, sql, params):
+        self._finish()
+        call_site = _call_site()
+        start = time.perf_counter()
+        try:
+            result = method(sql, params)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+        rows = max(self.rowcount, 0)
+        self._open = [sql, params, elapsed, rows, call_site]
+        if self.description is None:
+            self._finish()  # No result set, nothing left to fetch
+        return result
+
+    def execute(self, sql, params=()):
+        return self._run(super().execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        if not isinstance(seq_of_params, (list, tuple)):
+            seq_of_params = list(seq_of_params)
+        return self._run(super().executemany, sql, seq_of_params)
+
+    def _fetched(self, start, count, exhausted):
+        if self._open is not None:
+            self._open[2] += (time.perf_counter() - start) * 1000
+            self._open[3] += count
+            if exhausted:
+                self._finish()
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0, True)
+            raise
+        self._fetched(start, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Covers the common execute(...).fetchone() on a cursor that is
+        # dropped with rows left unread
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class ProfiledConnection(PooledConnection):
+    """Pooled connection whose statements all run through ProfiledCursor."""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+BLOCK_SIZE = 2048  # App rows multiplied at once in a full build, bounds its memory
+
+
+def available():
+    return np is not None and sparse is not None
+
+
+def _top_k(indices, counts, exclude, k):
+    # The k largest counts, ties going to the smaller app id, without exclude
+    keep = indices != exclude
+    indices, counts = indices[keep], counts[keep]
+    if len(counts) > k:
+        # Cut at the k-th largest count first, everything tied with it stays in the running
+        kth = np.partition(counts, len(counts) - k)[len(counts) - k]
+        keep = counts >= kth
+        indices, counts = indices[keep], counts[keep]
+    order = np.lexsort((indices, -counts))[:k]
+    return indices[order], counts[order]
+
+
+class CoInstallRecommender:
+    """"Users who installed this also installed", top_k apps per app, in memory.
+
+    A full build loads every install into a sparse users x apps matrix U
+    and multiplies U.T @ U block by block: cell (a, b) is the number of
+    users who installed both, and only the top_k of each row are kept.
+
+    Installs and uninstalls passed to record() are applied as deltas on
+    top of U. Every app whose row they change is marked dirty, and a
+    background thread recomputes just those rows every update_interval
+    seconds, with the same exact counts a full build would give.
+    Writes made by other processes are picked up by the full rebuild
+    every rebuild_interval seconds, which also folds the deltas back in.
+
+    load() returns (n_users, n_apps, batches): the matrix shape (largest
+    ids + 1) and an iterable of [(user_id, app_id)] install batches.
+    """
+
+    def __init__(self, load, top_k=20, rebuild_interval=900.0, update_interval=1.0, max_deltas=100000):
+        self.load = load
+        self.top_k = top_k
+        self.rebuild_interval = rebuild_interval
+        self.update_interval = update_interval
+        self.max_deltas = max_deltas  # Rebuild early once this many installs changed
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        # Set by a build: U and its transpose, then per app the neighbour ids
+        # and counts (top_k wide, -1 padded) and how many of them are set
+        self._users = self._apps = None
+        self._neighbors = self._counts = self._lengths = None
+        self._built_at = None
+        self._building = False
+        self._backlog = []  # Events recorded while a build runs, replayed after
+        self._added = {}  # user_id -> {app_id} installed since the build
+        self._removed = {}  # user_id -> {app_id} uninstalled since the build
+        self._dirty = set()
+        self._stats = {
+            "builds": 0,
+            "build_seconds": None,
+            "events": 0,
+            "updates": 0,
+            "rows_updated": 0,
+            "errors": 0,
+        }
+
+    # --- Background thread ---
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            # First use, or we are a forked child and the thread didn't come along
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="recommendations", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with self._lock:
+                    deltas = sum(map(len, self._added.values())) + sum(map(len, self._removed.values()))
+                    due = (self._built_at is None or time.time() - self._built_at >= self.rebuild_interval
+                           or deltas >= self.max_deltas)
+                if due:
+                    self.rebuild()
+                else:
+                    self.update()
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                print(f"Error updating recommendations: {e}")
+            time.sleep(self.update_interval)
+
+    # --- Full build ---
+
+    def rebuild(self):
+        """Recompute everything from load(), then replay events that came in meanwhile."""
+        started = time.perf_counter()
+        with self._lock:
+            self._building = True
+        try:
+            n_users, n_apps, batches = self.load()
+            pairs = [np.array(batch, dtype=np.int64).reshape(-1, 2) for batch in batches]
+            pairs = np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+            users = sparse.csr_matrix(
+                (np.ones(len(pairs), dtype=np.int32), (pairs[:, 0], pairs[:, 1])), shape=(n_users, n_apps))
+            users.sum_duplicates()
+            users.sort_indices()
+            apps = users.T.tocsr()
+
+            neighbors = np.full((n_apps, self.top_k), -1, dtype=np.int32)
+            counts = np.zeros((n_apps, self.top_k), dtype=np.int32)
+            lengths = np.zeros(n_apps, dtype=np.int32)
+            for start in range(0, n_apps, BLOCK_SIZE):
+                block = (apps[start:start + BLOCK_SIZE] @ users).tocsr()
+                self._fill(block, range(start, start + block.shape[0]), neighbors, counts, lengths)
+        except BaseException:
+            with self._lock:
+                self._building = False
+                self._backlog = []
+            raise
+
+        with self._lock:
+            self._users, self._apps = users, apps
+            self._neighbors, self._counts, self._lengths = neighbors, counts, lengths
+            self._added, self._removed, self._dirty = {}, {}, set()
+            self._built_at = time.time()
+            self._building = False
+            backlog, self._backlog = self._backlog, []
+            for event in backlog:
+                self._apply(*event)
+            self._stats["builds"] += 1
+            self._stats["build_seconds"] = round(time.perf_counter() - started, 3)
+
+    def _fill(self, rows, app_ids, neighbors, counts, lengths):
+        # rows: CSR co-install counts, one row per app in app_ids
+        for i, app_id in enumerate(app_ids):
+            start, end = rows.indptr[i], rows.indptr[i + 1]
+            ids, top = _top_k(rows.indices[start:end], rows.data[start:end], app_id, self.top_k)
+            neighbors[app_id, :len(ids)] = ids
+            neighbors[app_id, len(ids):] = -1
+            counts[app_id, :len(ids)] = top
+            counts[app_id, len(ids):] = 0
+            lengths[app_id] = len(ids)
+
+    # --- Incremental updates ---
+
+    def record(self, op, app_id, user_id):
+        """Note a committed install ("install") or uninstall ("uninstall")."""
+        self._ensure_started()
+        with self._lock:
+            self._stats["events"] += 1
+            if self._building or self._users is None:
+                self._backlog.append((op, app_id, user_id))
+            else:
+                self._apply(op, app_id, user_id)
+
+    def _library(self, user_id):
+        # Caller holds self._lock
+        users = self._users
+        base = users.indices[users.indptr[user_id]:users.indptr[user_id + 1]].tolist()
+        removed = self._removed.get(user_id, ())
+        return [app_id for app_id in base if app_id not in removed] + list(self._added.get(user_id, ()))
+
+    def _apply(self, op, app_id, user_id):
+        # Caller holds self._lock. Replays are harmless, an install of an app
+        # the user already has (or uninstall of one they don't) changes nothing.
+        n_users, n_apps = self._users.shape
+        if not (0 <= user_id < n_users and 0 <= app_id < n_apps):
+            return  # Newer than the build, the next one includes it
+        library = self._library(user_id)
+        installed = app_id in library
+        if op == "install" and not installed:
+            if app_id in self._removed.get(user_id, ()):
+                self._removed[user_id].discard(app_id)
+            else:
+                self._added.setdefault(user_id, set()).add(app_id)
+        elif op == "uninstall" and installed:
+            if app_id in self._added.get(user_id, ()):
+                self._added[user_id].discard(app_id)
+            else:
+                self._removed.setdefault(user_id, set()).add(app_id)
+        else:
+            return
+        # Its own row, and the row of every app it is paired with through this user
+        self._dirty.add(app_id)
+        self._dirty.update(library)
+
+    def update(self):
+        """Recompute the rows of dirty apps against U plus the deltas."""
+        with self._lock:
+            if not self._dirty or self._users is None:
+                return
+            dirty = np.array(sorted(self._dirty), dtype=np.int64)
+            self._dirty = set()
+            users, apps = self._users, self._apps
+            entries = [(user_id, app_id, 1) for user_id, added in self._added.items() for app_id in added]
+            entries += [(user_id, app_id, -1) for user_id, removed in self._removed.items() for app_id in removed]
+
+        # Co-install rows of the dirty apps: (A + D).T @ (A + D) restricted to
+        # those rows, with D the +1/-1 deltas, so A itself is never copied
+        if entries:
+            entries = np.array(entries, dtype=np.int64)
+            delta = sparse.csr_matrix((entries[:, 2].astype(np.int32), (entries[:, 0], entries[:, 1])),
+                                      shape=users.shape)
+            selected = apps[dirty] + delta.T.tocsr()[dirty]
+            rows = (selected @ users + selected @ delta).tocsr()
+        else:
+            rows = (apps[dirty] @ users).tocsr()
+        rows.eliminate_zeros()
+
+        with self._lock:
+            if self._users is not users:
+                return  # A rebuild replaced everything meanwhile
+            self._fill(rows, dirty.tolist(), self._neighbors, self._counts, self._lengths)
+            self._stats["updates"] += 1
+            self._stats["rows_updated"] += len(dirty)
+
+    # --- Serving ---
+
+    def similar(self, app_id, limit=None):
+        """[(app_id, common_users)] most co-installed first, or None before the first build."""
+        self._ensure_started()
+        with self._lock:
+            if self._neighbors is None:
+                return None
+            if not 0 <= app_id < len(self._lengths):
+                return []
+            length = int(self._lengths[app_id])
+            if limit is not None:
+                length = min(length, limit)
+            return list(zip(self._neighbors[app_id, :length].tolist(), self._counts[app_id, :length].tolist()))
+
+    @property
+    def built_at(self):
+        return self._built_at
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["ready"] = self._neighbors is not None
+            data["apps"] = 0 if self._users is None else self._users.shape[1]
+            data["installs"] = 0 if self._users is None else int(self._users.nnz)
+            data["dirty"] = len(self._dirty)
+            data["deltas"] = sum(map(len, self._added.values())) + sum(map(len, self._removed.values()))
+            data["built_at"] = self._built_at
+        data["top_k"] = self.top_k
+        return data
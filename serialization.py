@@ -0,0 +1,105 @@
+import gzip
+import os
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# "orjson" (when installed) or "stdlib"
+JSON_ENCODER = os.environ.get("APPSTORE_JSON_ENCODER", "orjson" if orjson is not None else "stdlib")
+# Bodies smaller than this go out uncompressed, the headers would eat the gain
+COMPRESS_MIN_BYTES = int(os.environ.get("APPSTORE_COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4  # Fast settings, this runs on every large response
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/csv", "text/plain"}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson when it is available.
+
+    Output matches the stdlib provider (same key order, same date format),
+    so every jsonify() call in app.py picks it up without changes.
+    """
+
+    encoder = JSON_ENCODER
+
+    def _orjson_options(self, indent=False):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dump_bytes(self, obj, indent=False):
+        if self.encoder == "orjson" and orjson is not None:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._orjson_options(indent))
+            except TypeError:
+                pass  # e.g. integers beyond 64 bits, let the stdlib have a go
+        if indent:
+            return self.dumps(obj, indent=2).encode("utf-8")
+        return self.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if self.encoder == "orjson" and orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dump_bytes(obj, indent) + b"\n", mimetype=self.mimetype)
+
+
+def negotiate_encoding(accept_encodings):
+    """Pick the best encoding we support from an Accept-Encoding header."""
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def encode(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def etag_variants(etag):
+    # A strong ETag names exact bytes, so each encoding gets its own
+    return [etag, f"{etag}-gzip", f"{etag}-br"]
+
+
+def compress_response(response):
+    """after_request hook: compress large bodies the client said it can take."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(encode(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak=weak)
+    return response
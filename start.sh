@@ -9,7 +9,7 @@ docker build -t appstore-backend .
 
 # Run the Docker container in the background
 echo "Starting Flask API in Docker..."
-docker run --rm -p 5000:5000 -v "$(pwd):/app" appstore-backend &
+docker run --rm -p 5000:5000 -v "$(pwd):/app" -e APPSTORE_RELOAD=1 appstore-backend &
 
 # Move to frontend directory
 cd web-app-store
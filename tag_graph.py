@@ -0,0 +1,83 @@
+import json
+from collections import deque
+
+# Tags up to MAX_DISTANCE hops apart are related, weighted DECAY ** distance
+MAX_DISTANCE = 2
+DECAY = 0.5
+
+# table_versions rows: GRAPH_VERSION is bumped by trigger whenever a tag or
+# its similar_tag_ids changes, BUILT_VERSION holds the GRAPH_VERSION that
+# tag_neighbors was last built from (see migrations._tag_neighbors)
+GRAPH_VERSION = "tag_graph"
+BUILT_VERSION = "tag_neighbors"
+
+
+def _similar_ids(value):
+    try:
+        ids = json.loads(value) if value else []
+    except (json.JSONDecodeError, TypeError):
+        return []
+    return [tag for tag in ids if isinstance(tag, str)] if isinstance(ids, list) else []
+
+
+def neighborhoods(similar, max_distance=MAX_DISTANCE, decay=DECAY):
+    """Return [(tag_id, neighbor_id, distance, weight)] for a tag graph.
+
+    similar maps each tag to the tag ids it lists as similar. Edges go both
+    ways: a tag is related to the ones it lists and to the ones listing it.
+    Every tag is its own neighbour at distance 0, weight 1. Ids that aren't
+    keys of similar are walked through but never returned.
+    """
+    edges = {}
+    for tag, ids in similar.items():
+        for other in ids:
+            if other != tag:
+                edges.setdefault(tag, set()).add(other)
+                edges.setdefault(other, set()).add(tag)
+
+    rows = []
+    for tag in similar:
+        distances = {tag: 0}
+        queue = deque([tag])
+        while queue:
+            current = queue.popleft()
+            if distances[current] == max_distance:
+                continue
+            for other in edges.get(current, ()):
+                if other not in distances:
+                    distances[other] = distances[current] + 1
+                    queue.append(other)
+        rows.extend((tag, other, distance, decay ** distance)
+                    for other, distance in distances.items() if other in similar)
+    return rows
+
+
+def _versions(cursor):
+    row = cursor.execute(
+        "SELECT (SELECT version FROM table_versions WHERE name = ?),"
+        " (SELECT version FROM table_versions WHERE name = ?)",
+        (GRAPH_VERSION, BUILT_VERSION)
+    ).fetchone()
+    return row[0], row[1]
+
+
+def is_stale(cursor):
+    graph, built = _versions(cursor)
+    return graph != built
+
+
+def expected_rows(cursor):
+    similar = {tag: _similar_ids(value)
+               for tag, value in cursor.execute("SELECT tag_id, similar_tag_ids FROM tags").fetchall()}
+    return neighborhoods(similar)
+
+
+def rebuild(cursor):
+    """Recompute tag_neighbors from tags and mark it current. Run inside a write transaction."""
+    graph, _ = _versions(cursor)
+    rows = expected_rows(cursor)
+    cursor.execute("DELETE FROM tag_neighbors")
+    cursor.executemany("INSERT INTO tag_neighbors (tag_id, neighbor_id, distance, weight) VALUES (?, ?, ?, ?)",
+                       rows)
+    cursor.execute("UPDATE table_versions SET version = ? WHERE name = ?", (graph, BUILT_VERSION))
+    return len(rows)
@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+
+
+class TopCharts:
+    """Materialized top-N listings, kept in memory and refreshed in the background.
+
+    A chart is the first size rows of one listing, keyed by whatever the
+    loader understands (db_utils uses (category, sort_by, sort_order)).
+    Charts are built the first time they are asked for. From then on a
+    background thread checks version() every max_age / 2 seconds and
+    reloads only the charts whose data changed since they were built.
+
+    page() never serves a chart that wasn't known to be current within
+    the last max_age seconds: if the refresher has fallen behind, the
+    chart is rebuilt inline first. Each page comes with the version the
+    chart was built at and when it was last confirmed current.
+
+    load(key, size) returns a list of rows, or None on a database error.
+    version() returns an opaque string that changes with the data, or None.
+    """
+
+    def __init__(self, load, version, size=100, max_age=5.0, max_charts=256):
+        self.load = load
+        self.version = version
+        self.size = size
+        self.max_age = max_age
+        self.max_charts = max_charts  # Keys past this are not materialized
+
+        self._lock = threading.Lock()
+        self._charts = {}  # key -> (rows, version, refreshed_at)
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            "hits": 0,
+            "builds": 0,        # Built or rebuilt inline by a reader
+            "refreshes": 0,     # Rebuilt by the background thread
+            "checks": 0,
+            "not_materialized": 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            # First use, or we are a forked child and the thread didn't come along
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="top-charts", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.max_age / 2)
+            try:
+                self.refresh()
+            except Exception as e:
+                # Readers rebuild inline once charts age out, keep going
+                print(f"Error refreshing top charts: {e}")
+
+    def _build(self, key):
+        # Version first: a write landing during the load makes the chart look
+        # older than it is, never newer
+        version = self.version()
+        if version is None:
+            return None
+        rows = self.load(key, self.size)
+        if rows is None:
+            return None
+        chart = (rows, version, time.time())
+        with self._lock:
+            if key in self._charts or len(self._charts) < self.max_charts:
+                self._charts[key] = chart
+        return chart
+
+    def refresh(self):
+        """Reload every chart whose data changed, mark the rest as current."""
+        version = self.version()
+        if version is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._stats["checks"] += 1
+            stale = []
+            for key, (rows, chart_version, _) in self._charts.items():
+                if chart_version == version:
+                    self._charts[key] = (rows, chart_version, now)
+                else:
+                    stale.append(key)
+        for key in stale:
+            if self._build(key) is not None:
+                with self._lock:
+                    self._stats["refreshes"] += 1
+
+    def page(self, key, offset, limit):
+        """Return (rows, version, refreshed_at), or None if this can't be served.
+
+        None means the page reaches past the chart, the chart couldn't be
+        built, or too many charts exist already. Rows are shared with
+        other callers, don't modify them.
+        """
+        if not self.enabled or offset < 0 or limit < 0 or offset + limit > self.size:
+            return None
+        self._ensure_started()
+        with self._lock:
+            chart = self._charts.get(key)
+            if chart is not None and time.time() - chart[2] <= self.max_age:
+                self._stats["hits"] += 1
+            else:
+                if chart is None and len(self._charts) >= self.max_charts:
+                    self._stats["not_materialized"] += 1
+                    return None
+                chart = None
+        if chart is None:
+            chart = self._build(key)
+            if chart is None:
+                return None
+            with self._lock:
+                self._stats["builds"] += 1
+        rows, version, refreshed_at = chart
+        return rows[offset:offset + limit], version, refreshed_at
+
+    def clear(self):
+        with self._lock:
+            self._charts.clear()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["charts"] = len(self._charts)
+            oldest = min((chart[2] for chart in self._charts.values()), default=None)
+        data["oldest_age_seconds"] = round(time.time() - oldest, 3) if oldest is not None else None
+        data["size"] = self.size
+        data["max_age"] = self.max_age
+        return data
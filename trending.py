@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# name -> (span, half_life) in hours: events older than span don't count,
+# the rest count 0.5 ** (age / half_life)
+WINDOWS = {
+    "day": (24, 6),
+    "week": (7 * 24, 48),
+}
+
+
+class TrendingApps:
+    """Net installs per app over sliding windows, ranked in the background.
+
+    Counts live in memory in hourly buckets for the last `hours` hours and
+    daily buckets (UTC days) for the `days` days before that. Every
+    refresh_interval seconds a background thread tails new events, folds
+    hourly buckets that aged out into their day, drops days that left the
+    window and re-ranks every window in WINDOWS. top() only slices the
+    ranking, so a lookup costs O(limit) however many apps are active.
+
+    Each bucket counts as if all its events happened at its midpoint,
+    weighted 0.5 ** (age / half_life). Windows no longer than `hours` only
+    use hourly buckets.
+
+    fetch(after_id, since) returns (daily, events): daily is
+    [(day, app_id, downloads)] from `since` (unix time) on, events is
+    [(event_id, app_id, delta, created_at)]. The first call passes
+    after_id=None and wants everything since `since`, later calls only
+    want events past after_id (daily empty). Trimming the log is left to
+    an EventCompactor, which runs whether or not anything is ranked.
+    """
+
+    def __init__(self, fetch, hours=24, days=7, size=100, refresh_interval=5.0, windows=WINDOWS):
+        self.fetch = fetch
+        self.hours = hours
+        self.days = days
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.windows = windows
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._hourly = {}  # hour since the epoch -> {app_id: net installs}
+        self._daily = {}  # day since the epoch -> {app_id: net installs}
+        self._last_id = None  # None until the first load
+        self._rankings = None  # window -> [(app_id, score, net installs)]
+        self._ranked_at = None
+        self._stats = {
+            "events": 0,
+            "refreshes": 0,
+            "errors": 0,
+            "refresh_seconds": None,
+        }
+
+    # --- Background thread ---
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            # First use, or we are a forked child and the thread didn't come along
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="trending", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                print(f"Error updating trending apps: {e}")
+            time.sleep(self.refresh_interval)
+
+    # --- Counting ---
+
+    def _first_day(self, now):
+        return int(now // DAY) - self.days + 1
+
+    def refresh(self, now=None):
+        """Pull new events, age the buckets and re-rank every window."""
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        with self._lock:
+            last_id = self._last_id
+        if last_id is None:
+            daily, events = self.fetch(None, self._first_day(now) * DAY)
+        else:
+            daily, events = self.fetch(last_id, None)
+
+        with self._lock:
+            for day, app_id, downloads in daily:
+                self._add(self._daily, day, app_id, downloads)
+            for event_id, app_id, delta, created_at in events:
+                self._add(self._hourly, int(created_at // HOUR), app_id, delta)
+                self._last_id = max(self._last_id or 0, event_id)
+            if self._last_id is None:
+                self._last_id = 0  # Loaded, the log was just empty
+            self._stats["events"] += len(events)
+            self._age(now)
+            hourly = {hour: dict(counts) for hour, counts in self._hourly.items()}
+            daily = {day: dict(counts) for day, counts in self._daily.items()}
+
+        # Ranked outside the lock on copies, so top() never waits on it
+        rankings = {name: self._rank(hourly, daily, now, span, half_life)
+                    for name, (span, half_life) in self.windows.items()}
+        with self._lock:
+            self._rankings = rankings
+            self._ranked_at = now
+            self._stats["refreshes"] += 1
+            self._stats["refresh_seconds"] = round(time.perf_counter() - started, 4)
+
+    @staticmethod
+    def _add(buckets, key, app_id, delta):
+        counts = buckets.setdefault(key, {})
+        counts[app_id] = counts.get(app_id, 0) + delta
+
+    def _age(self, now):
+        # Caller holds self._lock
+        first_hour = int(now // HOUR) - self.hours + 1
+        for hour in [hour for hour in self._hourly if hour < first_hour]:
+            for app_id, delta in self._hourly.pop(hour).items():
+                self._add(self._daily, hour // 24, app_id, delta)
+        first_day = self._first_day(now)
+        for day in [day for day in self._daily if day < first_day]:
+            del self._daily[day]
+
+    def _rank(self, hourly, daily, now, span, half_life):
+        now_hours = now / HOUR
+        buckets = [(hour + 0.5, counts) for hour, counts in hourly.items()]
+        if span > self.hours:
+            buckets += [(day * 24 + 12, counts) for day, counts in daily.items()]
+        scores, nets = {}, {}
+        for midpoint, counts in buckets:
+            age = max(now_hours - midpoint, 0.0)
+            if age > span:
+                continue
+            weight = 0.5 ** (age / half_life)
+            for app_id, delta in counts.items():
+                scores[app_id] = scores.get(app_id, 0.0) + delta * weight
+                nets[app_id] = nets.get(app_id, 0) + delta
+        ranked = sorted((app_id for app_id, score in scores.items() if score > 0),
+                        key=lambda app_id: (-scores[app_id], app_id))[:self.size]
+        return [(app_id, round(scores[app_id], 3), nets[app_id]) for app_id in ranked]
+
+    # --- Serving ---
+
+    def top(self, window, limit):
+        """[(app_id, score, net installs)] best first, or None before the first load.
+
+        Raises KeyError for a window not in WINDOWS.
+        """
+        if window not in self.windows:
+            raise KeyError(window)
+        self._ensure_started()
+        with self._lock:
+            if self._rankings is None:
+                return None
+            return self._rankings[window][:limit]
+
+    @property
+    def ranked_at(self):
+        return self._ranked_at
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["ready"] = self._rankings is not None
+            data["hour_buckets"] = len(self._hourly)
+            data["day_buckets"] = len(self._daily)
+            data["active_apps"] = len({app_id for buckets in (self._hourly, self._daily)
+                                       for counts in buckets.values() for app_id in counts})
+            data["last_event_id"] = self._last_id
+            data["ranked_at"] = self._ranked_at
+        return data
+
+
+class EventCompactor:
+    """Runs compact() every interval seconds on a background thread.
+
+    compact() trims the download event log and returns how many events it
+    folded away. The log grows on every install, so this has to run in
+    every process that writes, ranked or not: start it when a worker
+    serves its first request, not when trending is. stop() ends the thread
+    after the compaction in progress, if any.
+    """
+
+    def __init__(self, compact, interval=600.0):
+        self.compact = compact
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = None
+        self._stats = {
+            "compactions": 0,
+            "compacted_events": 0,
+            "errors": 0,
+            "compacted_at": None,
+        }
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            # First use, or we are a forked child and the thread didn't come along
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name="event-compaction",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, stop = self._thread, self._stop
+            self._thread = self._stop = None
+        if thread is not None and self._pid == os.getpid():
+            stop.set()
+            thread.join()
+
+    def _run(self, stop):
+        while not stop.wait(self.interval):
+            try:
+                compacted = self.compact()
+                with self._lock:
+                    self._stats["compactions"] += 1
+                    self._stats["compacted_events"] += compacted
+                    self._stats["compacted_at"] = time.time()
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                print(f"Error compacting download events: {e}")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """A bounded LRU map whose entries also expire ttl seconds after being stored.
+
+    Meant for payloads that are expensive to assemble and invalidated by
+    the writes that change them. The TTL bounds how stale an entry can get
+    when the write happened somewhere invalidate() isn't called, such as
+    another worker process.
+
+    Readers guard against racing a writer with a token: take one with
+    token() before reading the source, and put() drops the value if the
+    key was invalidated in between, since what was read may predate the
+    write.
+    """
+
+    def __init__(self, max_entries=1024, ttl=5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._generation = 0
+        self._invalidated = {}  # key -> generation of its last invalidation
+        self._floor = 0  # Tokens older than this are refused, see invalidate()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+            "stale_puts": 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return default
+
+    def token(self):
+        with self._lock:
+            return self._generation
+
+    def put(self, key, value, token):
+        """Store value unless key was invalidated after token was taken."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if token < self._floor or self._invalidated.get(key, 0) > token:
+                self._stats["stale_puts"] += 1
+                return False
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+            self._invalidated[key] = self._generation
+            self._stats["invalidations"] += 1
+            if len(self._invalidated) > 4 * max(self.max_entries, 1):
+                # Forget per-key history, refusing every put that started
+                # before now is the conservative way to stay bounded
+                self._invalidated.clear()
+                self._floor = self._generation
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._invalidated.clear()
+            self._floor = self._generation
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["size"] = len(self._entries)
+        data["max_entries"] = self.max_entries
+        data["ttl"] = self.ttl
+        return data